@@ -1,9 +1,54 @@
 """RAG-агент для ответов на вопросы по документации."""
-from typing import Dict, Any, List, Optional
+import hashlib
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, AsyncIterator
+import numpy as np
+import tiktoken
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
 from loguru import logger
 
+from app.config import settings
 from app.services.rag_service import rag_service
-from app.services.llm_factory import get_llm
+from app.services.llm_factory import get_llm, message_text
+from app.utils.cache import QueryCache
+
+
+_DEBUG_LEVEL = logger.level("DEBUG").no
+
+# Статическая часть промпта вынесена в системное сообщение:
+# она одинакова для всех запросов и кэшируется на стороне провайдера
+_SYSTEM_PROMPT = """Ты - эксперт по продуктам Positive Technologies. Ответь на вопрос пользователя на основе предоставленной документации.
+
+ВАЖНЫЕ ПРАВИЛА:
+1. Отвечай ТОЛЬКО на основе предоставленного контекста
+2. Если информации недостаточно для полного ответа, скажи об этом
+3. Не придумывай информацию, которой нет в контексте
+4. Отвечай на русском языке, четко и структурированно
+5. Если в контексте есть технические детали, включи их в ответ
+6. Укажи конкретные источники, если упоминаешь продукты или функции"""
+
+_SYSTEM_MESSAGE = SystemMessage(content=_SYSTEM_PROMPT)
+
+_CONTEXT_SEPARATOR = "\n---\n"
+
+
+@lru_cache(maxsize=1)
+def _get_encoding() -> Optional[tiktoken.Encoding]:
+    """Загрузка токенизатора (None, если словарь недоступен, например без сети)."""
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"tiktoken encoding unavailable, using approximate token count: {e}")
+        return None
+
+
+def _count_tokens(text: str) -> int:
+    """Подсчет токенов в тексте."""
+    encoding = _get_encoding()
+    if encoding is None:
+        # Грубая оценка: ~4 символа на токен
+        return len(text) // 4
+    return len(encoding.encode(text))
 
 
 class RAGAgent:
@@ -13,6 +58,7 @@ class RAGAgent:
         self.rag_service = None
         self.llm = None
         self._initialized = False
+        self._cache = QueryCache(max_size=512, ttl_seconds=300)
 
     def initialize(self, load_docs: bool = True, docs_directory: str = "./data/docs"):
         """Инициализация RAG-агента.
@@ -41,7 +87,7 @@ class RAGAgent:
             logger.error(f"Failed to initialize RAG Agent: {e}")
             raise
 
-    def answer_question(
+    async def answer_question(
         self,
         question: str,
         top_k: int = 5,
@@ -58,89 +104,126 @@ class RAGAgent:
         Returns:
             Словарь с ответом и метаданными
         """
+        async for event in self.answer_question_stream(question, top_k, min_relevance_score):
+            if event["type"] == "done":
+                return event["result"]
+
+    async def answer_question_stream(
+        self,
+        question: str,
+        top_k: int = 5,
+        min_relevance_score: float = 0.3
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковый ответ на вопрос: источники, затем токены ответа по мере генерации.
+
+        Args:
+            question: Вопрос пользователя
+            top_k: Количество документов для поиска
+            min_relevance_score: Минимальный порог релевантности (0-1)
+
+        Yields:
+            События {"type": "sources", ...}, {"type": "token", "text": ...}
+            и завершающее {"type": "done", "result": ...} с тем же словарем,
+            что возвращает answer_question
+        """
         if not self._initialized:
             self.initialize()
 
+        cache_key = hashlib.sha1(
+            f"{question.strip().lower()}|{top_k}|{min_relevance_score}".encode()
+        ).digest()
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"RAG Agent cache hit for question: {question}")
+            yield {"type": "sources", "sources": cached["sources"]}
+            yield {"type": "token", "text": cached["answer"]}
+            yield {"type": "done", "result": cached}
+            return
+
         try:
             logger.info(f"RAG Agent processing question: {question}")
 
-            # Поиск релевантных документов
-            retrieved_docs = self.rag_service.search(query=question, top_k=top_k)
+            # Поиск релевантных документов: порог релевантности применяется в RAG-сервисе
+            # ChromaDB возвращает distance: для косинусной метрики distance = 1 - cosine_similarity
+            retrieved_docs = await self.rag_service.asearch(
+                query=question,
+                top_k=top_k,
+                max_distance=1.0 - min_relevance_score
+            )
+
+            if not retrieved_docs:
+                # Резервный вариант: используем лучший документ даже если ниже порога
+                retrieved_docs = await self.rag_service.asearch(query=question, top_k=1)
+                if retrieved_docs:
+                    logger.warning(f"No documents passed threshold {min_relevance_score:.2f}, "
+                                  f"using top document as fallback (distance={retrieved_docs[0]['distance']:.2f})")
 
             if not retrieved_docs:
-                return {
+                yield {"type": "done", "result": {
                     "success": False,
                     "answer": "Извините, я не нашел релевантной информации в документации для ответа на ваш вопрос.",
                     "sources": [],
                     "retrieved_chunks": 0
-                }
+                }}
+                return
 
-            # Фильтрация по релевантности
-            # ChromaDB возвращает distance: для косинусной метрики distance = 1 - cosine_similarity
-            # Преобразуем distance в similarity [0, 1], где 1 - идеальное совпадение
-            filtered_docs = []
-
-            logger.info(f"Retrieved {len(retrieved_docs)} documents before filtering")
-
-            for doc in retrieved_docs:
-                distance = doc['distance']
+            logger.info(f"Retrieved {len(retrieved_docs)} documents with min_relevance={min_relevance_score}")
 
-                # Преобразование distance в similarity с ограничением диапазона [0, 1]
-                similarity = max(0.0, min(1.0, 1.0 - distance))
+            # Преобразование distance в similarity с ограничением диапазона [0, 1]
+            distances = np.fromiter(
+                (doc['distance'] for doc in retrieved_docs),
+                dtype=np.float64,
+                count=len(retrieved_docs)
+            )
+            similarities = np.clip(1.0 - distances, 0.0, 1.0)
 
+            for doc, similarity in zip(retrieved_docs, similarities.tolist()):
                 doc['similarity'] = similarity
 
-                logger.debug(f"Document: {doc['metadata'].get('filename', 'unknown')}, "
-                            f"distance={distance:.4f}, similarity={similarity:.4f}")
-
-                if similarity >= min_relevance_score:
-                    filtered_docs.append(doc)
+            if logger._core.min_level <= _DEBUG_LEVEL:
+                for doc in retrieved_docs:
+                    logger.debug("Document: {}, distance={:.4f}, similarity={:.4f}",
+                                 doc['metadata'].get('filename', 'unknown'), doc['distance'], doc['similarity'])
 
-            logger.info(f"Filtered to {len(filtered_docs)}/{len(retrieved_docs)} documents "
-                       f"with min_relevance={min_relevance_score}")
-
-            if not filtered_docs:
-                # Резервный вариант: используем лучший документ даже если ниже порога
-                if retrieved_docs:
-                    logger.warning(f"No documents passed threshold {min_relevance_score:.2f}, "
-                                  f"using top document as fallback (similarity={retrieved_docs[0].get('similarity', 0):.2f})")
-                    filtered_docs = [retrieved_docs[0]]
-                else:
-                    return {
-                        "success": False,
-                        "answer": "Извините, я не нашел релевантной информации в документации для ответа на ваш вопрос.",
-                        "sources": [],
-                        "retrieved_chunks": 0
-                    }
-
-            # Формирование контекста из документов
+            # Формирование контекста из документов в пределах бюджета токенов
+            filtered_docs = self._fit_to_token_budget(retrieved_docs)
             context = self._format_context(filtered_docs)
 
-            # Генерация ответа через LLM
-            answer = self._generate_answer(question, context)
-
             # Извлечение источников
             sources = self._extract_sources(filtered_docs)
+            yield {"type": "sources", "sources": sources}
+
+            # Потоковая генерация ответа через LLM
+            answer_parts = []
+            async for chunk in self.llm.astream(self._build_messages(question, context)):
+                text = message_text(chunk)
+                if text:
+                    answer_parts.append(text)
+                    yield {"type": "token", "text": text}
 
             logger.success(f"Generated answer using {len(filtered_docs)} relevant documents")
 
-            return {
+            result = {
                 "success": True,
-                "answer": answer,
+                "answer": "".join(answer_parts).strip(),
                 "sources": sources,
                 "retrieved_chunks": len(retrieved_docs),
                 "relevant_chunks": len(filtered_docs),
                 "top_similarity": filtered_docs[0]['similarity'] if filtered_docs else 0.0
             }
+            self._cache.set(cache_key, result)
+
+            yield {"type": "done", "result": result}
 
         except Exception as e:
             logger.error(f"Error answering question: {e}")
-            return {
+            yield {"type": "done", "result": {
                 "success": False,
                 "answer": f"Произошла ошибка при обработке вопроса: {str(e)}",
                 "sources": [],
                 "error": str(e)
-            }
+            }}
 
     def _format_context(self, documents: List[Dict[str, Any]]) -> str:
         """
@@ -152,56 +235,66 @@ class RAGAgent:
         Returns:
             Отформатированная строка контекста
         """
-        context_parts = []
-
-        for i, doc in enumerate(documents, 1):
-            source = doc['metadata'].get('filename', 'Unknown')
-            content = doc['content']
-            similarity = doc.get('similarity', 0.0)
-
-            context_parts.append(
-                f"[Документ {i}] (Источник: {source}, Релевантность: {similarity:.2f})\n{content}\n"
-            )
+        return _CONTEXT_SEPARATOR.join(
+            self._format_document(i, doc)
+            for i, doc in enumerate(documents, 1)
+        )
+
+    @staticmethod
+    def _format_document(index: int, doc: Dict[str, Any]) -> str:
+        return (
+            f"[Документ {index}] (Источник: {doc['metadata'].get('filename', 'Unknown')}, "
+            f"Релевантность: {doc.get('similarity', 0.0):.2f})\n{doc['content']}\n"
+        )
+
+    def _fit_to_token_budget(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Отбрасывание наименее релевантных документов, пока контекст не уложится в бюджет.
 
-        return "\n---\n".join(context_parts)
+        Args:
+            documents: Список отфильтрованных документов
 
-    def _generate_answer(self, question: str, context: str) -> str:
+        Returns:
+            Список документов, контекст которых не превышает rag_max_context_tokens
         """
-        Генерация ответа с использованием LLM и контекста.
+        max_tokens = settings.rag_max_context_tokens
+
+        # Каждый документ токенизируется один раз; при отбрасывании его токены
+        # вычитаются из общей суммы (номер документа в заголовке почти не влияет на оценку)
+        separator_tokens = _count_tokens(_CONTEXT_SEPARATOR)
+        doc_tokens = [_count_tokens(self._format_document(i, doc)) for i, doc in enumerate(documents, 1)]
+        total_tokens = sum(doc_tokens) + separator_tokens * max(len(documents) - 1, 0)
+
+        dropped = set()
+        # Порядок отбрасывания: от наименее релевантного
+        for index in sorted(range(len(documents)), key=lambda i: documents[i].get('similarity', 0.0)):
+            if total_tokens <= max_tokens or len(dropped) == len(documents) - 1:
+                break
+
+            weakest = documents[index]
+            dropped.add(index)
+            total_tokens -= doc_tokens[index] + separator_tokens
+            logger.info(f"Context exceeds {max_tokens} tokens, dropped document "
+                       f"{weakest['metadata'].get('filename', 'unknown')} "
+                       f"(similarity={weakest.get('similarity', 0.0):.2f})")
+
+        return [doc for i, doc in enumerate(documents) if i not in dropped]
+
+    def _build_messages(self, question: str, context: str) -> List[BaseMessage]:
+        """
+        Формирование сообщений для LLM из контекста и вопроса.
 
         Args:
             question: Вопрос пользователя
             context: Извлеченный контекст
 
         Returns:
-            Сгенерированный ответ
+            Системное сообщение с правилами и сообщение пользователя
         """
-        prompt = f"""Ты - эксперт по продуктам Positive Technologies. Ответь на вопрос пользователя на основе предоставленной документации.
-
-ВАЖНЫЕ ПРАВИЛА:
-1. Отвечай ТОЛЬКО на основе предоставленного контекста
-2. Если информации недостаточно для полного ответа, скажи об этом
-3. Не придумывай информацию, которой нет в контексте
-4. Отвечай на русском языке, четко и структурированно
-5. Если в контексте есть технические детали, включи их в ответ
-6. Укажи конкретные источники, если упоминаешь продукты или функции
-
-КОНТЕКСТ ИЗ ДОКУМЕНТАЦИИ:
-{context}
-
-ВОПРОС ПОЛЬЗОВАТЕЛЯ:
-{question}
-
-ОТВЕТ:"""
-
-        try:
-            response = self.llm.invoke(prompt)
-            answer = response.content if hasattr(response, 'content') else str(response)
-            return answer.strip()
-
-        except Exception as e:
-            logger.error(f"Error generating answer: {e}")
-            raise
+        return [
+            _SYSTEM_MESSAGE,
+            HumanMessage(content=f"КОНТЕКСТ ИЗ ДОКУМЕНТАЦИИ:\n{context}\n\nВОПРОС ПОЛЬЗОВАТЕЛЯ:\n{question}")
+        ]
 
     def _extract_sources(self, documents: List[Dict[str, Any]]) -> List[str]:
         """
@@ -213,14 +306,7 @@ class RAGAgent:
         Returns:
             Список уникальных источников
         """
-        sources = set()
-
-        for doc in documents:
-            filename = doc['metadata'].get('filename', 'Unknown')
-            source = doc['metadata'].get('source', filename)
-            sources.add(filename)
-
-        return sorted(list(sources))
+        return sorted({doc['metadata'].get('filename', 'Unknown') for doc in documents})
 
     def get_collection_info(self) -> Dict[str, Any]:
         """
@@ -246,6 +332,8 @@ class RAGAgent:
 
         logger.info(f"Reloading documents from {directory}...")
         self.rag_service.load_documents(directory, force_reload=True)
+        # Ответы, построенные на старом индексе, больше не актуальны
+        self._cache.clear()
         logger.success("Documents reloaded successfully")
 
 
@@ -1,10 +1,70 @@
 """Агент-маршрутизатор для классификации запросов и выбора инструментов."""
-import json
-from typing import Dict, Any, List, Optional
+import asyncio
+import re
+from typing import Dict, Any, List, Optional, Tuple
+import orjson
 from loguru import logger
 
-from app.services.llm_factory import get_llm
-from app.prompts.router_prompts import get_router_prompt, get_router_prompt_with_examples
+from app.models.schemas import RoutingDecision, RoutingBatch
+from app.services.llm_factory import get_llm, message_text
+from app.services.rag_service import rag_service
+from app.utils.batching import MicroBatcher
+from app.utils.cache import SemanticCache
+from app.prompts.router_prompts import (
+    get_router_prompt,
+    get_router_prompt_with_examples,
+    get_router_batch_prompt
+)
+
+
+# Разбиение пакетного ответа LLM на части A[i]
+_BATCH_ANSWER_RE = re.compile(r'^\s*A\[(\d+)\]:', re.MULTILINE)
+
+# Первый '{' ... последний '}' в ответе LLM
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Допустимые инструменты маршрутизации
+_VALID_TOOLS = frozenset(("SQL", "RAG", "WEB_SEARCH", "MULTIPLE"))
+_MULTIPLE_SUBSET = frozenset(("SQL", "RAG", "WEB_SEARCH"))
+
+# Ключевые слова для вывода инструментов из запроса
+_SQL_KEYWORDS = frozenset({'сколько', 'кто работает', 'команда', 'разработчик', 'инцидент', 'статистика'})
+_RAG_KEYWORDS = frozenset({'что такое', 'как работает', 'возможности', 'функции', 'описание', 'документация'})
+_WEB_KEYWORDS = frozenset({'новости', 'актуальн', 'тренд', 'последние', 'сейчас'})
+
+# Ключевые слова для резервной маршрутизации
+_FALLBACK_SQL_KEYWORDS = frozenset({'сколько', 'count', 'количество', 'статистика'})
+_FALLBACK_WEB_KEYWORDS = frozenset({'новости', 'news', 'тренд', 'trend'})
+
+
+def _compile_keyword_pattern(routes: Dict[str, frozenset]) -> re.Pattern:
+    """
+    Сборка одного выражения с именованной группой на каждый инструмент.
+
+    Args:
+        routes: Инструмент -> набор ключевых слов
+
+    Returns:
+        Скомпилированное выражение; имя совпавшей группы (lastgroup) - инструмент
+    """
+    # Длинные ключевые слова первыми, чтобы при общем префиксе срабатывало полное совпадение
+    return re.compile("|".join(
+        f"(?P<{tool}>{'|'.join(map(re.escape, sorted(keywords, key=len, reverse=True)))})"
+        for tool, keywords in routes.items()
+    ))
+
+
+_INFER_PATTERN = _compile_keyword_pattern(
+    {"SQL": _SQL_KEYWORDS, "RAG": _RAG_KEYWORDS, "WEB_SEARCH": _WEB_KEYWORDS}
+)
+_FALLBACK_PATTERN = _compile_keyword_pattern(
+    {"SQL": _FALLBACK_SQL_KEYWORDS, "WEB_SEARCH": _FALLBACK_WEB_KEYWORDS}
+)
+
+
+def _match_tools(pattern: re.Pattern, query: str) -> set:
+    """Инструменты, ключевые слова которых встречаются в запросе (один проход по тексту)."""
+    return {m.lastgroup for m in pattern.finditer(query.casefold())}
 
 
 class RouterAgent:
@@ -16,8 +76,14 @@ class RouterAgent:
     - RAG Agent (поиск по документации)
     - Web Search Agent (поиск в интернете)
     - Нескольким агентам (комбинированные запросы)
+
+    Одновременные запросы собираются в пакет в течение BATCH_WINDOW_MS
+    и классифицируются одним вызовом LLM.
     """
 
+    BATCH_WINDOW_MS = 30
+    MAX_BATCH_SIZE = 16
+
     def __init__(self, use_few_shot: bool = True):
         """Инициализация агента-маршрутизатора.
 
@@ -27,6 +93,9 @@ class RouterAgent:
         self.llm = None
         self._initialized = False
         self.use_few_shot = use_few_shot
+        self._sem_cache = SemanticCache(max_size=256, similarity_threshold=0.95)
+        self.batch_llm = None
+        self._batcher = MicroBatcher(self._process_batch, self.BATCH_WINDOW_MS, self.MAX_BATCH_SIZE)
 
     def initialize(self):
         """Инициализация Router Agent."""
@@ -34,7 +103,16 @@ class RouterAgent:
             logger.info("Initializing Router Agent...")
 
             # Получение LLM с temperature=0 для стабильной классификации
-            self.llm = get_llm(temperature=0.0)
+            llm = get_llm(temperature=0.0)
+
+            # Ограничение вывода схемой RoutingDecision, если провайдер это поддерживает
+            try:
+                self.llm = llm.with_structured_output(RoutingDecision)
+                self.batch_llm = llm.with_structured_output(RoutingBatch)
+            except NotImplementedError:
+                logger.warning("LLM does not support structured output, falling back to JSON parsing")
+                self.llm = llm
+                self.batch_llm = llm
 
             self._initialized = True
             logger.success("Router Agent initialized successfully")
@@ -43,7 +121,7 @@ class RouterAgent:
             logger.error(f"Failed to initialize Router Agent: {e}")
             raise
 
-    def route(self, query: str) -> Dict[str, Any]:
+    async def route(self, query: str) -> Dict[str, Any]:
         """
         Маршрутизация запроса к подходящему инструменту.
 
@@ -63,31 +141,34 @@ class RouterAgent:
         if not self._initialized:
             self.initialize()
 
+        # Поиск решения для семантически близкого запроса
+        query_embedding = await self._embed_query(query)
+        if query_embedding is not None:
+            cached_decision = self._sem_cache.get(query_embedding)
+            if cached_decision is not None:
+                logger.info(f"Routing cache hit: tool={cached_decision['tool']}")
+                return dict(cached_decision)
+
         try:
             logger.info(f"Routing query: {query}")
 
-            # Получение промпта
-            if self.use_few_shot:
-                prompt = get_router_prompt_with_examples(query)
-            else:
-                prompt = get_router_prompt(query)
-
-            # Получение ответа от LLM
-            response = self.llm.invoke(prompt)
-            response_text = response.content if hasattr(response, 'content') else str(response)
-
-            # Парсинг JSON-ответа
-            routing_decision = self._parse_routing_response(response_text)
+            # Получение решения от LLM (в составе пакета одновременных запросов)
+            routing_decision = await self._request_decision(query)
 
             # Валидация решения о маршрутизации
             routing_decision = self._validate_routing_decision(routing_decision, query)
 
-            logger.info(
-                f"Routing decision: tool={routing_decision['tool']}, "
-                f"confidence={routing_decision['confidence']:.2f}, "
-                f"reasoning={routing_decision['reasoning'][:100]}..."
+            logger.opt(lazy=True).info(
+                "Routing decision: tool={}, confidence={:.2f}, reasoning={}...",
+                lambda: routing_decision['tool'],
+                lambda: routing_decision['confidence'],
+                lambda: routing_decision['reasoning'][:100]
             )
 
+            # Резервные решения не кэшируются, чтобы не закреплять ошибку LLM
+            if query_embedding is not None and not routing_decision["query_type"].startswith("fallback"):
+                self._sem_cache.set(query_embedding, dict(routing_decision))
+
             return routing_decision
 
         except Exception as e:
@@ -95,6 +176,121 @@ class RouterAgent:
             # Резервный вариант: RAG (наиболее универсальный инструмент)
             return self._fallback_routing(query, str(e))
 
+    async def _request_decision(self, query: str) -> Dict[str, Any]:
+        """
+        Постановка запроса в очередь пакетной классификации и ожидание решения.
+
+        Args:
+            query: Запрос пользователя
+
+        Returns:
+            Нераспарсенное решение о маршрутизации от LLM
+        """
+        return await self._batcher.submit(query)
+
+    async def _process_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """
+        Классификация пакета запросов и передача решений ожидающим вызовам.
+
+        Args:
+            batch: Пары (запрос, future) для разрешения
+        """
+        if not batch:
+            return
+
+        queries = [query for query, _ in batch]
+
+        try:
+            if len(queries) == 1:
+                decisions = [await self._invoke_single(queries[0])]
+            else:
+                logger.info(f"Routing batch of {len(queries)} queries")
+                decisions = await self._invoke_batch(queries)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i < len(decisions) and decisions[i] is not None:
+                future.set_result(decisions[i])
+            else:
+                future.set_exception(ValueError(f"Missing answer A[{i + 1}] in batch routing response"))
+
+    async def _invoke_single(self, query: str) -> Dict[str, Any]:
+        """Классификация одного запроса."""
+        if self.use_few_shot:
+            prompt = get_router_prompt_with_examples(query)
+        else:
+            prompt = get_router_prompt(query)
+
+        response = await self.llm.ainvoke(prompt)
+
+        if isinstance(response, RoutingDecision):
+            return response.model_dump(exclude_none=True)
+
+        # Парсинг JSON-ответа (LLM без поддержки structured output)
+        response_text = message_text(response)
+        return self._parse_routing_response(response_text)
+
+    async def _invoke_batch(self, queries: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Классификация нескольких запросов одним вызовом LLM.
+
+        Args:
+            queries: Запросы пользователей
+
+        Returns:
+            Решения в порядке запросов (None, если ответ для запроса не найден)
+        """
+        prompt = get_router_batch_prompt(queries, with_examples=self.use_few_shot)
+        response = await self.batch_llm.ainvoke(prompt)
+
+        if isinstance(response, RoutingBatch):
+            return [decision.model_dump(exclude_none=True) for decision in response.decisions]
+
+        response_text = message_text(response)
+        parts = _BATCH_ANSWER_RE.split(response_text)
+
+        # parts: [преамбула, номер, ответ, номер, ответ, ...]
+        decisions: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+        for number, answer in zip(parts[1::2], parts[2::2]):
+            index = int(number) - 1
+            if 0 <= index < len(queries):
+                try:
+                    decisions[index] = self._parse_routing_response(answer)
+                except ValueError:
+                    logger.warning(f"Failed to parse batch answer A[{number}]")
+
+        return decisions
+
+    async def _embed_query(self, query: str) -> Optional[List[float]]:
+        """
+        Получение эмбеддинга запроса через embedding-функцию RAG-сервиса.
+
+        Args:
+            query: Запрос пользователя
+
+        Returns:
+            Эмбеддинг запроса или None, если RAG-сервис недоступен
+        """
+        if not rag_service._initialized or rag_service.embedding_function is None:
+            return None
+
+        try:
+            embeddings = await asyncio.to_thread(rag_service.embed_queries, [query])
+            return embeddings[0]
+        except Exception as e:
+            logger.warning(f"Failed to embed query for routing cache: {e}")
+            return None
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Статистика семантического кэша маршрутизации."""
+        return self._sem_cache.stats()
+
     def _parse_routing_response(self, response_text: str) -> Dict[str, Any]:
         """
         Парсинг ответа LLM для извлечения решения о маршрутизации.
@@ -108,31 +304,17 @@ class RouterAgent:
         Raises:
             ValueError: Если ответ не может быть распарсен
         """
-        # Поиск JSON в ответе
-        response_text = response_text.strip()
-
-        # Удаление markdown блоков кода
-        if "```json" in response_text:
-            start = response_text.find("```json") + 7
-            end = response_text.find("```", start)
-            response_text = response_text[start:end].strip()
-        elif "```" in response_text:
-            start = response_text.find("```") + 3
-            end = response_text.find("```", start)
-            response_text = response_text[start:end].strip()
-
-        # Поиск JSON-объекта
-        if not response_text.startswith("{"):
-            # Попытка найти первую {
-            start = response_text.find("{")
-            if start != -1:
-                end = response_text.rfind("}") + 1
-                response_text = response_text[start:end]
+        # Поиск JSON-объекта (в том числе внутри markdown блоков кода)
+        match = _JSON_OBJECT_RE.search(response_text)
+        if not match:
+            logger.error("No JSON object found in routing response")
+            logger.debug(f"Response text: {response_text}")
+            raise ValueError("Invalid JSON response: no JSON object found")
 
         try:
-            routing_decision = json.loads(response_text)
+            routing_decision = orjson.loads(match.group(0))
             return routing_decision
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             logger.error(f"Failed to parse JSON response: {e}")
             logger.debug(f"Response text: {response_text}")
             raise ValueError(f"Invalid JSON response: {e}")
@@ -159,9 +341,8 @@ class RouterAgent:
 
         # Нормализация имени инструмента
         tool = decision["tool"].upper()
-        valid_tools = ["SQL", "RAG", "WEB_SEARCH", "MULTIPLE"]
 
-        if tool not in valid_tools:
+        if tool not in _VALID_TOOLS:
             logger.warning(f"Invalid tool: {tool}, falling back to RAG")
             return self._fallback_routing(query, f"Invalid tool: {tool}")
 
@@ -188,7 +369,7 @@ class RouterAgent:
             # Валидация списка инструментов
             decision["tools"] = [
                 t.upper() for t in decision["tools"]
-                if t.upper() in ["SQL", "RAG", "WEB_SEARCH"]
+                if t.upper() in _MULTIPLE_SUBSET
             ]
 
             if not decision["tools"]:
@@ -207,23 +388,8 @@ class RouterAgent:
         Returns:
             Список выведенных инструментов
         """
-        query_lower = query.lower()
-        tools = []
-
-        # Проверка SQL ключевых слов
-        sql_keywords = ['сколько', 'кто работает', 'команда', 'разработчик', 'инцидент', 'статистика']
-        if any(kw in query_lower for kw in sql_keywords):
-            tools.append("SQL")
-
-        # Проверка RAG ключевых слов
-        rag_keywords = ['что такое', 'как работает', 'возможности', 'функции', 'описание', 'документация']
-        if any(kw in query_lower for kw in rag_keywords):
-            tools.append("RAG")
-
-        # Проверка ключевых слов веб-поиска
-        web_keywords = ['новости', 'актуальн', 'тренд', 'последние', 'сейчас']
-        if any(kw in query_lower for kw in web_keywords):
-            tools.append("WEB_SEARCH")
+        matched = _match_tools(_INFER_PATTERN, query)
+        tools = [tool for tool in ("SQL", "RAG", "WEB_SEARCH") if tool in matched]
 
         # По умолчанию RAG
         if not tools:
@@ -245,10 +411,10 @@ class RouterAgent:
         logger.warning(f"Using fallback routing due to: {error_message}")
 
         # Простая маршрутизация на основе ключевых слов
-        query_lower = query.lower()
+        matched = _match_tools(_FALLBACK_PATTERN, query)
 
         # Проверка явных индикаторов SQL
-        if any(kw in query_lower for kw in ['сколько', 'count', 'количество', 'статистика']):
+        if "SQL" in matched:
             return {
                 "tool": "SQL",
                 "reasoning": f"Fallback routing: query contains SQL keywords. Error: {error_message}",
@@ -257,7 +423,7 @@ class RouterAgent:
             }
 
         # Проверка явных индикаторов веб-поиска
-        if any(kw in query_lower for kw in ['новости', 'news', 'тренд', 'trend']):
+        if "WEB_SEARCH" in matched:
             return {
                 "tool": "WEB_SEARCH",
                 "reasoning": f"Fallback routing: query contains web search keywords. Error: {error_message}",
@@ -273,7 +439,7 @@ class RouterAgent:
             "query_type": "fallback_rag"
         }
 
-    def route_with_context(
+    async def route_with_context(
         self,
         query: str,
         conversation_history: Optional[List[Dict[str, str]]] = None
@@ -289,7 +455,7 @@ class RouterAgent:
             Решение о маршрутизации с учетом контекста
         """
         # TODO: реализовать контекстно-зависимую маршрутизацию
-        return self.route(query)
+        return await self.route(query)
 
     def explain_routing(self, routing_decision: Dict[str, Any]) -> str:
         """
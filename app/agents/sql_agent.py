@@ -1,43 +1,88 @@
 """SQL агент для преобразования естественного языка в SQL."""
-from typing import Dict, Any, Optional, List
-from langchain.chains import create_sql_query_chain
-from langchain_community.utilities import SQLDatabase
-from langchain.prompts import PromptTemplate
+import asyncio
+import hashlib
+import re
+import threading
+from typing import Dict, Any, Optional, List, Tuple
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
 from loguru import logger
 
 from app.services.database_service import db_service
-from app.services.llm_factory import get_llm
+from app.services.llm_factory import get_llm, message_text
+from app.utils.batching import MicroBatcher
+from app.utils.cache import QueryCache
+
+
+# Содержимое блока кода markdown (```sql ... ``` или ``` ... ```)
+_CODE_BLOCK_RE = re.compile(r"```(?:sql\b)?\s*(.*?)\s*(?:```|$)", re.IGNORECASE | re.DOTALL)
+# Первая строка, начинающаяся с SELECT
+_SELECT_LINE_RE = re.compile(r"^\s*(SELECT\b.*?)[\s;]*$", re.IGNORECASE | re.MULTILINE)
+
+# Стоп-последовательности генерации SQL: запрос заканчивается точкой с запятой
+_SQL_STOP = [";"]
+
+# Статический префикс промпта генерации SQL (схема БД подставляется один раз)
+_SQL_SYSTEM_PROMPT_TEMPLATE = """You are a SQL expert. Given the database schema below, write a SQL query to answer the user's question.
+
+{db_info}
+
+Output only one valid SELECT statement ending with ';', no explanations. Use table and column names exactly as in the schema. Use JOIN/WHERE/GROUP BY as needed."""
+
+_FORMAT_RESULTS_SYSTEM_MESSAGE = SystemMessage(content="""Based on the query results provided by the user, provide a clear and concise answer to the user's question.
+
+Provide a natural language answer that directly addresses the question. Be specific with numbers and names.
+Answer in Russian if the question is in Russian, otherwise in English.""")
 
 
 class SQLAgent:
-    """Агент для преобразования запросов на естественном языке в SQL."""
+    """Агент для преобразования запросов на естественном языке в SQL.
+
+    Одновременные асинхронные запросы генерации SQL собираются в пакет
+    в течение BATCH_WINDOW_MS и отправляются в LLM одним вызовом abatch.
+    """
+
+    BATCH_WINDOW_MS = 25
+    MAX_BATCH_SIZE = 8
 
     def __init__(self):
         self.llm = None
         self.db_info = None
+        self._system_message = None
         self._initialized = False
+        self._init_lock = threading.Lock()
+        self._sql_cache = QueryCache(max_size=512, ttl_seconds=3600)
+        self._answer_cache = QueryCache(max_size=512, ttl_seconds=300)
+        self._batcher = MicroBatcher(self._process_batch, self.BATCH_WINDOW_MS, self.MAX_BATCH_SIZE)
 
     def initialize(self):
-        """Инициализация SQL-агента."""
-        try:
-            logger.info("Initializing SQL Agent...")
+        """Инициализация SQL-агента (потокобезопасна, повторные вызовы игнорируются)."""
+        if self._initialized:
+            return
 
-            # Инициализация сервиса БД
-            if not db_service._initialized:
-                db_service.initialize()
+        with self._init_lock:
+            # Повторная проверка: агент мог быть инициализирован другим потоком
+            if self._initialized:
+                return
 
-            # Получение LLM с низкой температурой для SQL
-            self.llm = get_llm(temperature=0.0)
+            try:
+                logger.info("Initializing SQL Agent...")
 
-            # Получение схемы БД
-            self.db_info = db_service.get_table_info_for_llm()
+                # Инициализация сервиса БД
+                if not db_service._initialized:
+                    db_service.initialize()
 
-            self._initialized = True
-            logger.success("SQL Agent initialized successfully")
+                # Получение LLM с низкой температурой для SQL
+                self.llm = get_llm(temperature=0.0)
 
-        except Exception as e:
-            logger.error(f"Failed to initialize SQL Agent: {e}")
-            raise
+                # Получение схемы БД и построение статического префикса промпта
+                self._get_system_message()
+
+                self._initialized = True
+                logger.success("SQL Agent initialized successfully")
+
+            except Exception as e:
+                logger.error(f"Failed to initialize SQL Agent: {e}")
+                raise
 
     def generate_sql(self, question: str) -> str:
         """
@@ -52,10 +97,25 @@ class SQLAgent:
         if not self._initialized:
             self.initialize()
 
+        cache_key = self._sql_cache_key(question)
+        cached = self._sql_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"SQL cache hit: {cached}")
+            return cached
+
         try:
             prompt = self._create_sql_prompt(question)
-            response = self.llm.invoke(prompt)
-            sql_query = self._extract_sql(response.content if hasattr(response, 'content') else str(response))
+
+            # Потоковая генерация с остановкой после конца запроса:
+            # пояснения модели после SQL не декодируются
+            parts = []
+            for chunk in self.llm.stream(prompt, stop=_SQL_STOP):
+                parts.append(message_text(chunk))
+                if self._is_sql_complete("".join(parts)):
+                    break
+
+            sql_query = self._extract_sql("".join(parts))
+            self._sql_cache.set(cache_key, sql_query)
 
             logger.info(f"Generated SQL: {sql_query}")
             return sql_query
@@ -64,48 +124,146 @@ class SQLAgent:
             logger.error(f"Error generating SQL: {e}")
             raise
 
-    def _create_sql_prompt(self, question: str) -> str:
-        prompt = f"""You are a SQL expert. Given the database schema below, write a SQL query to answer the user's question.
+    async def agenerate_sql(self, question: str) -> str:
+        """
+        Асинхронная версия generate_sql.
 
-{self.db_info}
+        Args:
+            question: Вопрос на естественном языке
 
-Rules:
-1. Only use SELECT statements
-2. Use proper JOINs when querying multiple tables
-3. Use appropriate WHERE clauses for filtering
-4. Use GROUP BY for aggregations
-5. Return only the SQL query without any explanations
-6. Start the query with SELECT and end with semicolon
-7. Use table and column names exactly as shown in the schema
+        Returns:
+            Сгенерированный SQL запрос
+        """
+        if not self._initialized:
+            self.initialize()
 
-Question: {question}
+        cache_key = self._sql_cache_key(question)
+        cached = self._sql_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"SQL cache hit: {cached}")
+            return cached
+
+        try:
+            sql_query = await self._request_sql(question)
+            self._sql_cache.set(cache_key, sql_query)
 
-SQL Query:"""
-        return prompt
+            logger.info(f"Generated SQL: {sql_query}")
+            return sql_query
+
+        except Exception as e:
+            logger.error(f"Error generating SQL: {e}")
+            raise
+
+    async def _request_sql(self, question: str) -> str:
+        """
+        Постановка вопроса в очередь пакетной генерации SQL и ожидание результата.
+
+        Args:
+            question: Вопрос на естественном языке
+
+        Returns:
+            Сгенерированный SQL запрос
+        """
+        return await self._batcher.submit(question)
+
+    async def _process_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        """
+        Генерация SQL для пакета вопросов и передача результатов ожидающим вызовам.
+
+        Args:
+            batch: Пары (вопрос, future) для разрешения
+        """
+        if not batch:
+            return
+
+        questions = [question for question, _ in batch]
+
+        try:
+            if len(questions) == 1:
+                # Одиночный запрос: потоковая генерация с ранней остановкой
+                texts = [await self._astream_sql(questions[0])]
+            else:
+                logger.info(f"Generating SQL for batch of {len(questions)} questions")
+                responses = await self.llm.abatch(
+                    [self._create_sql_prompt(question) for question in questions],
+                    stop=_SQL_STOP
+                )
+                texts = [
+                    message_text(response)
+                    for response in responses
+                ]
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, (_, future) in zip(texts, batch):
+            if not future.done():
+                future.set_result(self._extract_sql(text))
+
+    async def _astream_sql(self, question: str) -> str:
+        parts = []
+        async for chunk in self.llm.astream(self._create_sql_prompt(question), stop=_SQL_STOP):
+            parts.append(message_text(chunk))
+            if self._is_sql_complete("".join(parts)):
+                break
+
+        return "".join(parts)
+
+    def _refresh_db_info(self) -> str:
+        """
+        Актуальное описание схемы БД.
+
+        get_table_info_for_llm перепроверяет отпечаток схемы не чаще раза
+        в db_schema_check_ttl_seconds; после миграции описание меняется,
+        и системное сообщение строится заново.
+
+        Returns:
+            Описание схемы для промпта
+        """
+        db_info = db_service.get_table_info_for_llm()
+        if db_info != self.db_info:
+            self.db_info = db_info
+            self._system_message = None
+        return db_info
+
+    def _sql_cache_key(self, question: str) -> tuple:
+        # Схема БД входит в ключ: при ее изменении старые запросы не используются
+        return hash(self._refresh_db_info()), " ".join(question.lower().split())
+
+    def _get_system_message(self) -> SystemMessage:
+        """Системное сообщение со схемой БД и правилами (перестраивается при изменении схемы)."""
+        self._refresh_db_info()
+        if self._system_message is None:
+            self._system_message = SystemMessage(
+                content=_SQL_SYSTEM_PROMPT_TEMPLATE.format(db_info=self.db_info)
+            )
+        return self._system_message
+
+    def _create_sql_prompt(self, question: str) -> List[BaseMessage]:
+        return [
+            self._get_system_message(),
+            HumanMessage(content=f"Question: {question}\n\nSQL Query:")
+        ]
+
+    def _is_sql_complete(self, text: str) -> bool:
+        """Проверка, что в накопленном ответе уже есть конец SQL запроса."""
+        return ";" in text or text.count("```") >= 2
 
     def _extract_sql(self, response: str) -> str:
         # Удаление markdown блоков кода
-        if "```sql" in response:
-            start = response.find("```sql") + 6
-            end = response.find("```", start)
-            sql = response[start:end].strip()
-        elif "```" in response:
-            start = response.find("```") + 3
-            end = response.find("```", start)
-            sql = response[start:end].strip()
-        else:
-            sql = response.strip()
+        match = _CODE_BLOCK_RE.search(response)
+        sql = match.group(1) if match else response
 
         # Удаление завершающей точки с запятой (добавим позже)
-        sql = sql.rstrip(";").strip()
+        sql = sql.strip().rstrip(";").strip()
 
         # Проверка что запрос начинается с SELECT
-        if not sql.upper().startswith("SELECT"):
-            lines = sql.split("\n")
-            for line in lines:
-                if line.strip().upper().startswith("SELECT"):
-                    sql = line.strip()
-                    break
+        if not sql[:6].upper() == "SELECT":
+            match = _SELECT_LINE_RE.search(sql)
+            if match:
+                sql = match.group(1)
 
         return sql
 
@@ -129,28 +287,45 @@ SQL Query:"""
 
         try:
             sql_query = self.generate_sql(question)
+            return self._run_sql(sql_query, validate)
 
-            if validate:
-                is_valid, error_msg = db_service.validate_query(sql_query)
-                if not is_valid:
-                    logger.warning(f"Generated invalid SQL: {error_msg}")
-                    return {
-                        "success": False,
-                        "error": error_msg,
-                        "sql_query": sql_query,
-                        "results": []
-                    }
-
-            results = db_service.execute_query(sql_query)
-            logger.success(f"Query executed successfully, returned {len(results)} rows")
-
+        except Exception as e:
+            logger.error(f"Error executing query: {e}")
             return {
-                "success": True,
-                "sql_query": sql_query,
-                "results": results,
-                "row_count": len(results)
+                "success": False,
+                "error": str(e),
+                "sql_query": None,
+                "results": []
             }
 
+    async def execute_and_format(
+        self,
+        question: str,
+        validate: bool = True,
+        max_rows: int = 10,
+        explain: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Генерация SQL, выполнение и форматирование ответа за один асинхронный проход.
+
+        Args:
+            question: Вопрос на естественном языке
+            validate: Валидировать сгенерированный SQL
+            max_rows: Максимум строк в резюме
+            explain: Формулировать ответ через LLM (False - только таблица результатов)
+
+        Returns:
+            Словарь как у execute_query, дополненный ключом "answer" при успехе
+        """
+        if not self._initialized:
+            self.initialize()
+
+        try:
+            sql_query = await self.agenerate_sql(question)
+
+            # Валидация и выполнение запроса к БД - в отдельном потоке
+            result = await asyncio.to_thread(self._run_sql, sql_query, validate)
+
         except Exception as e:
             logger.error(f"Error executing query: {e}")
             return {
@@ -160,11 +335,39 @@ SQL Query:"""
                 "results": []
             }
 
+        if result["success"]:
+            result["answer"] = await self.aformat_results(result["results"], question, max_rows, explain)
+
+        return result
+
+    def _run_sql(self, sql_query: str, validate: bool) -> Dict[str, Any]:
+        if validate:
+            is_valid, error_msg = db_service.validate_query(sql_query)
+            if not is_valid:
+                logger.warning(f"Generated invalid SQL: {error_msg}")
+                return {
+                    "success": False,
+                    "error": error_msg,
+                    "sql_query": sql_query,
+                    "results": []
+                }
+
+        results = db_service.execute_query(sql_query)
+        logger.success(f"Query executed successfully, returned {len(results)} rows")
+
+        return {
+            "success": True,
+            "sql_query": sql_query,
+            "results": results,
+            "row_count": len(results)
+        }
+
     def format_results(
         self,
         results: List[Dict[str, Any]],
         question: str,
-        max_rows: int = 10
+        max_rows: int = 10,
+        explain: bool = True
     ) -> str:
         """
         Форматирование результатов запроса в читаемый текст.
@@ -173,6 +376,7 @@ SQL Query:"""
             results: Результаты запроса
             question: Исходный вопрос
             max_rows: Максимум строк в резюме
+            explain: Формулировать ответ через LLM (False - только таблица результатов)
 
         Returns:
             Отформатированная строка
@@ -180,34 +384,155 @@ SQL Query:"""
         if not results:
             return "Запрос не вернул результатов."
 
-        display_results = results[:max_rows]
-        total_rows = len(results)
+        # Тривиальный результат (например, COUNT(*)) оформляется без вызова LLM
+        direct_answer = self._format_without_llm(results, max_rows, explain)
+        if direct_answer is not None:
+            return direct_answer
 
         if not self._initialized:
             self.initialize()
 
+        cache_key = self._answer_cache_key(results, question, max_rows)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
-            results_text = "\n".join([str(row) for row in display_results])
+            response = self.llm.invoke(self._build_format_messages(results, question, max_rows))
+            answer = message_text(response)
+            answer = answer.strip()
+            self._answer_cache.set(cache_key, answer)
+            return answer
 
-            prompt = f"""Based on the following query results, provide a clear and concise answer to the user's question.
+        except Exception as e:
+            logger.error(f"Error formatting results: {e}")
+            return self._fallback_format(results, max_rows)
 
-Question: {question}
+    async def aformat_results(
+        self,
+        results: List[Dict[str, Any]],
+        question: str,
+        max_rows: int = 10,
+        explain: bool = True
+    ) -> str:
+        """
+        Асинхронная версия format_results.
 
-Results ({total_rows} total rows, showing first {len(display_results)}):
-{results_text}
+        Args:
+            results: Результаты запроса
+            question: Исходный вопрос
+            max_rows: Максимум строк в резюме
+            explain: Формулировать ответ через LLM (False - только таблица результатов)
 
-Provide a natural language answer that directly addresses the question. Be specific with numbers and names.
-Answer in Russian if the question is in Russian, otherwise in English.
+        Returns:
+            Отформатированная строка
+        """
+        if not results:
+            return "Запрос не вернул результатов."
+
+        # Тривиальный результат (например, COUNT(*)) оформляется без вызова LLM
+        direct_answer = self._format_without_llm(results, max_rows, explain)
+        if direct_answer is not None:
+            return direct_answer
 
-Answer:"""
+        cache_key = self._answer_cache_key(results, question, max_rows)
+        cached = self._answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-            response = self.llm.invoke(prompt)
-            answer = response.content if hasattr(response, 'content') else str(response)
-            return answer.strip()
+        try:
+            response = await self.llm.ainvoke(self._build_format_messages(results, question, max_rows))
+            answer = message_text(response)
+            answer = answer.strip()
+            self._answer_cache.set(cache_key, answer)
+            return answer
 
         except Exception as e:
             logger.error(f"Error formatting results: {e}")
-            return f"Найдено {total_rows} записей. Первые результаты:\n{results_text}"
+            return self._fallback_format(results, max_rows)
+
+    def _answer_cache_key(
+        self,
+        results: List[Dict[str, Any]],
+        question: str,
+        max_rows: int
+    ) -> bytes:
+        # Ответ зависит от вопроса и показанных LLM строк результата
+        return hashlib.sha1(
+            f"{' '.join(question.lower().split())}|{len(results)}|{results[:max_rows]}".encode()
+        ).digest()
+
+    def _build_format_messages(
+        self,
+        results: List[Dict[str, Any]],
+        question: str,
+        max_rows: int
+    ) -> List[BaseMessage]:
+        display_results = results[:max_rows]
+        results_text = self._render_rows(display_results)
+
+        return [
+            _FORMAT_RESULTS_SYSTEM_MESSAGE,
+            HumanMessage(content=f"""Question: {question}
+
+Results ({len(results)} total rows, showing first {len(display_results)}):
+{results_text}
+
+Answer:""")
+        ]
+
+    def _render_rows(self, rows: List[Dict[str, Any]]) -> str:
+        """
+        Компактное табличное представление строк: заголовок один раз, значения через табуляцию.
+
+        Args:
+            rows: Строки результата запроса
+
+        Returns:
+            Таблица в формате TSV
+        """
+        if not rows:
+            return ""
+
+        columns = list(rows[0].keys())
+        lines = ["\t".join(columns)]
+        lines.extend(
+            "\t".join(self._render_value(row.get(column)) for column in columns)
+            for row in rows
+        )
+        return "\n".join(lines)
+
+    @staticmethod
+    def _render_value(value: Any) -> str:
+        # Округление длинных дробей, чтобы не тратить токены на лишние знаки.
+        # Дробные части сохраняют 4 значащие цифры (3e-05 не превращается в 0.0),
+        # целые части не переводятся в экспоненциальную запись
+        if isinstance(value, float):
+            if abs(value) < 1:
+                return f"{value:.4g}"
+            return str(round(value, 4))
+        return str(value)
+
+    def _format_without_llm(
+        self,
+        results: List[Dict[str, Any]],
+        max_rows: int,
+        explain: bool
+    ) -> Optional[str]:
+        if not explain:
+            return self._fallback_format(results, max_rows)
+
+        if len(results) == 1 and len(results[0]) <= 3:
+            row = results[0]
+            if len(row) == 1:
+                return f"Ответ: {self._render_value(next(iter(row.values())))}"
+            return ", ".join(f"{column}: {self._render_value(value)}" for column, value in row.items())
+
+        return None
+
+    def _fallback_format(self, results: List[Dict[str, Any]], max_rows: int) -> str:
+        results_text = self._render_rows(results[:max_rows])
+        return f"Найдено {len(results)} записей. Первые результаты:\n{results_text}"
 
 
 # Глобальный экземпляр SQL агента
@@ -1,9 +1,28 @@
 """Агент веб-поиска для поиска информации в интернете."""
-from typing import Dict, Any, List
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage
 from loguru import logger
 
+from app.config import settings
 from app.services.search_service import search_service
-from app.services.llm_factory import get_llm
+from app.services.llm_factory import get_llm, message_text
+
+
+# Статические правила промптов вынесены в системные сообщения:
+# они одинаковы для всех запросов и кэшируются на стороне провайдера
+_ANSWER_SYSTEM_MESSAGE = SystemMessage(content="""Ты - помощник, который отвечает на вопросы пользователя на основе результатов поиска в интернете.
+
+Отвечай по-русски, четко и структурированно, ТОЛЬКО по результатам поиска, ничего не придумывай. Называй сайты-источники и, если важно, даты публикаций. Если данных мало или источники противоречат друг другу - скажи об этом.""")
+
+_NEWS_SYSTEM_MESSAGE = SystemMessage(content="""Ты - новостной аналитик. Создай краткую сводку новостей по запросу пользователя.
+
+Кратко по пунктам, по-русски: ключевые факты, цифры и даты публикаций из предоставленных новостей с указанием изданий.""")
+
+
+_SEARCH_UNAVAILABLE = "Веб-поиск недоступен. Не настроен API ключ для Tavily. Получите ключ на https://tavily.com/"
+_NEWS_UNAVAILABLE = "Поиск новостей недоступен. Не настроен API ключ для Tavily."
+_NOT_FOUND = "К сожалению, я не нашел релевантной информации в интернете по вашему запросу."
 
 
 class WebSearchAgent:
@@ -13,32 +32,44 @@ class WebSearchAgent:
         self.search_service = None
         self.llm = None
         self._initialized = False
+        self._init_lock = threading.Lock()
+        # Порог релевантности, начиная с которого AI-сводка Tavily отдается без LLM
+        self.direct_answer_threshold = settings.search_direct_answer_threshold
 
     def initialize(self):
-        """Инициализация агента веб-поиска."""
-        try:
-            logger.info("Initializing Web Search Agent...")
+        """Инициализация агента веб-поиска (потокобезопасна, повторные вызовы игнорируются)."""
+        if self._initialized:
+            return
 
-            # Инициализация поискового сервиса
-            if not search_service._initialized:
-                search_service.initialize()
-            self.search_service = search_service
+        with self._init_lock:
+            # Повторная проверка: агент мог быть инициализирован другим потоком
+            if self._initialized:
+                return
 
-            # Получение LLM с низкой температурой для фактических ответов
-            self.llm = get_llm(temperature=0.3)
+            try:
+                logger.info("Initializing Web Search Agent...")
 
-            self._initialized = True
-            logger.success("Web Search Agent initialized successfully")
+                # Инициализация поискового сервиса
+                if not search_service._initialized:
+                    search_service.initialize()
+                self.search_service = search_service
 
-        except Exception as e:
-            logger.error(f"Failed to initialize Web Search Agent: {e}")
-            raise
+                # Получение LLM с низкой температурой для фактических ответов
+                self.llm = get_llm(temperature=0.3)
+
+                self._initialized = True
+                logger.success("Web Search Agent initialized successfully")
+
+            except Exception as e:
+                logger.error(f"Failed to initialize Web Search Agent: {e}")
+                raise
 
     def search_and_answer(
         self,
         question: str,
         max_results: int = 5,
-        search_depth: str = "basic"
+        search_depth: str = "basic",
+        min_score: Optional[float] = None
     ) -> Dict[str, Any]:
         """
         Поиск в интернете и генерация ответа.
@@ -47,72 +78,42 @@ class WebSearchAgent:
             question: Вопрос пользователя
             max_results: Максимальное количество результатов
             search_depth: "basic" или "advanced"
+            min_score: Минимальная релевантность результата (по умолчанию settings.search_min_score)
 
         Returns:
             Словарь с ответом и метаданными
         """
-        if not self._initialized:
-            self.initialize()
-
-        if not self.search_service._initialized:
-            return {
-                "success": False,
-                "answer": "Веб-поиск недоступен. Не настроен API ключ для Tavily. Получите ключ на https://tavily.com/",
-                "sources": [],
-                "search_results": []
-            }
+        if not self._ensure_ready():
+            return self._failure(_SEARCH_UNAVAILABLE, search_results=[])
 
         try:
             logger.info(f"Web Search Agent processing question: {question}")
 
-            # Выполнение поиска
             search_results = self.search_service.search(
                 query=question,
                 max_results=max_results,
                 search_depth=search_depth
             )
 
-            if not search_results:
-                return {
-                    "success": False,
-                    "answer": "К сожалению, я не нашел релевантной информации в интернете по вашему запросу.",
-                    "sources": [],
-                    "search_results": []
-                }
-
-            # Форматирование контекста из результатов
-            context = self._format_search_context(search_results)
-
-            # Генерация ответа через LLM
-            answer = self._generate_answer(question, context, search_results)
+            result, messages = self._prepare_answer(question, search_results, min_score)
+            if messages is not None:
+                try:
+                    result["answer"] = message_text(self.llm.invoke(messages)).strip()
+                except Exception as e:
+                    result["answer"] = self._fallback_answer(search_results, e)
 
-            # Извлечение источников
-            sources = self._extract_sources(search_results)
-
-            logger.success(f"Generated answer using {len(search_results)} search results")
-
-            return {
-                "success": True,
-                "answer": answer,
-                "sources": sources,
-                "search_results": len(search_results),
-                "top_score": search_results[0].get("score", 0) if search_results else 0
-            }
+            return result
 
         except Exception as e:
             logger.error(f"Error in web search: {e}")
-            return {
-                "success": False,
-                "answer": f"Произошла ошибка при поиске в интернете: {str(e)}",
-                "sources": [],
-                "error": str(e)
-            }
+            return self._failure(f"Произошла ошибка при поиске в интернете: {str(e)}", error=str(e))
 
     def search_news(
         self,
         query: str,
         max_results: int = 5,
-        days: int = 7
+        days: int = 7,
+        min_score: Optional[float] = None
     ) -> Dict[str, Any]:
         """
         Поиск последних новостей и генерация сводки.
@@ -121,184 +122,324 @@ class WebSearchAgent:
             query: Поисковый запрос
             max_results: Максимальное количество результатов
             days: Поиск за последние N дней
+            min_score: Минимальная релевантность результата (по умолчанию settings.search_min_score)
 
         Returns:
             Словарь со сводкой новостей и источниками
         """
-        if not self._initialized:
-            self.initialize()
-
-        if not self.search_service._initialized:
-            return {
-                "success": False,
-                "answer": "Поиск новостей недоступен. Не настроен API ключ для Tavily.",
-                "sources": []
-            }
+        if not self._ensure_ready():
+            return self._failure(_NEWS_UNAVAILABLE)
 
         try:
             logger.info(f"Searching news for: {query}")
 
-            # Поиск новостей
             news_results = self.search_service.search_news(
                 query=query,
                 max_results=max_results,
                 days=days
             )
 
-            if not news_results:
-                return {
-                    "success": False,
-                    "answer": f"Не найдено новостей по запросу '{query}' за последние {days} дней.",
-                    "sources": []
-                }
+            result, messages = self._prepare_news(query, news_results, days, min_score)
+            if messages is not None:
+                result["answer"] = message_text(self.llm.invoke(messages)).strip()
+
+            return result
+
+        except Exception as e:
+            logger.error(f"Error in news search: {e}")
+            return self._failure(f"Произошла ошибка при поиске новостей: {str(e)}", error=str(e))
+
+    async def asearch_and_answer(
+        self,
+        question: str,
+        max_results: int = 5,
+        search_depth: str = "basic",
+        min_score: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Асинхронная версия search_and_answer."""
+        if not self._ensure_ready():
+            return self._failure(_SEARCH_UNAVAILABLE, search_results=[])
+
+        try:
+            logger.info(f"Web Search Agent processing question: {question}")
+
+            search_results = await self.search_service.asearch(
+                query=question,
+                max_results=max_results,
+                search_depth=search_depth
+            )
+
+            result, messages = self._prepare_answer(question, search_results, min_score)
+            if messages is not None:
+                try:
+                    result["answer"] = message_text(await self.llm.ainvoke(messages)).strip()
+                except Exception as e:
+                    result["answer"] = self._fallback_answer(search_results, e)
+
+            return result
 
-            # Форматирование контекста
-            context = self._format_search_context(news_results)
+        except Exception as e:
+            logger.error(f"Error in web search: {e}")
+            return self._failure(f"Произошла ошибка при поиске в интернете: {str(e)}", error=str(e))
+
+    async def asearch_news(
+        self,
+        query: str,
+        max_results: int = 5,
+        days: int = 7,
+        min_score: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """Асинхронная версия search_news."""
+        if not self._ensure_ready():
+            return self._failure(_NEWS_UNAVAILABLE)
 
-            # Генерация сводки новостей
-            answer = self._generate_news_summary(query, context, news_results)
+        try:
+            logger.info(f"Searching news for: {query}")
 
-            # Извлечение источников
-            sources = self._extract_sources(news_results)
+            news_results = await self.search_service.asearch_news(
+                query=query,
+                max_results=max_results,
+                days=days
+            )
 
-            logger.success(f"Generated news summary from {len(news_results)} articles")
+            result, messages = self._prepare_news(query, news_results, days, min_score)
+            if messages is not None:
+                result["answer"] = message_text(await self.llm.ainvoke(messages)).strip()
 
-            return {
-                "success": True,
-                "answer": answer,
-                "sources": sources,
-                "articles_found": len(news_results)
-            }
+            return result
 
         except Exception as e:
             logger.error(f"Error in news search: {e}")
-            return {
-                "success": False,
-                "answer": f"Произошла ошибка при поиске новостей: {str(e)}",
-                "sources": [],
-                "error": str(e)
-            }
-
-    def _format_search_context(self, results: List[Dict[str, Any]]) -> str:
+            return self._failure(f"Произошла ошибка при поиске новостей: {str(e)}", error=str(e))
+
+    def _ensure_ready(self) -> bool:
+        """Ленивая инициализация агента; False, если поисковый сервис не настроен."""
+        if not self._initialized:
+            self.initialize()
+        return self.search_service._initialized
+
+    @staticmethod
+    def _failure(answer: str, **extra: Any) -> Dict[str, Any]:
+        return {"success": False, "answer": answer, "sources": [], **extra}
+
+    def _prepare_answer(
+        self,
+        question: str,
+        search_results: List[Dict[str, Any]],
+        min_score: Optional[float]
+    ) -> Tuple[Dict[str, Any], Optional[List[BaseMessage]]]:
         """
-        Форматирование результатов поиска в контекст для LLM.
+        Подготовка ответа по результатам поиска до вызова LLM.
 
         Args:
-            results: Результаты поиска
+            question: Вопрос пользователя
+            search_results: Результаты поиска
+            min_score: Минимальная релевантность результата
 
         Returns:
-            Отформатированная строка контекста
+            Кортеж (результат, сообщения для LLM). Если сообщения None, результат
+            окончательный; иначе поле answer заполняет вызывающий код ответом LLM
         """
-        context_parts = []
+        if not search_results:
+            return self._failure(_NOT_FOUND, search_results=[]), None
+
+        # Отбрасывание малорелевантных результатов
+        search_results = self._select_relevant(search_results, min_score)
+        logger.info(f"Answering from {len(search_results)} search results")
+
+        result = {
+            "success": True,
+            "answer": None,
+            "sources": [],
+            "search_results": len(search_results),
+            "top_score": search_results[0].get("score", 0)
+        }
+
+        # Уверенная AI-сводка Tavily используется как ответ без вызова LLM
+        answer = self._direct_answer(search_results)
+        if answer is not None:
+            result["answer"] = answer
+            result["sources"] = self._extract_sources(search_results)
+            return result, None
+
+        # Контекст и источники - за один проход
+        context, result["sources"] = self._format_and_extract(search_results)
+        return result, self._build_answer_messages(question, context)
+
+    def _prepare_news(
+        self,
+        query: str,
+        news_results: List[Dict[str, Any]],
+        days: int,
+        min_score: Optional[float]
+    ) -> Tuple[Dict[str, Any], Optional[List[BaseMessage]]]:
+        """
+        Подготовка сводки новостей до вызова LLM.
 
-        # Добавление AI-сводки Tavily, если доступна
-        if results and "tavily_answer" in results[0]:
-            context_parts.append(f"AI Summary: {results[0]['tavily_answer']}\n")
+        Args:
+            query: Поисковый запрос
+            news_results: Результаты поиска новостей
+            days: Период поиска в днях (для сообщения об отсутствии новостей)
+            min_score: Минимальная релевантность результата
 
-        # Добавление отдельных результатов
-        for i, result in enumerate(results, 1):
-            context_parts.append(
-                f"[Источник {i}] {result['title']}\n"
-                f"URL: {result['url']}\n"
-                f"Содержание: {result['content']}\n"
-                f"Релевантность: {result['score']:.2f}\n"
-            )
+        Returns:
+            Кортеж (результат, сообщения для LLM); см. _prepare_answer
+        """
+        if not news_results:
+            return self._failure(f"Не найдено новостей по запросу '{query}' за последние {days} дней."), None
+
+        news_results = self._select_relevant(news_results, min_score)
+        logger.info(f"Summarizing {len(news_results)} news articles")
+
+        context, sources = self._format_and_extract(news_results)
+        result = {
+            "success": True,
+            "answer": None,
+            "sources": sources,
+            "articles_found": len(news_results)
+        }
+        return result, self._build_news_messages(query, context)
+
+    @staticmethod
+    def _fallback_answer(search_results: List[Dict[str, Any]], error: Exception) -> str:
+        """
+        Резервный ответ при ошибке LLM: AI-сводка Tavily, если она есть.
+
+        Args:
+            search_results: Результаты поиска (AI-сводка хранится в первом)
+            error: Ошибка генерации ответа
 
-        return "\n---\n".join(context_parts)
+        Returns:
+            Ответ на основе AI-сводки; без нее ошибка пробрасывается дальше
+        """
+        logger.error(f"Error generating answer: {error}")
+        tavily_answer = search_results[0].get("tavily_answer")
+        if tavily_answer:
+            return f"На основе поиска: {tavily_answer}"
+        raise error
 
-    def _generate_answer(
+    def _select_relevant(
         self,
-        question: str,
-        context: str,
-        search_results: List[Dict[str, Any]]
-    ) -> str:
+        results: List[Dict[str, Any]],
+        min_score: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
         """
-        Генерация ответа с использованием LLM и результатов поиска.
+        Отбор результатов поиска с релевантностью не ниже порога.
 
         Args:
-            question: Вопрос пользователя
-            context: Отформатированный контекст поиска
-            search_results: Сырые результаты поиска
+            results: Результаты поиска (непустые)
+            min_score: Минимальная релевантность (по умолчанию settings.search_min_score)
 
         Returns:
-            Сгенерированный ответ
+            Отфильтрованные результаты; лучший результат сохраняется,
+            даже если он ниже порога
         """
-        # Проверка наличия AI-ответа от Tavily
-        tavily_answer = search_results[0].get("tavily_answer", "") if search_results else ""
+        if min_score is None:
+            min_score = settings.search_min_score
 
-        prompt = f"""Ты - помощник, который отвечает на вопросы пользователя на основе результатов поиска в интернете.
+        selected = [result for result in results if result.get("score", 0) >= min_score]
+        if not selected:
+            selected = [max(results, key=lambda result: result.get("score", 0))]
 
-ВАЖНЫЕ ПРАВИЛА:
-1. Отвечай ТОЛЬКО на основе предоставленных результатов поиска
-2. Указывай источники информации (упоминай названия сайтов)
-3. Если информации недостаточно для полного ответа, скажи об этом
-4. Не придумывай информацию, которой нет в результатах поиска
-5. Отвечай на русском языке, четко и структурированно
-6. Если есть противоречия в источниках, укажи на это
-7. Укажи дату публикации, если это важно (для новостей)
+        if len(selected) < len(results):
+            logger.info(f"Dropped {len(results) - len(selected)} search results "
+                       f"with score below {min_score:.2f}")
 
-РЕЗУЛЬТАТЫ ПОИСКА:
-{context}
+            # AI-сводка Tavily хранится в первом результате - переносим ее
+            tavily_answer = results[0].get("tavily_answer")
+            if tavily_answer and "tavily_answer" not in selected[0]:
+                selected[0] = {**selected[0], "tavily_answer": tavily_answer}
 
-ВОПРОС ПОЛЬЗОВАТЕЛЯ:
-{question}
+        return selected
 
-ОТВЕТ:"""
+    def _direct_answer(self, results: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        AI-сводка Tavily в качестве готового ответа, если лучший результат достаточно релевантен.
 
-        try:
-            response = self.llm.invoke(prompt)
-            answer = response.content if hasattr(response, 'content') else str(response)
-            return answer.strip()
+        Args:
+            results: Отобранные результаты поиска
 
-        except Exception as e:
-            logger.error(f"Error generating answer: {e}")
-            # Резервный вариант: использовать ответ Tavily
-            if tavily_answer:
-                return f"На основе поиска: {tavily_answer}"
-            raise
+        Returns:
+            Ответ или None, если нужна генерация через LLM
+        """
+        top = results[0]
+        tavily_answer = top.get("tavily_answer")
+
+        if tavily_answer and top.get("score", 0) >= self.direct_answer_threshold:
+            logger.info(f"Using Tavily answer directly (top score={top.get('score', 0):.2f})")
+            return tavily_answer.strip()
 
-    def _generate_news_summary(
+        return None
+
+    def _format_search_context(
         self,
-        query: str,
-        context: str,
-        news_results: List[Dict[str, Any]]
+        results: List[Dict[str, Any]],
+        snippet_chars: Optional[int] = None
     ) -> str:
         """
-        Генерация сводки новостей с использованием LLM.
+        Форматирование результатов поиска в контекст для LLM.
 
         Args:
-            query: Поисковый запрос
-            context: Отформатированный контекст новостей
-            news_results: Результаты поиска новостей
+            results: Результаты поиска
+            snippet_chars: Максимальная длина содержания одного результата
+                (по умолчанию settings.search_snippet_chars)
 
         Returns:
-            Сводка новостей
+            Отформатированная строка контекста
         """
-        prompt = f"""Ты - новостной аналитик. Создай краткую сводку новостей по запросу пользователя.
+        context, _ = self._format_and_extract(results, snippet_chars)
+        return context
 
-ПРАВИЛА:
-1. Суммируй основные новости из предоставленных источников
-2. Укажи даты публикации, если они есть
-3. Упомяни ключевые факты и цифры
-4. Структурируй ответ по пунктам
-5. Отвечай на русском языке
-6. Укажи источники (названия изданий)
+    def _format_and_extract(
+        self,
+        results: List[Dict[str, Any]],
+        snippet_chars: Optional[int] = None
+    ) -> Tuple[str, List[str]]:
+        """
+        Форматирование контекста для LLM и извлечение источников за один проход.
 
-НОВОСТИ:
-{context}
+        Args:
+            results: Результаты поиска
+            snippet_chars: Максимальная длина содержания одного результата
+                (по умолчанию settings.search_snippet_chars)
 
-ЗАПРОС ПОЛЬЗОВАТЕЛЯ: {query}
+        Returns:
+            Кортеж (строка контекста, список источников)
+        """
+        if snippet_chars is None:
+            snippet_chars = settings.search_snippet_chars
 
-СВОДКА:"""
+        context_parts = []
+        sources = []
 
-        try:
-            response = self.llm.invoke(prompt)
-            answer = response.content if hasattr(response, 'content') else str(response)
-            return answer.strip()
+        # Добавление AI-сводки Tavily, если доступна
+        if results and "tavily_answer" in results[0]:
+            context_parts.append(f"AI Summary: {results[0]['tavily_answer']}\n")
 
-        except Exception as e:
-            logger.error(f"Error generating news summary: {e}")
-            raise
+        for i, result in enumerate(results, 1):
+            url = result['url']
+            context_parts.append(
+                f"[Источник {i}] {result['title']}\n"
+                f"URL: {url}\n"
+                f"Содержание: {(result['content'] or '')[:snippet_chars]}\n"
+                f"Релевантность: {result['score']:.2f}\n"
+            )
+            if url:
+                sources.append(f"{result.get('title', '')} ({url})")
+
+        return "\n---\n".join(context_parts), sources
+
+    def _build_answer_messages(self, question: str, context: str) -> List[BaseMessage]:
+        return [
+            _ANSWER_SYSTEM_MESSAGE,
+            HumanMessage(content=f"РЕЗУЛЬТАТЫ ПОИСКА:\n{context}\n\nВОПРОС ПОЛЬЗОВАТЕЛЯ:\n{question}\n\nОТВЕТ:")
+        ]
+
+    def _build_news_messages(self, query: str, context: str) -> List[BaseMessage]:
+        return [
+            _NEWS_SYSTEM_MESSAGE,
+            HumanMessage(content=f"НОВОСТИ:\n{context}\n\nЗАПРОС ПОЛЬЗОВАТЕЛЯ: {query}\n\nСВОДКА:")
+        ]
 
     def _extract_sources(self, results: List[Dict[str, Any]]) -> List[str]:
         """
@@ -310,14 +451,11 @@ class WebSearchAgent:
         Returns:
             Список URL источников
         """
-        sources = []
-        for result in results:
-            url = result.get("url", "")
-            title = result.get("title", "")
-            if url:
-                sources.append(f"{title} ({url})")
-
-        return sources
+        return [
+            f"{result.get('title', '')} ({result['url']})"
+            for result in results
+            if result.get("url")
+        ]
 
 
 # Глобальный экземпляр агента веб-поиска
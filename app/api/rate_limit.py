@@ -0,0 +1,132 @@
+"""Ограничение нагрузки: частота запросов по IP (token bucket) и число одновременных запросов."""
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+import orjson
+from loguru import logger
+
+
+class RateLimitMiddleware:
+    """
+    Ограничение частоты запросов к дорогим эндпоинтам по IP клиента.
+
+    Каждому IP соответствует корзина на burst токенов, пополняемая со скоростью
+    rate токенов в секунду. Запрос без свободного токена отклоняется с 429 до
+    вызова эндпоинта: тело не читается, сессия не создается, агенты не вызываются.
+    """
+
+    MAX_CLIENTS = 10000
+
+    def __init__(self, app, rate: float, burst: int, path_prefixes: Tuple[str, ...]):
+        """
+        Args:
+            app: Оборачиваемое ASGI-приложение
+            rate: Скорость пополнения корзины (запросов в секунду)
+            burst: Емкость корзины (допустимый всплеск запросов)
+            path_prefixes: Префиксы путей, к которым применяется ограничение
+        """
+        self.app = app
+        self.rate = rate
+        self.burst = burst
+        self.path_prefixes = path_prefixes
+        # IP -> (доступные токены, время последнего обновления); давно неактивные IP вытесняются
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        client = scope.get("client")
+        client_ip = client[0] if client else "unknown"
+
+        retry_after = self._acquire(client_ip)
+        if retry_after is None:
+            await self.app(scope, receive, send)
+            return
+
+        logger.warning(f"Rate limit exceeded for {client_ip} on {scope['path']}")
+
+        # Тело в формате ErrorResponse без построения Pydantic-модели
+        body = orjson.dumps({
+            "error": "Too Many Requests",
+            "detail": f"Rate limit exceeded, retry after {retry_after:.2f}s",
+            "timestamp": datetime.now(timezone.utc)
+        })
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(math.ceil(retry_after)).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    def _acquire(self, client_ip: str) -> Optional[float]:
+        """
+        Списание токена из корзины клиента.
+
+        Args:
+            client_ip: IP-адрес клиента
+
+        Returns:
+            None, если запрос разрешен, иначе время в секундах до появления токена
+        """
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(client_ip, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+
+        retry_after = None
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / self.rate
+
+        self._buckets[client_ip] = (tokens, now)
+        while len(self._buckets) > self.MAX_CLIENTS:
+            self._buckets.popitem(last=False)
+
+        return retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    Ограничение числа одновременно обрабатываемых запросов без очереди ожидания.
+
+    При исчерпании лимита запрос отклоняется сразу (503), а не ждет в очереди:
+    уже принятые запросы сохраняют латентность, клиент повторяет позже.
+    Счетчик меняется только в event loop без await между проверкой и
+    увеличением, поэтому блокировка не нужна.
+    """
+
+    def __init__(self, limit: int):
+        """
+        Args:
+            limit: Максимальное количество одновременных запросов
+        """
+        self.limit = limit
+        self.in_flight = 0
+
+    @property
+    def saturated(self) -> bool:
+        return self.in_flight >= self.limit
+
+    def try_acquire(self) -> bool:
+        """
+        Занятие слота.
+
+        Returns:
+            True, если слот занят; False, если лимит исчерпан
+        """
+        if self.saturated:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        """Освобождение слота, занятого try_acquire."""
+        self.in_flight -= 1
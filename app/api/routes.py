@@ -1,10 +1,21 @@
 """API роуты для LLM Assistant."""
-from fastapi import APIRouter, HTTPException, status
-from typing import Dict, List
+import asyncio
+import bisect
+import copy
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+
+import orjson
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from loguru import logger
 
+from app.api.rate_limit import ConcurrencyLimiter
+from app.api.responses import ORJSONResponse
 from app.models.schemas import (
     ChatRequest,
     ChatResponse,
@@ -15,25 +26,139 @@ from app.models.schemas import (
     ErrorResponse,
     Message,
     MessageRole,
-    ToolUsage,
     ToolType,
     EvaluateRequest,
     EvaluateResponse,
+    EvaluationJob,
+    EvaluationStatus,
     RoutingInfo,
-    MetricScore
+    MetricScore,
+    RAGDebugBatchRequest
 )
 from app.config import settings
-from app.agents.sql_agent import sql_agent
-from app.agents.rag_agent import rag_agent
-from app.agents.web_search_agent import web_search_agent
 from app.services.orchestrator_service import orchestrator
+from app.services.history_service import history_service
+from app.services.response_cache import response_cache
+from app.utils.cache import QueryCache
+
+try:
+    # DeepEval тянет за собой тяжелые зависимости: импортируем один раз при загрузке модуля
+    from deepeval.metrics import AnswerRelevancyMetric, FaithfulnessMetric
+    from deepeval.test_case import LLMTestCase
+    DEEPEVAL_AVAILABLE = True
+except ImportError:
+    DEEPEVAL_AVAILABLE = False
+    logger.warning("DeepEval package not available, /evaluate is disabled. Install with: pip install deepeval")
+
+router = APIRouter(
+    prefix="/api/v1",
+    tags=["api"],
+    # Схема тел ошибок для OpenAPI; сами обработчики возвращают готовые словари
+    responses={
+        422: {"model": ErrorResponse},
+        500: {"model": ErrorResponse}
+    }
+)
+
+# Метаданные ответа чата не меняются между запросами
+_RESPONSE_METADATA = {
+    "model": settings.llm_model,
+    "provider": settings.llm_provider
+}
+
+# Поиск значения ToolType по строке без вызова Enum.__call__; неизвестные - NONE
+_TOOL_TYPES = {tool.value: tool for tool in ToolType}
+
+# Back-pressure: ограничение одновременных запросов /chat и /chat/stream
+_chat_limiter = ConcurrencyLimiter(settings.chat_max_concurrency)
+
+# Тестовый поиск /rag/stats по ETag индекса; сбрасывается при /rag/reload
+_rag_stats_cache = QueryCache(max_size=1, ttl_seconds=30)
+
+
+def _build_tools_used(result: Dict[str, Any], query: str) -> List[Dict[str, Any]]:
+    """
+    Конвертация tools_used и решения роутера из результата оркестратора в формат ToolUsage.
+
+    Args:
+        result: Результат OrchestratorService.process_query
+        query: Исходное сообщение пользователя
+
+    Returns:
+        Список словарей с полями ToolUsage (решение роутера первым)
+    """
+    tools_used = []
+
+    # Добавление решения роутера в метаданные
+    routing_decision = result.get("routing_decision", {})
+    if routing_decision:
+        tools_used.append({
+            "tool_type": ToolType.ROUTER.value,
+            "query": query,
+            "result_summary": f"Routing: {routing_decision.get('tool', 'UNKNOWN')}",
+            "reasoning": routing_decision.get("reasoning"),
+            "confidence": routing_decision.get("confidence"),
+            "metadata": {
+                "tool": routing_decision.get("tool"),
+                "query_type": routing_decision.get("query_type"),
+                "tools": routing_decision.get("tools", [])
+            }
+        })
+
+    for tool_usage in result.get("tools_used", []):
+        # Нормализация tool_type к lowercase для соответствия ToolType enum
+        raw_tool_type = tool_usage.get("tool_type", "none")
+        if isinstance(raw_tool_type, str):
+            raw_tool_type = raw_tool_type.lower()
+
+        tools_used.append({
+            "tool_type": _TOOL_TYPES.get(raw_tool_type, ToolType.NONE).value,
+            "query": tool_usage.get("query"),
+            "result_summary": tool_usage.get("result_summary"),
+            "reasoning": None,
+            "confidence": None,
+            "metadata": tool_usage.get("metadata")
+        })
+
+    return tools_used
+
+
+def _chat_payload(result: Dict[str, Any], query: str, session_id: str) -> Dict[str, Any]:
+    """
+    Тело ответа чата в формате ChatResponse без построения Pydantic-моделей.
+
+    Args:
+        result: Результат OrchestratorService.process_query
+        query: Исходное сообщение пользователя
+        session_id: Идентификатор сессии
+
+    Returns:
+        Словарь с полями ChatResponse
+    """
+    sources = result.get("sources", [])
+    return {
+        "message": result.get("answer", "Не удалось обработать запрос."),
+        "session_id": session_id,
+        "tools_used": _build_tools_used(result, query),
+        "sources": sources if sources else None,
+        "metadata": _RESPONSE_METADATA
+    }
 
-router = APIRouter(prefix="/api/v1", tags=["api"])
 
-# Временное хранилище истории чата в памяти
-# TODO: Заменить на постоянное хранилище (Redis или БД)
-chat_history: Dict[str, List[Message]] = {}
-feedback_storage: List[Dict] = []
+@lru_cache(maxsize=None)
+def _rag_agent():
+    """Ленивый импорт RAG-агента: ChromaDB загружается при первом обращении к /rag."""
+    from app.agents.rag_agent import rag_agent
+    return rag_agent
+
+
+def _elapsed(started_at: datetime, started: float) -> datetime:
+    """Время ответа: одна отметка wall-clock на запрос плюс монотонная длительность обработки."""
+    return started_at + timedelta(seconds=time.monotonic() - started)
+
+
+def _sse_event(event: Dict[str, Any]) -> bytes:
+    return b"data: " + orjson.dumps(event) + b"\n\n"
 
 
 @router.get("/health", response_model=HealthResponse)
@@ -56,83 +181,105 @@ async def chat(request: ChatRequest):
 
     Принимает сообщения пользователя и возвращает AI-ответы.
     Агент автоматически выбирает подходящие инструменты (RAG, SQL, Веб-поиск).
+    Ответ сериализуется напрямую через orjson; ChatResponse описывает схему для OpenAPI.
+    При CHAT_MAX_CONCURRENCY одновременных запросах новые отклоняются с 503.
     """
+    if not _chat_limiter.try_acquire():
+        raise _server_busy()
+
     try:
-        session_id = request.session_id or str(uuid.uuid4())
+        return ORJSONResponse(await _process_chat(request))
+    finally:
+        _chat_limiter.release()
+
+
+def _server_busy() -> HTTPException:
+    """Ответ 503 при исчерпании лимита одновременных запросов чата."""
+    logger.warning(f"Chat concurrency limit reached ({_chat_limiter.limit} in flight)")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server is busy, retry later",
+        headers={"Retry-After": "1"}
+    )
+
+
+async def _run_query(
+    query: str,
+    conversation_history: Optional[List[Dict[str, str]]] = None
+) -> Dict[str, Any]:
+    """
+    Обработка запроса оркестратором без записи в историю.
+
+    Args:
+        query: Запрос пользователя
+        conversation_history: История беседы (None - запрос без истории)
+
+    Returns:
+        Результат OrchestratorService.process_query
+    """
+    use_history = conversation_history is not None
+
+    # Семантический кэш только для запросов без истории: ответ с историей
+    # зависит от контекста конкретной сессии
+    result = None if use_history else await response_cache.get(query)
+
+    if result is None:
+        # Обработка запроса через Orchestrator (с Router Agent)
+        result = await orchestrator.process_query(
+            query=query,
+            use_history=use_history,
+            conversation_history=conversation_history
+        )
+        if not use_history:
+            await response_cache.put(query, result)
+
+    return result
+
+
+async def _process_chat(request: ChatRequest) -> Dict[str, Any]:
+    """
+    Обработка сообщения чата.
+
+    Args:
+        request: Запрос чата
 
-        if session_id not in chat_history:
-            chat_history[session_id] = []
+    Returns:
+        Тело ответа в формате ChatResponse
+    """
+    try:
+        started = time.monotonic()
+        started_at = datetime.now(timezone.utc)
+        session_id = request.session_id or uuid.uuid4().hex
 
         user_message = Message(
             role=MessageRole.USER,
             content=request.message,
-            timestamp=datetime.now()
+            timestamp=started_at
         )
-        chat_history[session_id].append(user_message)
+        await history_service.append_message(session_id, user_message)
 
-        # Обработка запроса через Orchestrator (с Router Agent)
-        result = await orchestrator.process_query(
-            query=request.message,
-            use_history=request.use_history,
-            conversation_history=[
-                {"role": msg.role.value, "content": msg.content}
-                for msg in chat_history[session_id]
-            ] if request.use_history else None
-        )
+        conversation_history = None
+        if request.use_history:
+            conversation_history = await history_service.get_conversation(
+                session_id,
+                limit=settings.history_window
+            )
+
+        result = await _run_query(request.message, conversation_history)
 
-        response_text = result.get("answer", "Не удалось обработать запрос.")
-        sources = result.get("sources", [])
-
-        # Конвертация tools_used в модели ToolUsage
-        tools_used = []
-        for tool_usage in result.get("tools_used", []):
-            # Нормализация tool_type к lowercase для соответствия ToolType enum
-            raw_tool_type = tool_usage.get("tool_type", "none")
-            if isinstance(raw_tool_type, str):
-                raw_tool_type = raw_tool_type.lower()
-
-            tools_used.append(ToolUsage(
-                tool_type=ToolType(raw_tool_type),
-                query=tool_usage.get("query"),
-                result_summary=tool_usage.get("result_summary"),
-                metadata=tool_usage.get("metadata")
-            ))
-
-        # Добавление решения роутера в метаданные
-        routing_decision = result.get("routing_decision", {})
-        if routing_decision:
-            tools_used.insert(0, ToolUsage(
-                tool_type=ToolType.ROUTER,
-                query=request.message,
-                result_summary=f"Routing: {routing_decision.get('tool', 'UNKNOWN')}",
-                reasoning=routing_decision.get("reasoning"),
-                confidence=routing_decision.get("confidence"),
-                metadata={
-                    "tool": routing_decision.get("tool"),
-                    "query_type": routing_decision.get("query_type"),
-                    "tools": routing_decision.get("tools", [])
-                }
-            ))
+        payload = _chat_payload(result, request.message, session_id)
 
         assistant_message = Message(
             role=MessageRole.ASSISTANT,
-            content=response_text,
-            timestamp=datetime.now()
-        )
-        chat_history[session_id].append(assistant_message)
-
-        logger.info(f"Chat request processed for session {session_id}")
-
-        return ChatResponse(
-            message=response_text,
-            session_id=session_id,
-            tools_used=tools_used,
-            sources=sources if sources else None,
-            metadata={
-                "model": settings.llm_model,
-                "provider": settings.llm_provider
-            }
+            content=payload["message"],
+            timestamp=_elapsed(started_at, started)
         )
+        await history_service.append_message(session_id, assistant_message)
+
+        # Ленивое форматирование: при уровне INFO и выше строка не строится
+        logger.debug("Chat request processed for session {}", session_id)
+
+        return payload
 
     except Exception as e:
         logger.error(f"Error processing chat request: {e}")
@@ -142,6 +289,82 @@ async def chat(request: ChatRequest):
         )
 
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Потоковый чат-эндпоинт через Server-Sent Events.
+
+    События: session (идентификатор сессии), routing (решение роутера),
+    sources и token (фрагменты ответа по мере генерации), done (итоговый ответ
+    в формате ChatResponse). Ответ сохраняется в историю и при обрыве соединения.
+    """
+    if _chat_limiter.saturated:
+        raise _server_busy()
+
+    started = time.monotonic()
+    started_at = datetime.now(timezone.utc)
+    session_id = request.session_id or uuid.uuid4().hex
+
+    async def event_stream():
+        # Слот занимается в генераторе: finally освобождает его, даже если клиент отключился
+        if not _chat_limiter.try_acquire():
+            yield _sse_event({"type": "error", "detail": "Server is busy, retry later"})
+            return
+
+        answer_parts = []
+        final_answer = None
+        try:
+            # Сообщение пользователя сохраняется только для принятого запроса
+            user_message = Message(
+                role=MessageRole.USER,
+                content=request.message,
+                timestamp=started_at
+            )
+            await history_service.append_message(session_id, user_message)
+
+            conversation_history = None
+            if request.use_history:
+                conversation_history = await history_service.get_conversation(
+                    session_id,
+                    limit=settings.history_window
+                )
+
+            yield _sse_event({"type": "session", "session_id": session_id})
+
+            async for event in orchestrator.process_query_stream(
+                request.message,
+                use_history=request.use_history,
+                conversation_history=conversation_history
+            ):
+                if event["type"] == "token":
+                    answer_parts.append(event["text"])
+                    yield _sse_event(event)
+                elif event["type"] == "done":
+                    payload = _chat_payload(event["result"], request.message, session_id)
+                    final_answer = payload["message"]
+                    yield _sse_event({"type": "done", "response": payload})
+                else:
+                    yield _sse_event(event)
+
+        except Exception as e:
+            logger.error(f"Error processing streaming chat request: {e}")
+            yield _sse_event({"type": "error", "detail": f"Error processing request: {str(e)}"})
+
+        finally:
+            _chat_limiter.release()
+            content = final_answer if final_answer is not None else "".join(answer_parts)
+            if content:
+                assistant_message = Message(
+                    role=MessageRole.ASSISTANT,
+                    content=content,
+                    timestamp=_elapsed(started_at, started)
+                )
+                await history_service.append_message(session_id, assistant_message)
+                logger.debug("Streaming chat request processed for session {}", session_id)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @router.post("/feedback", response_model=FeedbackResponse)
 async def submit_feedback(request: FeedbackRequest):
     try:
@@ -150,11 +373,11 @@ async def submit_feedback(request: FeedbackRequest):
             "message_id": request.message_id,
             "rating": request.rating,
             "comment": request.comment,
-            "timestamp": datetime.now()
+            "timestamp": datetime.now(timezone.utc)
         }
-        feedback_storage.append(feedback_entry)
+        await history_service.add_feedback(feedback_entry)
 
-        logger.info(f"Feedback received for session {request.session_id}: rating {request.rating}")
+        logger.debug("Feedback received for session {}: rating {}", request.session_id, request.rating)
 
         return FeedbackResponse(
             success=True,
@@ -170,28 +393,70 @@ async def submit_feedback(request: FeedbackRequest):
 
 
 @router.get("/history/{session_id}", response_model=ChatHistory)
-async def get_history(session_id: str):
-    """Получение истории чата для сессии."""
-    if session_id not in chat_history:
+async def get_history(
+    session_id: str,
+    limit: int = Query(100, ge=1, le=1000),
+    before: Optional[datetime] = None,
+    before_offset: int = Query(0, ge=0)
+):
+    """
+    Получение истории чата для сессии постранично, от новых сообщений к старым.
+
+    Args:
+        session_id: Идентификатор сессии
+        limit: Максимальное количество сообщений на странице
+        before: Вернуть сообщения раньше этого момента (next_before предыдущей страницы)
+        before_offset: Сколько сообщений с меткой времени ровно before тоже вернуть
+            (next_before_offset предыдущей страницы); курсор (before, before_offset)
+            не пропускает сообщения с совпадающими timestamps и не сдвигается
+            при добавлении новых сообщений или обрезке старых
+
+    Returns:
+        ChatHistory со страницей сообщений в хронологическом порядке
+    """
+    messages = await history_service.get_messages(session_id)
+    if messages is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Session {session_id} not found"
         )
 
-    messages = chat_history[session_id]
+    end = len(messages)
+    if before is not None:
+        if before.tzinfo is None:
+            before = before.replace(tzinfo=timezone.utc)
+        # Сообщения хранятся в порядке добавления, их timestamps не убывают
+        first_equal = bisect.bisect_left(messages, before, key=_message_timestamp)
+        after_equal = bisect.bisect_right(messages, before, lo=first_equal, key=_message_timestamp)
+        end = min(first_equal + before_offset, after_equal)
+
+    start = max(0, end - limit)
+    page = messages[start:end]
+
+    next_before = next_before_offset = None
+    if start > 0:
+        next_before = page[0].timestamp
+        # Позиция первого сообщения страницы среди сообщений с той же меткой времени
+        next_before_offset = start - bisect.bisect_left(messages, next_before, hi=start, key=_message_timestamp)
 
     return ChatHistory(
         session_id=session_id,
-        messages=messages,
-        total_messages=len(messages)
+        messages=page,
+        total_messages=len(messages),
+        has_more=start > 0,
+        next_before=next_before,
+        next_before_offset=next_before_offset
     )
 
 
+def _message_timestamp(message: Message) -> datetime:
+    return message.timestamp
+
+
 @router.delete("/history/{session_id}")
 async def clear_history(session_id: str):
     """Очистка истории чата для сессии."""
-    if session_id in chat_history:
-        del chat_history[session_id]
+    if await history_service.clear(session_id):
         logger.info(f"History cleared for session {session_id}")
         return {"message": f"History cleared for session {session_id}"}
     else:
@@ -204,40 +469,46 @@ async def clear_history(session_id: str):
 @router.get("/stats")
 async def get_stats():
     """Статистика системы."""
-    total_sessions = len(chat_history)
-    total_messages = sum(len(messages) for messages in chat_history.values())
-    total_feedback = len(feedback_storage)
-
-    avg_rating = 0
-    if feedback_storage:
-        avg_rating = sum(f["rating"] for f in feedback_storage) / len(feedback_storage)
+    stats = await history_service.get_stats()
 
     return {
-        "total_sessions": total_sessions,
-        "total_messages": total_messages,
-        "total_feedback": total_feedback,
-        "average_rating": round(avg_rating, 2),
+        "total_sessions": stats["total_sessions"],
+        "total_messages": stats["total_messages"],
+        "total_feedback": stats["total_feedback"],
+        "average_rating": round(stats["average_rating"], 2),
+        "active_chat_requests": _chat_limiter.in_flight,
+        "chat_max_concurrency": _chat_limiter.limit,
         "active_llm_provider": settings.llm_provider,
         "active_vector_store": settings.vector_store
     }
 
 
 @router.get("/rag/stats")
-async def get_rag_stats():
-    """Статистика RAG коллекции и тестовый поиск."""
+async def get_rag_stats(request: Request):
+    """
+    Статистика RAG коллекции и тестовый поиск.
+
+    Ответ зависит только от состояния индекса: тестовый поиск кэшируется
+    на 30 секунд, а ответ помечается ETag по версии коллекции и числу документов, так что
+    опрашивающие клиенты с If-None-Match получают 304 без тела.
+    """
     try:
+        rag_agent = _rag_agent()
+
         if not rag_agent._initialized:
-            rag_agent.initialize(load_docs=False)
+            await run_in_threadpool(rag_agent.initialize, load_docs=False)
 
-        stats = rag_agent.get_collection_info()
+        stats = await run_in_threadpool(rag_agent.get_collection_info)
+        etag = f'W/"{stats.get("collection_version", 0)}-{stats.get("total_documents", 0)}"'
 
-        # Test search
-        test_query = "PT Sandbox"
-        test_results = rag_agent.rag_service.search(test_query, top_k=3)
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
 
-        return {
-            "collection_stats": stats,
-            "test_search": {
+        test_search = _rag_stats_cache.get(etag)
+        if test_search is None:
+            test_query = "PT Sandbox"
+            test_results = await run_in_threadpool(rag_agent.rag_service.search, test_query, top_k=3)
+            test_search = {
                 "query": test_query,
                 "results_count": len(test_results),
                 "top_results": [
@@ -250,7 +521,12 @@ async def get_rag_stats():
                     for r in test_results[:3]
                 ]
             }
-        }
+            _rag_stats_cache.set(etag, test_search)
+
+        return ORJSONResponse(
+            {"collection_stats": stats, "test_search": test_search},
+            headers={"ETag": etag}
+        )
     except Exception as e:
         logger.error(f"Error getting RAG stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -260,9 +536,12 @@ async def get_rag_stats():
 async def reload_rag_documents():
     """Принудительная перезагрузка документов с диска."""
     try:
+        rag_agent = _rag_agent()
+
         logger.info("Force reloading RAG documents...")
-        rag_agent.reload_documents("./data/docs")
-        stats = rag_agent.get_collection_info()
+        await run_in_threadpool(rag_agent.reload_documents, "./data/docs")
+        _rag_stats_cache.clear()
+        stats = await run_in_threadpool(rag_agent.get_collection_info)
         return {
             "success": True,
             "message": "Documents reloaded successfully",
@@ -277,35 +556,90 @@ async def reload_rag_documents():
 async def debug_rag_search(query: str):
     """Отладка RAG поиска для просмотра расстояний и сходства."""
     try:
+        rag_agent = _rag_agent()
+
         if not rag_agent._initialized:
-            rag_agent.initialize(load_docs=False)
+            await run_in_threadpool(rag_agent.initialize, load_docs=False)
 
-        results = rag_agent.rag_service.search(query, top_k=5)
+        results = await run_in_threadpool(rag_agent.rag_service.search, query, top_k=5)
 
-        debug_info = []
-        for r in results:
-            distance = r['distance']
-            similarity = max(0.0, min(1.0, 1.0 - distance))
+        return _debug_search_results(query, results)
+    except Exception as e:
+        logger.error(f"Error in debug search: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-            debug_info.append({
-                "filename": r['metadata'].get('filename', 'unknown'),
-                "distance": round(distance, 4),
-                "similarity": round(similarity, 4),
-                "passes_threshold_0.3": similarity >= 0.3,
-                "passes_threshold_0.5": similarity >= 0.5,
-                "content_preview": r['content'][:150] + "..."
-            })
 
-        return {
-            "query": query,
-            "total_results": len(results),
-            "results": debug_info
-        }
+@router.post("/rag/debug_batch")
+async def debug_rag_search_batch(request: RAGDebugBatchRequest):
+    """
+    Пакетная отладка RAG поиска.
+
+    Эмбеддинги всех запросов вычисляются одним вызовом, поиск выполняется
+    одним обращением к коллекции.
+    """
+    try:
+        rag_agent = _rag_agent()
+
+        if not rag_agent._initialized:
+            await run_in_threadpool(rag_agent.initialize, load_docs=False)
+
+        batch_results = await run_in_threadpool(
+            rag_agent.rag_service.search_batch,
+            request.queries,
+            top_k=request.top_k
+        )
+
+        return [
+            _debug_search_results(query, results)
+            for query, results in zip(request.queries, batch_results)
+        ]
     except Exception as e:
-        logger.error(f"Error in debug search: {e}")
+        logger.error(f"Error in batch debug search: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _debug_search_results(query: str, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Форматирование результатов поиска с расстояниями и порогами сходства."""
+    debug_info = []
+    for r in results:
+        distance = r['distance']
+        similarity = max(0.0, min(1.0, 1.0 - distance))
+
+        debug_info.append({
+            "filename": r['metadata'].get('filename', 'unknown'),
+            "distance": round(distance, 4),
+            "similarity": round(similarity, 4),
+            "passes_threshold_0.3": similarity >= 0.3,
+            "passes_threshold_0.5": similarity >= 0.5,
+            "content_preview": r['content'][:150] + "..."
+        })
+
+    return {
+        "query": query,
+        "total_results": len(results),
+        "results": debug_info
+    }
+
+
+@router.get("/rag/stream/{query}")
+async def stream_rag_answer(query: str):
+    """Потоковый ответ RAG-агента через Server-Sent Events."""
+    rag_agent = _rag_agent()
+
+    if not rag_agent._initialized:
+        try:
+            await run_in_threadpool(rag_agent.initialize, load_docs=False)
+        except Exception as e:
+            logger.error(f"Error initializing RAG Agent for streaming: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_stream():
+        async for event in rag_agent.answer_question_stream(query):
+            yield _sse_event(event)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # =============================================================================
 # EVALUATION ENDPOINT
 # =============================================================================
@@ -320,6 +654,9 @@ async def evaluate_single_query(request: EvaluateRequest):
     - Answer Relevancy: релевантность ответа вопросу
     - Faithfulness: соответствие источникам (отсутствие галлюцинаций)
 
+    Ответ возвращается после завершения всех LLM-вызовов метрик; для длинных
+    прогонов используйте /evaluate/jobs.
+
     Args:
         request: EvaluateRequest с query, expected_output, retrieval_context
 
@@ -334,91 +671,175 @@ async def evaluate_single_query(request: EvaluateRequest):
             "retrieval_context": ["SQLite database: employees table"]
         }
     """
+    _require_deepeval()
+
     try:
-        # Импорт DeepEval метрик
-        from deepeval.metrics import AnswerRelevancyMetric, FaithfulnessMetric
-        from deepeval.test_case import LLMTestCase
-
-        # Вызов основного chat endpoint
-        chat_request = ChatRequest(
-            message=request.query,
-            use_history=False
-        )
-        response = await chat(chat_request)
-
-        # Извлечение routing decision
-        tools_used = response.tools_used
-        router_tool = "unknown"
-        router_confidence = 0.0
-        router_reasoning = ""
-
-        if tools_used and tools_used[0].tool_type == ToolType.ROUTER:
-            router_decision = tools_used[0]
-            metadata = router_decision.metadata or {}
-            router_tool = metadata.get("tool", "unknown").lower()
-            router_confidence = router_decision.confidence or 0.0
-            router_reasoning = router_decision.reasoning or ""
-
-        # Создание routing info
-        routing_info = RoutingInfo(
-            tool=router_tool,
-            confidence=router_confidence,
-            reasoning=router_reasoning
+        return await _run_evaluation(request)
+
+    except HTTPException:
+        # Re-raise HTTP exceptions from chat endpoint
+        raise
+
+    except Exception as e:
+        logger.error(f"Error in evaluate endpoint: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Evaluation error: {str(e)}"
         )
 
-        # Создание DeepEval test case
-        test_case = LLMTestCase(
-            input=request.query,
-            actual_output=response.message,
-            expected_output=request.expected_output,
-            retrieval_context=request.retrieval_context or [],
-            context=response.sources or []
+
+@router.post(
+    "/evaluate/jobs",
+    response_model=EvaluationJob,
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def create_evaluation_job(request: EvaluateRequest, background_tasks: BackgroundTasks):
+    """
+    Запуск оценки в фоне.
+
+    Возвращает job_id сразу, не дожидаясь LLM-вызовов метрик; результат
+    доступен через GET /evaluate/jobs/{job_id} в течение evaluation_job_ttl_seconds.
+
+    Args:
+        request: EvaluateRequest с query, expected_output, retrieval_context
+        background_tasks: Фоновые задачи FastAPI
+
+    Returns:
+        EvaluationJob со статусом pending
+    """
+    _require_deepeval()
+
+    job = EvaluationJob(job_id=uuid.uuid4().hex, status=EvaluationStatus.PENDING)
+    await history_service.save_evaluation_job(job.job_id, job.model_dump(mode="json"))
+    background_tasks.add_task(_run_evaluation_job, job.job_id, request)
+    return job
+
+
+@router.get("/evaluate/jobs/{job_id}", response_model=EvaluationJob)
+async def get_evaluation_job(job_id: str):
+    """
+    Получение статуса и результата фоновой оценки.
+
+    Args:
+        job_id: Идентификатор задачи из POST /evaluate/jobs
+
+    Returns:
+        EvaluationJob; result заполнен при статусе completed
+    """
+    job = await history_service.get_evaluation_job(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Evaluation job {job_id} not found"
         )
+    return ORJSONResponse(job)
 
-        # Применение метрик
-        metrics_to_use = [
-            AnswerRelevancyMetric(threshold=0.7, model="gpt-4.1", include_reason=True),
-            FaithfulnessMetric(threshold=0.7, model="gpt-4.1", include_reason=True)
-        ]
 
-        # Измерение метрик
-        metric_scores = {}
+@lru_cache(maxsize=None)
+def _metric_prototypes() -> tuple:
+    """Метрики DeepEval создаются один раз: конструкторы поднимают модель и HTTP-клиент."""
+    return (
+        AnswerRelevancyMetric(threshold=0.7, model="gpt-4.1", include_reason=True),
+        FaithfulnessMetric(threshold=0.7, model="gpt-4.1", include_reason=True)
+    )
 
-        for metric in metrics_to_use:
-            try:
-                metric.measure(test_case)
 
-                metric_scores[metric.__name__] = MetricScore(
-                    score=metric.score,
-                    threshold=metric.threshold,
-                    passed=metric.is_successful(),
-                    reason=getattr(metric, "reason", None)
-                )
+def _evaluation_metrics() -> list:
+    """Копии метрик на один прогон: measure() записывает score и reason в сам объект."""
+    return [copy.copy(metric) for metric in _metric_prototypes()]
 
-            except Exception as e:
-                logger.error(f"Error measuring metric {metric.__name__}: {e}")
-                metric_scores[metric.__name__] = MetricScore(
-                    score=0.0,
-                    threshold=metric.threshold,
-                    passed=False,
-                    reason=f"Error: {str(e)}"
-                )
 
-        # Формирование ответа
-        return EvaluateResponse(
-            query=request.query,
-            response=response.message,
-            routing=routing_info,
-            metrics=metric_scores
+def _require_deepeval():
+    """Ответ 503, если DeepEval не установлен."""
+    if not DEEPEVAL_AVAILABLE:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Evaluation is unavailable: deepeval package is not installed"
         )
 
-    except HTTPException:
-        # Re-raise HTTP exceptions from chat endpoint
-        raise
 
+async def _run_evaluation_job(job_id: str, request: EvaluateRequest):
+    """Выполнение фоновой оценки с сохранением результата или ошибки."""
+    try:
+        result = await _run_evaluation(request)
+        job = EvaluationJob(job_id=job_id, status=EvaluationStatus.COMPLETED, result=result)
     except Exception as e:
-        logger.error(f"Error in evaluate endpoint: {e}", exc_info=True)
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Evaluation error: {str(e)}"
+        logger.error(f"Evaluation job {job_id} failed: {e}", exc_info=True)
+        job = EvaluationJob(
+            job_id=job_id,
+            status=EvaluationStatus.FAILED,
+            error=e.detail if isinstance(e, HTTPException) else str(e)
         )
+
+    await history_service.save_evaluation_job(job_id, job.model_dump(mode="json"))
+
+
+async def _run_evaluation(request: EvaluateRequest) -> EvaluateResponse:
+    """
+    Получение ответа системы на запрос и расчет метрик DeepEval.
+
+    Args:
+        request: EvaluateRequest с query, expected_output, retrieval_context
+
+    Returns:
+        EvaluateResponse с scores по метрикам
+    """
+    # Ответ системы без записи в историю чатов
+    result = await _run_query(request.query)
+    answer = result.get("answer", "Не удалось обработать запрос.")
+
+    # Извлечение routing decision
+    routing_decision = result.get("routing_decision") or {}
+    routing_info = RoutingInfo(
+        tool=(routing_decision.get("tool") or "unknown").lower(),
+        confidence=routing_decision.get("confidence") or 0.0,
+        reasoning=routing_decision.get("reasoning") or ""
+    )
+
+    # Создание DeepEval test case
+    test_case = LLMTestCase(
+        input=request.query,
+        actual_output=answer,
+        expected_output=request.expected_output,
+        retrieval_context=request.retrieval_context or [],
+        context=result.get("sources") or []
+    )
+
+    # Применение метрик
+    metrics_to_use = _evaluation_metrics()
+
+    # Измерение метрик: каждая делает блокирующие LLM-вызовы, выполняем их параллельно
+    async def _measure(metric) -> MetricScore:
+        await run_in_threadpool(metric.measure, test_case)
+        return MetricScore(
+            score=metric.score,
+            threshold=metric.threshold,
+            passed=metric.is_successful(),
+            reason=getattr(metric, "reason", None)
+        )
+
+    entries = await asyncio.gather(
+        *(_measure(metric) for metric in metrics_to_use),
+        return_exceptions=True
+    )
+
+    metric_scores = {}
+
+    for metric, entry in zip(metrics_to_use, entries):
+        if isinstance(entry, Exception):
+            logger.error(f"Error measuring metric {metric.__name__}: {entry}")
+            entry = MetricScore(
+                score=0.0,
+                threshold=metric.threshold,
+                passed=False,
+                reason=f"Error: {str(entry)}"
+            )
+        metric_scores[metric.__name__] = entry
+
+    # Формирование ответа
+    return EvaluateResponse(
+        query=request.query,
+        response=answer,
+        routing=routing_info,
+        metrics=metric_scores
+    )
@@ -16,6 +16,7 @@ class Settings(BaseSettings):
     api_host: str = "0.0.0.0"
     api_port: int = 8000
     api_workers: int = 1
+    api_threadpool_size: int = 200  # потоки для блокирующих вызовов (run_in_threadpool)
 
     # API ключи
     openai_api_key: Optional[str] = None
@@ -40,6 +41,8 @@ class Settings(BaseSettings):
     chroma_persist_directory: str = "./chroma_db"
     chunk_size: int = 1000
     chunk_overlap: int = 200
+    rag_max_context_tokens: int = 6000
+    semantic_cache_threshold: float = 0.93  # косинусное сходство для кэша ответов /chat
 
     # База данных
     database_type: str = "sqlite"  # "sqlite" или "postgresql"
@@ -50,10 +53,31 @@ class Settings(BaseSettings):
     postgres_host: str = "localhost"
     postgres_port: int = 5432
     database_url: Optional[str] = None
+    db_pool_size: int = 20  # постоянные соединения PostgreSQL
+    db_pool_warm_connections: int = 2  # сколько из них открывать при старте
+    db_max_overflow: int = 10
+    db_pool_timeout: int = 10  # ожидание свободного соединения, затем ошибка вместо зависания
+    db_pool_recycle: int = 1800  # пересоздание соединений старше N секунд
+    db_schema_check_ttl_seconds: int = 60  # как часто перепроверять отпечаток схемы для промпта SQL
+    db_schema_cache_dir: Optional[str] = "./data/schema_cache"  # описание схемы между запусками; пусто - без диска
+
+    # История чатов (Redis; без REDIS_URL история хранится в памяти процесса)
+    redis_url: Optional[str] = None
+    redis_max_connections: int = 50
+    history_ttl_seconds: int = 3600
+    history_max_sessions: int = 10000  # лимит сессий в памяти процесса (LRU)
+    history_max_messages: int = 200  # последние N сообщений на сессию
+    history_window: int = 20  # последние N сообщений, передаваемых оркестратору
+    history_max_feedback: int = 100000  # хранятся последние N отзывов, /stats учитывает все
+    evaluation_job_ttl_seconds: int = 3600  # хранение результатов /evaluate/jobs
+    evaluation_max_jobs: int = 1000  # лимит результатов в памяти процесса
 
     # Веб-поиск
     web_search_enabled: bool = True
     max_search_results: int = 5
+    search_snippet_chars: int = 500
+    search_min_score: float = 0.3
+    search_direct_answer_threshold: float = 0.85
 
     # Агенты
     agent_max_iterations: int = 5
@@ -62,6 +86,17 @@ class Settings(BaseSettings):
     # Безопасность
     enable_guardrails: bool = True
     allowed_sql_operations: str = "SELECT"
+
+    # Ограничение частоты запросов к /chat, /evaluate и отладочным RAG-эндпоинтам (по IP)
+    rate_limit_enabled: bool = True
+    rate_limit_per_second: float = 10.0
+    rate_limit_burst: int = 20
+    chat_max_concurrency: int = 100  # одновременные запросы /chat, сверх лимита - 503
+
+    # CORS: явные списки позволяют Starlette собрать заголовки preflight один раз
+    cors_allow_origins: List[str] = ["*"]
+    cors_allow_methods: List[str] = ["GET", "POST", "DELETE"]
+    cors_allow_headers: List[str] = ["Content-Type", "Authorization", "If-None-Match"]
     
     class Config:
         env_file = ".env"
@@ -1,27 +1,43 @@
 """Точка входа для приложения LLM Assistant."""
 import sys
+import asyncio
+import anyio
+from datetime import datetime, timezone
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.exceptions import RequestValidationError
 from loguru import logger
 
 from app.config import settings
 from app.api.routes import router
-from app.models.schemas import ErrorResponse
+from app.api.rate_limit import RateLimitMiddleware
+from app.api.responses import ORJSONResponse
 from app.services.database_service import db_service
-from app.agents.sql_agent import sql_agent
-from app.agents.rag_agent import rag_agent
-from app.agents.web_search_agent import web_search_agent
+from app.services.history_service import history_service
 
 
 logger.remove()
-logger.add(
-    sys.stderr,
-    level=settings.log_level,
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>"
-)
+# enqueue=True: запись в stderr выполняется фоновым потоком, а не в event loop
+if settings.debug:
+    logger.add(
+        sys.stderr,
+        level=settings.log_level,
+        enqueue=True,
+        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | <level>{level: <8}</level> | <cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>"
+    )
+else:
+    # Production: без ANSI-разметки и без разбора значений переменных в трейсбеках
+    logger.add(
+        sys.stderr,
+        level=settings.log_level,
+        enqueue=True,
+        colorize=False,
+        backtrace=False,
+        diagnose=False,
+        format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {name}:{function} - {message}"
+    )
 
 
 @asynccontextmanager
@@ -32,19 +48,43 @@ async def lifespan(app: FastAPI):
     logger.info(f"LLM Provider: {settings.llm_provider}")
     logger.info(f"Vector Store: {settings.vector_store}")
 
-    try:
-        logger.info("Initializing database connection...")
-        db_service.initialize()
+    # Пул потоков для блокирующих вызовов агентов (по умолчанию в anyio всего 40)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.api_threadpool_size
 
-        logger.info("Initializing SQL Agent...")
-        sql_agent.initialize()
-
-        logger.info("Initializing RAG Agent...")
-        # Временно отключаем загрузку документов при старте для отладки
-        rag_agent.initialize(load_docs=False, docs_directory="./data/docs")
-
-        logger.info("Initializing Web Search Agent...")
-        web_search_agent.initialize()
+    try:
+        # Агенты импортируются здесь, а не на уровне модуля: импорт app.main
+        # (воркеры uvicorn, тесты) не загружает SQLAlchemy-схему, ChromaDB и Tavily
+        from app.agents.sql_agent import sql_agent
+        from app.agents.rag_agent import rag_agent
+        from app.agents.web_search_agent import web_search_agent
+
+        logger.info("Initializing chat history store...")
+        history_service.initialize()
+
+        def initialize_sql():
+            # SQL-агент читает схему через db_service, поэтому они инициализируются по очереди
+            logger.info("Initializing database connection...")
+            db_service.initialize()
+            logger.info("Initializing SQL Agent...")
+            sql_agent.initialize()
+
+        logger.info("Initializing SQL, RAG and Web Search Agents...")
+        # Блокирующие инициализации независимы: время старта - максимум, а не сумма
+        results = await asyncio.gather(
+            asyncio.to_thread(initialize_sql),
+            # Временно отключаем загрузку документов при старте для отладки
+            asyncio.to_thread(rag_agent.initialize, load_docs=False, docs_directory="./data/docs"),
+            asyncio.to_thread(web_search_agent.initialize),
+            return_exceptions=True
+        )
+
+        failed = False
+        for name, result in zip(("SQL Agent", "RAG Agent", "Web Search Agent"), results):
+            if isinstance(result, Exception):
+                failed = True
+                logger.error(f"Failed to initialize {name}: {result}")
+        if failed:
+            logger.warning("Application started with limited functionality")
 
         # TODO: Инициализировать Router agent
 
@@ -61,6 +101,7 @@ async def lifespan(app: FastAPI):
     try:
         logger.info("Closing database connections...")
         db_service.close()
+        await history_service.close()
 
         # TODO: Сохранить состояние vector store, очистить временные файлы
 
@@ -68,6 +109,8 @@ async def lifespan(app: FastAPI):
         logger.error(f"Error during shutdown: {e}")
 
     logger.success("Application shut down successfully")
+    # Дожидаемся записи сообщений, оставшихся в очереди логгера
+    await logger.complete()
 
 
 app = FastAPI(
@@ -76,40 +119,65 @@ app = FastAPI(
     description="Multi-functional LLM Assistant with RAG, SQL, and Web Search capabilities",
     docs_url="/docs",
     redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
     lifespan=lifespan
 )
 
 
+# Ограничение частоты добавляется до CORS, чтобы ответы 429 тоже получали CORS-заголовки
+if settings.rate_limit_enabled:
+    app.add_middleware(
+        RateLimitMiddleware,
+        rate=settings.rate_limit_per_second,
+        burst=settings.rate_limit_burst,
+        path_prefixes=(
+            "/api/v1/chat",
+            "/api/v1/evaluate",
+            "/api/v1/rag/reload",
+            "/api/v1/rag/debug",
+            "/api/v1/rag/stream"
+        )
+    )
+
+
+# Сжатие больших JSON-ответов (история, источники); SSE-потоки не сжимаются
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],  # TODO: Настроить для production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=settings.cors_allow_origins,
+    # С "*" Starlette все равно не возвращает credentials для произвольного источника
+    allow_credentials="*" not in settings.cors_allow_origins,
+    allow_methods=settings.cors_allow_methods,
+    allow_headers=settings.cors_allow_headers,
+    expose_headers=["ETag", "Retry-After"],
 )
 
 
+def _error_body(error: str, detail: str) -> dict:
+    """Тело ошибки в формате ErrorResponse без построения Pydantic-модели."""
+    return {"error": error, "detail": detail, "timestamp": datetime.now(timezone.utc)}
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     logger.error(f"Validation error: {exc.errors()}")
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-        content=ErrorResponse(
-            error="Validation Error",
-            detail=str(exc.errors())
-        ).model_dump()
+        content=_error_body("Validation Error", str(exc.errors()))
     )
 
 
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception: {exc}", exc_info=True)
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        content=ErrorResponse(
-            error="Internal Server Error",
-            detail=str(exc) if settings.debug else "An error occurred"
-        ).model_dump()
+        content=_error_body(
+            "Internal Server Error",
+            str(exc) if settings.debug else "An error occurred"
+        )
     )
 
 
@@ -138,7 +206,11 @@ def main():
         port=settings.api_port,
         workers=settings.api_workers,
         reload=settings.debug,
-        log_level=settings.log_level.lower()
+        log_level=settings.log_level.lower(),
+        # uvloop и httptools входят в uvicorn[standard]; uvloop недоступен на Windows
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        timeout_keep_alive=75
     )
 
 
@@ -1,8 +1,13 @@
 """Pydantic модели для API запросов и ответов."""
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import List, Optional, Dict, Any, Literal
+from datetime import datetime, timezone
 from enum import Enum
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
+
+
+def _utcnow() -> datetime:
+    """Текущее время в UTC с часовым поясом (сравнимо между воркерами)."""
+    return datetime.now(timezone.utc)
 
 
 class MessageRole(str, Enum):
@@ -20,10 +25,16 @@ class ToolType(str, Enum):
     NONE = "none"
 
 
+class EvaluationStatus(str, Enum):
+    PENDING = "pending"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
 class Message(BaseModel):
     role: MessageRole
     content: str
-    timestamp: Optional[datetime] = Field(default_factory=datetime.now)
+    timestamp: Optional[datetime] = Field(default_factory=_utcnow)
 
 
 class ToolUsage(BaseModel):
@@ -36,20 +47,38 @@ class ToolUsage(BaseModel):
     metadata: Optional[Dict[str, Any]] = None
 
 
+_CHAT_REQUEST_EXAMPLE = {
+    "example": {
+        "message": "Сколько человек работает над PT Application Inspector?",
+        "session_id": "user123",
+        "use_history": True
+    }
+}
+
+
 class ChatRequest(BaseModel):
     """Модель запроса для чат-эндпоинта."""
     message: str = Field(..., description="User message", min_length=1)
     session_id: Optional[str] = Field(None, description="Session ID for conversation history")
     use_history: bool = Field(True, description="Whether to use conversation history")
 
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "message": "Сколько человек работает над PT Application Inspector?",
-                "session_id": "user123",
-                "use_history": True
+    model_config = ConfigDict(json_schema_extra=_CHAT_REQUEST_EXAMPLE)
+
+
+_CHAT_RESPONSE_EXAMPLE = {
+    "example": {
+        "message": "Над продуктом PT Application Inspector работает 3 разработчика...",
+        "session_id": "user123",
+        "tools_used": [
+            {
+                "tool_type": "sql",
+                "query": "SELECT COUNT(*) FROM team_members WHERE ...",
+                "result_summary": "Found 3 team members"
             }
-        }
+        ],
+        "sources": ["database: team_members table"]
+    }
+}
 
 
 class ChatResponse(BaseModel):
@@ -60,27 +89,13 @@ class ChatResponse(BaseModel):
     sources: Optional[List[str]] = Field(None, description="Sources used for the answer")
     metadata: Optional[Dict[str, Any]] = None
 
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "message": "Над продуктом PT Application Inspector работает 3 разработчика...",
-                "session_id": "user123",
-                "tools_used": [
-                    {
-                        "tool_type": "sql",
-                        "query": "SELECT COUNT(*) FROM team_members WHERE ...",
-                        "result_summary": "Found 3 team members"
-                    }
-                ],
-                "sources": ["database: team_members table"]
-            }
-        }
+    model_config = ConfigDict(json_schema_extra=_CHAT_RESPONSE_EXAMPLE)
 
 
 class HealthResponse(BaseModel):
     status: str = "healthy"
     version: str
-    timestamp: datetime = Field(default_factory=datetime.now)
+    timestamp: datetime = Field(default_factory=_utcnow)
     services: Optional[Dict[str, str]] = None
 
 
@@ -100,12 +115,15 @@ class ChatHistory(BaseModel):
     session_id: str
     messages: List[Message]
     total_messages: int
+    has_more: bool = False  # есть более ранние сообщения
+    next_before: Optional[datetime] = None  # значение before для следующей страницы
+    next_before_offset: Optional[int] = None  # значение before_offset для следующей страницы
 
 
 class ErrorResponse(BaseModel):
     error: str
     detail: Optional[str] = None
-    timestamp: datetime = Field(default_factory=datetime.now)
+    timestamp: datetime = Field(default_factory=_utcnow)
 
 
 # =============================================================================
@@ -127,6 +145,15 @@ class RoutingInfo(BaseModel):
     reasoning: str = Field(..., description="Router reasoning")
 
 
+_EVALUATE_REQUEST_EXAMPLE = {
+    "example": {
+        "query": "Сколько программистов в команде?",
+        "expected_output": "В команде 2 программиста",
+        "retrieval_context": ["SQLite database: employees table"]
+    }
+}
+
+
 class EvaluateRequest(BaseModel):
     """Модель запроса для evaluate эндпоинта."""
     query: str = Field(..., description="User query to evaluate", min_length=1)
@@ -136,14 +163,34 @@ class EvaluateRequest(BaseModel):
         description="Context for RAG evaluation (optional)"
     )
 
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "query": "Сколько программистов в команде?",
-                "expected_output": "В команде 2 программиста",
-                "retrieval_context": ["SQLite database: employees table"]
+    model_config = ConfigDict(json_schema_extra=_EVALUATE_REQUEST_EXAMPLE)
+
+
+_EVALUATE_RESPONSE_EXAMPLE = {
+    "example": {
+        "query": "Сколько программистов в команде?",
+        "response": "В команде работает 2 программиста.",
+        "routing": {
+            "tool": "sql",
+            "confidence": 0.95,
+            "reasoning": "Query requires database lookup"
+        },
+        "metrics": {
+            "Answer Relevancy": {
+                "score": 0.92,
+                "threshold": 0.7,
+                "passed": True,
+                "reason": "Response directly answers the question"
+            },
+            "Faithfulness": {
+                "score": 0.88,
+                "threshold": 0.7,
+                "passed": True,
+                "reason": "No hallucinations detected"
             }
         }
+    }
+}
 
 
 class EvaluateResponse(BaseModel):
@@ -153,29 +200,39 @@ class EvaluateResponse(BaseModel):
     routing: RoutingInfo = Field(..., description="Routing decision")
     metrics: Dict[str, MetricScore] = Field(..., description="DeepEval metric scores")
 
-    class Config:
-        json_schema_extra = {
-            "example": {
-                "query": "Сколько программистов в команде?",
-                "response": "В команде работает 2 программиста.",
-                "routing": {
-                    "tool": "sql",
-                    "confidence": 0.95,
-                    "reasoning": "Query requires database lookup"
-                },
-                "metrics": {
-                    "Answer Relevancy": {
-                        "score": 0.92,
-                        "threshold": 0.7,
-                        "passed": True,
-                        "reason": "Response directly answers the question"
-                    },
-                    "Faithfulness": {
-                        "score": 0.88,
-                        "threshold": 0.7,
-                        "passed": True,
-                        "reason": "No hallucinations detected"
-                    }
-                }
-            }
-        }
+    model_config = ConfigDict(json_schema_extra=_EVALUATE_RESPONSE_EXAMPLE)
+
+
+class EvaluationJob(BaseModel):
+    """Состояние фоновой оценки, запущенной через /evaluate/jobs."""
+    job_id: str = Field(..., description="Evaluation job ID")
+    status: EvaluationStatus = Field(..., description="Job status")
+    result: Optional[EvaluateResponse] = Field(None, description="Evaluation result when completed")
+    error: Optional[str] = Field(None, description="Error message when failed")
+
+
+class RAGDebugBatchRequest(BaseModel):
+    """Модель запроса пакетной отладки RAG поиска."""
+    queries: List[str] = Field(..., description="Search queries", min_length=1, max_length=100)
+    top_k: int = Field(5, description="Results per query", ge=1, le=50)
+
+
+# =============================================================================
+# Router Schemas
+# =============================================================================
+
+class RoutingDecision(BaseModel):
+    """Структурированный ответ LLM-маршрутизатора."""
+    tool: Literal["SQL", "RAG", "WEB_SEARCH", "MULTIPLE"] = Field(..., description="Selected tool")
+    tools: Optional[List[Literal["SQL", "RAG", "WEB_SEARCH"]]] = Field(
+        None,
+        description="Tools to combine, only for MULTIPLE"
+    )
+    reasoning: str = Field(..., description="Short explanation of the choice")
+    confidence: float = Field(..., description="Confidence from 0.0 to 1.0")
+    query_type: str = Field(..., description="Short query type label")
+
+
+class RoutingBatch(BaseModel):
+    """Структурированный ответ LLM-маршрутизатора для пакета запросов."""
+    decisions: List[RoutingDecision] = Field(..., description="Decisions A[1]..A[n] in the order of questions")
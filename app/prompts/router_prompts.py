@@ -1,3 +1,5 @@
+from typing import List
+
 
 ROUTER_SYSTEM_PROMPT = """Ты - интеллектуальный роутер запросов для многофункционального LLM-ассистента.
 
@@ -142,6 +144,15 @@ ROUTER_USER_PROMPT_TEMPLATE = """Проанализируй следующий 
 Ответь ТОЛЬКО JSON в указанном формате:"""
 
 
+ROUTER_BATCH_PROMPT_TEMPLATE = """Проанализируй каждый из следующих вопросов пользователей независимо и для каждого определи, какой инструмент использовать.
+
+{questions}
+
+Для каждого вопроса Q[i] верни ответ A[i] - JSON в указанном формате, по одному на строку, в том же порядке:
+A[1]: {{...}}
+A[2]: {{...}}"""
+
+
 def get_router_prompt(query: str) -> str:
     """Получение полного промпта роутера с запросом пользователя.
 
@@ -211,3 +222,27 @@ def get_router_prompt_with_examples(query: str) -> str:
     ])
 
     return f"{ROUTER_SYSTEM_PROMPT}\n\nПРИМЕРЫ:\n{examples_text}\n\n{ROUTER_USER_PROMPT_TEMPLATE.format(query=query)}"
+
+
+def get_router_batch_prompt(queries: List[str], with_examples: bool = True) -> str:
+    """Получение промпта роутера для классификации нескольких запросов за один вызов LLM.
+
+    Args:
+        queries: Запросы пользователей для классификации
+        with_examples: Добавлять ли few-shot примеры
+
+    Returns:
+        Отформатированный промпт с вопросами Q[1]..Q[n]
+    """
+    questions_text = "\n".join(f"Q[{i}]: {query}" for i, query in enumerate(queries, 1))
+    batch_prompt = ROUTER_BATCH_PROMPT_TEMPLATE.format(questions=questions_text)
+
+    if not with_examples:
+        return f"{ROUTER_SYSTEM_PROMPT}\n\n{batch_prompt}"
+
+    examples_text = "\n\n".join([
+        f"Пример {i+1}:\nВопрос: {ex['query']}\nОтвет: {ex['response']}"
+        for i, ex in enumerate(ROUTER_FEW_SHOT_EXAMPLES)
+    ])
+
+    return f"{ROUTER_SYSTEM_PROMPT}\n\nПРИМЕРЫ:\n{examples_text}\n\n{batch_prompt}"
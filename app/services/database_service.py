@@ -1,6 +1,10 @@
 """Сервис базы данных для выполнения SQL-запросов."""
-from typing import List, Dict, Any, Optional
+import os
+from pathlib import Path
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+import hashlib
 import re
+import time
 from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.exc import SQLAlchemyError
@@ -10,12 +14,35 @@ from app.config import settings
 from app.models.database import Base
 
 
+# Отпечаток схемы PostgreSQL: меняется при добавлении/изменении таблиц, колонок и ограничений
+_PG_SCHEMA_FINGERPRINT_SQL = """
+SELECT md5(
+    (SELECT coalesce(string_agg(table_name || '.' || column_name || ':' || data_type || ':' || is_nullable,
+                                ',' ORDER BY table_name, ordinal_position), '')
+     FROM information_schema.columns WHERE table_schema = 'public')
+    || '|' ||
+    (SELECT coalesce(string_agg(constraint_name, ',' ORDER BY constraint_name), '')
+     FROM information_schema.table_constraints WHERE table_schema = 'public')
+)
+"""
+
+# Опасные команды SQL (word boundaries, чтобы created_at не совпадал с CREATE)
+# и вызовы хранимых процедур (xp_cmdshell(...), sp_executesql(...)); колонки
+# вроде sp_name без скобок вызова не блокируются, а EXEC xp_... ловит EXEC
+_DANGEROUS_SQL_RE = re.compile(
+    r"\b(DELETE|DROP|TRUNCATE|ALTER|CREATE|INSERT|UPDATE|EXECUTE|EXEC|GRANT|REVOKE)\b"
+    r"|\b(XP_|SP_)\w*\s*\("
+)
+
+
 class DatabaseService:
     """Сервис для операций с базой данных."""
 
     def __init__(self):
         self.engine = None
         self.SessionLocal = None
+        self._table_info: Optional[Tuple[str, str]] = None
+        self._schema_checked_at = 0.0
         self._initialized = False
 
     def initialize(self):
@@ -35,8 +62,10 @@ class DatabaseService:
                 self.engine = create_engine(
                     settings.db_url,
                     pool_pre_ping=True,
-                    pool_size=5,
-                    max_overflow=10
+                    pool_size=settings.db_pool_size,
+                    max_overflow=settings.db_max_overflow,
+                    pool_timeout=settings.db_pool_timeout,
+                    pool_recycle=settings.db_pool_recycle
                 )
 
             self.SessionLocal = sessionmaker(
@@ -45,9 +74,19 @@ class DatabaseService:
                 bind=self.engine
             )
 
-            # Тестирование соединения
-            with self.engine.connect() as conn:
-                conn.execute(text("SELECT 1"))
+            # Тестирование соединения и прогрев пула: несколько соединений PostgreSQL
+            # открываются заранее, чтобы первые запросы не платили за TCP/TLS-рукопожатие
+            if settings.database_type.lower() == "sqlite":
+                warm_connections = 1
+            else:
+                warm_connections = max(1, min(settings.db_pool_size, settings.db_pool_warm_connections))
+            connections = [self.engine.connect() for _ in range(warm_connections)]
+            try:
+                for conn in connections:
+                    conn.execute(text("SELECT 1"))
+            finally:
+                for conn in connections:
+                    conn.close()
 
             self._initialized = True
             logger.success("Database connection established")
@@ -71,21 +110,37 @@ class DatabaseService:
         Returns:
             Список словарей с результатами запроса
         """
+        rows = [row for chunk in self.iter_query(query) for row in chunk]
+        logger.info(f"Query executed successfully, returned {len(rows)} rows")
+        return rows
+
+    def iter_query(self, query: str, chunk_size: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Выполнение SQL-запроса с выдачей результатов порциями.
+
+        Для PostgreSQL используется серверный курсор: драйвер не буферизует
+        весь результат, в памяти одновременно находится не более chunk_size строк.
+
+        Args:
+            query: SQL-запрос
+            chunk_size: Количество строк в порции
+
+        Yields:
+            Списки словарей с результатами запроса
+        """
         if not self._initialized:
             self.initialize()
 
         try:
             with self.engine.connect() as conn:
-                result = conn.execute(text(query))
-
-                # Преобразование в список словарей
-                columns = result.keys()
-                rows = []
-                for row in result:
-                    rows.append(dict(zip(columns, row)))
+                result = conn.execution_options(
+                    stream_results=True,
+                    yield_per=chunk_size
+                ).execute(text(query))
 
-                logger.info(f"Query executed successfully, returned {len(rows)} rows")
-                return rows
+                # RowMapping использует общий индекс колонок результата вместо zip по каждой строке
+                for chunk in result.mappings().partitions(chunk_size):
+                    yield [dict(row) for row in chunk]
 
         except SQLAlchemyError as e:
             logger.error(f"Database error: {e}")
@@ -104,49 +159,151 @@ class DatabaseService:
         if not self._initialized:
             self.initialize()
 
-        inspector = inspect(self.engine)
+        # Одно соединение на всю интроспекцию вместо выдачи из пула на каждый вызов инспектора
+        with self.engine.connect() as conn:
+            inspector = inspect(conn)
 
-        if table_name:
-            # Получение схемы конкретной таблицы
-            columns = inspector.get_columns(table_name)
-            foreign_keys = inspector.get_foreign_keys(table_name)
+            if table_name:
+                # Получение схемы конкретной таблицы
+                columns = inspector.get_columns(table_name)
+                foreign_keys = inspector.get_foreign_keys(table_name)
 
-            return {
-                "table": table_name,
-                "columns": columns,
-                "foreign_keys": foreign_keys
-            }
-        else:
-            # Получение схемы всех таблиц
-            tables = inspector.get_table_names()
-            schema = {}
-
-            for table in tables:
-                columns = inspector.get_columns(table)
-                foreign_keys = inspector.get_foreign_keys(table)
-
-                schema[table] = {
-                    "columns": [
-                        {
-                            "name": col["name"],
-                            "type": str(col["type"]),
-                            "nullable": col["nullable"],
-                            "primary_key": col.get("primary_key", False)
-                        }
-                        for col in columns
-                    ],
+                return {
+                    "table": table_name,
+                    "columns": columns,
                     "foreign_keys": foreign_keys
                 }
 
-            return schema
+            # Получение схемы всех таблиц: пакетная рефлексия (в PostgreSQL -
+            # по одному запросу к каталогу на колонки и внешние ключи всех таблиц)
+            tables = inspector.get_table_names()
+            multi_columns = inspector.get_multi_columns()
+            multi_foreign_keys = inspector.get_multi_foreign_keys()
+
+        schema = {}
+
+        for table in tables:
+            columns = multi_columns.get((None, table), [])
+            foreign_keys = multi_foreign_keys.get((None, table), [])
+
+            schema[table] = {
+                "columns": [
+                    {
+                        "name": col["name"],
+                        "type": str(col["type"]),
+                        "nullable": col["nullable"],
+                        "primary_key": col.get("primary_key", False)
+                    }
+                    for col in columns
+                ],
+                "foreign_keys": foreign_keys
+            }
+
+        return schema
+
+    def schema_fingerprint(self) -> str:
+        """
+        Дешевый отпечаток схемы БД, меняющийся при любом DDL.
+
+        Returns:
+            Хэш, идентифицирующий текущую версию схемы
+        """
+        if not self._initialized:
+            self.initialize()
+
+        with self.engine.connect() as conn:
+            if self.engine.dialect.name == "sqlite":
+                version = conn.execute(
+                    text("SELECT group_concat(sql, ';') FROM (SELECT sql FROM sqlite_master ORDER BY name)")
+                ).scalar()
+            else:
+                version = conn.execute(text(_PG_SCHEMA_FINGERPRINT_SQL)).scalar()
+
+        return hashlib.sha1(f"{self.engine.url}|{version}".encode()).hexdigest()
 
     def get_table_info_for_llm(self) -> str:
         """
         Получение отформатированной информации о таблицах для контекста LLM.
 
+        Описание схемы кэшируется в памяти и в db_schema_cache_dir по отпечатку
+        схемы, поэтому полная интроспекция выполняется только после изменения DDL,
+        а не при каждом запуске процесса. Отпечаток перепроверяется не чаще раза
+        в db_schema_check_ttl_seconds.
+
         Returns:
             Отформатированная строка со схемами таблиц
         """
+        now = time.monotonic()
+        if self._table_info is not None and now - self._schema_checked_at < settings.db_schema_check_ttl_seconds:
+            return self._table_info[1]
+
+        fingerprint = self.schema_fingerprint()
+        self._schema_checked_at = now
+
+        if self._table_info is None or self._table_info[0] != fingerprint:
+            table_info = self._read_cached_table_info(fingerprint)
+            if table_info is None:
+                table_info = self._build_table_info()
+                self._write_cached_table_info(fingerprint, table_info)
+            self._table_info = (fingerprint, table_info)
+
+        return self._table_info[1]
+
+    @staticmethod
+    def _schema_cache_path(fingerprint: str) -> Optional[Path]:
+        if not settings.db_schema_cache_dir:
+            return None
+        return Path(settings.db_schema_cache_dir) / f"schema_{fingerprint}.txt"
+
+    def _read_cached_table_info(self, fingerprint: str) -> Optional[str]:
+        cache_path = self._schema_cache_path(fingerprint)
+        if cache_path is None:
+            return None
+
+        try:
+            table_info = cache_path.read_text(encoding="utf-8")
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Failed to read table info cache: {e}")
+            return None
+
+        logger.info(f"Loaded table info from cache: {cache_path}")
+        return table_info
+
+    def _write_cached_table_info(self, fingerprint: str, table_info: str):
+        """
+        Сохранение описания схемы на диск.
+
+        Каталог создается с правами 0700, файл - с правами 0600; запись идет
+        во временный файл с атомарной заменой. Файлы прежних отпечатков удаляются.
+
+        Args:
+            fingerprint: Отпечаток схемы
+            table_info: Описание схемы
+        """
+        cache_path = self._schema_cache_path(fingerprint)
+        if cache_path is None:
+            return
+
+        cache_dir = cache_path.parent
+        tmp_path = cache_dir / f".{cache_path.name}.{os.getpid()}.tmp"
+        try:
+            cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            cache_dir.chmod(0o700)
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(table_info)
+            os.replace(tmp_path, cache_path)
+
+            for stale_path in cache_dir.glob("schema_*.txt"):
+                if stale_path != cache_path:
+                    stale_path.unlink(missing_ok=True)
+        except OSError as e:
+            logger.warning(f"Failed to write table info cache: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    def _build_table_info(self) -> str:
         schema = self.get_table_schema()
 
         info_parts = ["Database Schema:\n"]
@@ -194,30 +351,15 @@ class DatabaseService:
         if first_word not in allowed_ops:
             return False, f"Query must start with one of: {', '.join(allowed_ops)}. Got: {first_word}"
 
-        # Проверка 2: Поиск опасных команд SQL (word boundaries для точности)
-        dangerous_commands = [
-            r'\bDELETE\b', r'\bDROP\b', r'\bTRUNCATE\b',
-            r'\bALTER\b', r'\bCREATE\b', r'\bINSERT\b',
-            r'\bUPDATE\b', r'\bEXECUTE\b', r'\bEXEC\b',
-            r'\bGRANT\b', r'\bREVOKE\b'
-        ]
-
-        for pattern in dangerous_commands:
-            if re.search(pattern, query_upper):
-                cmd = pattern.strip(r'\b').strip('\\')
-                # Проверка, действительно ли команда разрешена
-                if cmd not in allowed_ops:
-                    return False, f"Dangerous operation '{cmd}' detected in query. Only {', '.join(allowed_ops)} operations are permitted."
-
-        # Проверка 3: Поиск опасных паттернов stored procedures
-        dangerous_patterns = [
-            (r'xp_', 'xp_'),
-            (r'sp_', 'sp_'),
-        ]
-
-        for pattern, name in dangerous_patterns:
-            if re.search(pattern, query_upper):
-                return False, f"Dangerous pattern '{name}' detected in query"
+        # Проверки 2 и 3: опасные команды SQL и префиксы хранимых процедур
+        # одним проходом скомпилированного выражения
+        for match in _DANGEROUS_SQL_RE.finditer(query_upper):
+            cmd, procedure_prefix = match.groups()
+            if procedure_prefix:
+                return False, f"Dangerous pattern '{procedure_prefix.lower()}' detected in query"
+            # Проверка, действительно ли команда разрешена
+            if cmd not in allowed_ops:
+                return False, f"Dangerous operation '{cmd}' detected in query. Only {', '.join(allowed_ops)} operations are permitted."
 
         # Проверка 4: Защита от SQL-инъекций через множественные выражения
         # Допускается точка с запятой только в конце
@@ -0,0 +1,358 @@
+"""Сервис хранения истории чатов, отзывов и результатов оценок (Redis или память процесса)."""
+import time
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Optional
+import orjson
+from loguru import logger
+
+try:
+    from redis import asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    logger.warning("Redis package not available. Install with: pip install redis")
+
+from app.config import settings
+from app.models.schemas import Message
+from app.utils.cache import QueryCache
+
+
+_CHAT_KEY_PREFIX = "chat:"
+_FEEDBACK_STREAM_KEY = "feedback"
+_STATS_KEY = "chat_stats"
+# Сессия -> время последнего сообщения; истекшие по TTL записи удаляются при подсчете
+_SESSIONS_KEY = "chat_sessions"
+# Сессия -> число сообщений, учтенных в счетчике messages
+_SESSION_LENGTHS_KEY = "chat_session_lengths"
+_EVALUATION_KEY_PREFIX = "evaluation:"
+
+# Атомарное удаление истекших сессий: их сообщения вычитаются из счетчика messages
+_PRUNE_SESSIONS_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local removed = 0
+for _, session_id in ipairs(expired) do
+    removed = removed + tonumber(redis.call('HGET', KEYS[2], session_id) or 0)
+    redis.call('HDEL', KEYS[2], session_id)
+    redis.call('ZREM', KEYS[1], session_id)
+end
+if removed ~= 0 then
+    redis.call('HINCRBY', KEYS[3], 'messages', -removed)
+end
+return #expired
+"""
+
+
+class HistoryService:
+    """Хранилище истории чатов и отзывов.
+
+    При заданном REDIS_URL состояние хранится в Redis (общее для всех воркеров,
+    сессии истекают через history_ttl_seconds), иначе - в памяти процесса
+    (не более history_max_sessions сессий, давно неактивные вытесняются).
+    В обоих случаях хранятся последние history_max_messages сообщений сессии
+    в сериализованном JSON-виде; модели Message создаются только при чтении истории.
+    Отзывов хранится не более history_max_feedback, счетчики /stats учитывают все.
+    """
+
+    def __init__(self):
+        self.redis = None
+        self._prune_sessions = None
+        self._chat_history: "OrderedDict[str, List[str]]" = OrderedDict()
+        # Параллельно хранимые {"role", "content"} для передачи в оркестратор без пересборки
+        self._conversations: Dict[str, List[Dict[str, str]]] = {}
+        self._feedback: "deque[bytes]" = deque(maxlen=settings.history_max_feedback)
+        self._evaluation_jobs = QueryCache(
+            max_size=settings.evaluation_max_jobs,
+            ttl_seconds=settings.evaluation_job_ttl_seconds
+        )
+        # Счетчики для /stats, обновляемые при записи
+        self._message_count = 0
+        self._feedback_count = 0
+        self._rating_sum = 0.0
+        self._initialized = False
+
+    def initialize(self):
+        try:
+            if not settings.redis_url:
+                logger.info("REDIS_URL not configured, chat history is kept in memory")
+            elif not REDIS_AVAILABLE:
+                logger.warning("Redis package is not installed, chat history is kept in memory")
+            else:
+                logger.info(f"Connecting chat history store to Redis: {settings.redis_url}")
+                self.redis = aioredis.Redis.from_url(
+                    settings.redis_url,
+                    max_connections=settings.redis_max_connections
+                )
+                self._prune_sessions = self.redis.register_script(_PRUNE_SESSIONS_SCRIPT)
+
+            self._initialized = True
+
+        except Exception as e:
+            logger.error(f"Failed to initialize history service: {e}")
+            raise
+
+    async def append_message(self, session_id: str, message: Message):
+        """
+        Добавление сообщения в историю сессии.
+
+        Args:
+            session_id: Идентификатор сессии
+            message: Сообщение
+        """
+        if not self._initialized:
+            self.initialize()
+
+        max_messages = settings.history_max_messages
+        raw_message = message.model_dump_json()
+
+        if self.redis is None:
+            history = self._chat_history.get(session_id)
+            if history is None:
+                history = self._chat_history[session_id] = []
+                conversation = self._conversations[session_id] = []
+                self._evict_sessions()
+            else:
+                self._chat_history.move_to_end(session_id)
+                conversation = self._conversations[session_id]
+
+            history.append(raw_message)
+            conversation.append({"role": message.role.value, "content": message.content})
+            self._message_count += 1
+            if len(history) > max_messages:
+                del history[0]
+                del conversation[0]
+                self._message_count -= 1
+            return
+
+        key = _CHAT_KEY_PREFIX + session_id
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.rpush(key, raw_message)
+            pipe.ltrim(key, -max_messages, -1)
+            pipe.expire(key, settings.history_ttl_seconds)
+            pipe.hincrby(_STATS_KEY, "messages", 1)
+            pipe.zadd(_SESSIONS_KEY, {session_id: time.time()})
+            pipe.hincrby(_SESSION_LENGTHS_KEY, session_id, 1)
+            length, _, _, _, _, counted = await pipe.execute()
+
+        # Учтенная длина расходится с фактической после обрезки списка или после
+        # истечения сессии по TTL, если она возобновилась до очистки в get_stats
+        drift = counted - min(length, max_messages)
+        if drift:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hincrby(_SESSION_LENGTHS_KEY, session_id, -drift)
+                pipe.hincrby(_STATS_KEY, "messages", -drift)
+                await pipe.execute()
+
+    def _evict_sessions(self):
+        """Вытеснение давно неактивных сессий сверх history_max_sessions."""
+        while len(self._chat_history) > settings.history_max_sessions:
+            session_id, evicted = self._chat_history.popitem(last=False)
+            del self._conversations[session_id]
+            self._message_count -= len(evicted)
+
+    async def get_messages(self, session_id: str) -> Optional[List[Message]]:
+        """
+        Получение истории сессии.
+
+        Args:
+            session_id: Идентификатор сессии
+
+        Returns:
+            Список сообщений или None, если сессия не найдена
+        """
+        if not self._initialized:
+            self.initialize()
+
+        if self.redis is None:
+            raw_messages = self._chat_history.get(session_id)
+            if raw_messages is not None:
+                self._chat_history.move_to_end(session_id)
+        else:
+            raw_messages = await self.redis.lrange(_CHAT_KEY_PREFIX + session_id, 0, -1)
+
+        if not raw_messages:
+            return None
+
+        return [Message.model_validate_json(raw) for raw in raw_messages]
+
+    async def get_conversation(
+        self,
+        session_id: str,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, str]]:
+        """
+        История сессии в виде {"role", "content"} для передачи в оркестратор.
+
+        В памяти процесса список поддерживается при записи; без limit он
+        возвращается без копирования, поэтому изменять его нельзя.
+
+        Args:
+            session_id: Идентификатор сессии
+            limit: Количество последних сообщений (None - вся история)
+
+        Returns:
+            Список сообщений (пустой, если сессия не найдена)
+        """
+        if not self._initialized:
+            self.initialize()
+
+        if self.redis is None:
+            conversation = self._conversations.get(session_id)
+            if conversation is None:
+                return []
+            self._chat_history.move_to_end(session_id)
+            return conversation[-limit:] if limit else conversation
+
+        start = -limit if limit else 0
+        raw_messages = await self.redis.lrange(_CHAT_KEY_PREFIX + session_id, start, -1)
+        conversation = []
+        for raw in raw_messages:
+            message = orjson.loads(raw)
+            conversation.append({"role": message["role"], "content": message["content"]})
+        return conversation
+
+    async def clear(self, session_id: str) -> bool:
+        """
+        Удаление истории сессии.
+
+        Args:
+            session_id: Идентификатор сессии
+
+        Returns:
+            True, если сессия существовала
+        """
+        if not self._initialized:
+            self.initialize()
+
+        if self.redis is None:
+            messages = self._chat_history.pop(session_id, None)
+            if messages is None:
+                return False
+            del self._conversations[session_id]
+            self._message_count -= len(messages)
+            return True
+
+        key = _CHAT_KEY_PREFIX + session_id
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            pipe.hget(_SESSION_LENGTHS_KEY, session_id)
+            pipe.hdel(_SESSION_LENGTHS_KEY, session_id)
+            pipe.zrem(_SESSIONS_KEY, session_id)
+            deleted, counted, _, _ = await pipe.execute()
+
+        if counted:
+            await self.redis.hincrby(_STATS_KEY, "messages", -int(counted))
+
+        return bool(deleted)
+
+    async def add_feedback(self, entry: Dict[str, Any]):
+        """
+        Сохранение отзыва пользователя.
+
+        Args:
+            entry: Отзыв (session_id, message_id, rating, comment, timestamp)
+        """
+        if not self._initialized:
+            self.initialize()
+
+        if self.redis is None:
+            self._feedback.append(orjson.dumps(entry))
+            self._feedback_count += 1
+            self._rating_sum += entry["rating"]
+            return
+
+        fields = {key: str(value) for key, value in entry.items() if value is not None}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xadd(
+                _FEEDBACK_STREAM_KEY,
+                fields,
+                maxlen=settings.history_max_feedback,
+                approximate=True
+            )
+            pipe.hincrby(_STATS_KEY, "feedback", 1)
+            pipe.hincrbyfloat(_STATS_KEY, "rating_sum", entry["rating"])
+            await pipe.execute()
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """
+        Агрегированная статистика по сессиям и отзывам.
+
+        Returns:
+            Словарь с total_sessions, total_messages, total_feedback, average_rating
+        """
+        if not self._initialized:
+            self.initialize()
+
+        if self.redis is None:
+            total_feedback = self._feedback_count
+            rating_sum = self._rating_sum
+            total_sessions = len(self._chat_history)
+            total_messages = self._message_count
+        else:
+            await self._prune_sessions(
+                keys=[_SESSIONS_KEY, _SESSION_LENGTHS_KEY, _STATS_KEY],
+                args=[time.time() - settings.history_ttl_seconds]
+            )
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.zcard(_SESSIONS_KEY)
+                pipe.hgetall(_STATS_KEY)
+                total_sessions, stats = await pipe.execute()
+
+            total_messages = int(stats.get(b"messages", 0))
+            total_feedback = int(stats.get(b"feedback", 0))
+            rating_sum = float(stats.get(b"rating_sum", 0))
+
+        return {
+            "total_sessions": total_sessions,
+            "total_messages": total_messages,
+            "total_feedback": total_feedback,
+            "average_rating": rating_sum / total_feedback if total_feedback else 0
+        }
+
+    async def save_evaluation_job(self, job_id: str, job: Dict[str, Any]):
+        """
+        Сохранение состояния фоновой оценки (истекает через evaluation_job_ttl_seconds).
+
+        Args:
+            job_id: Идентификатор задачи
+            job: Сериализуемое состояние задачи
+        """
+        if not self._initialized:
+            self.initialize()
+
+        if self.redis is None:
+            self._evaluation_jobs.set(job_id, job)
+            return
+
+        await self.redis.set(
+            _EVALUATION_KEY_PREFIX + job_id,
+            orjson.dumps(job),
+            ex=settings.evaluation_job_ttl_seconds
+        )
+
+    async def get_evaluation_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Получение состояния фоновой оценки.
+
+        Args:
+            job_id: Идентификатор задачи
+
+        Returns:
+            Состояние задачи или None, если задача не найдена или истекла
+        """
+        if not self._initialized:
+            self.initialize()
+
+        if self.redis is None:
+            return self._evaluation_jobs.get(job_id)
+
+        raw_job = await self.redis.get(_EVALUATION_KEY_PREFIX + job_id)
+        return orjson.loads(raw_job) if raw_job is not None else None
+
+    async def close(self):
+        if self.redis is not None:
+            await self.redis.aclose()
+            logger.info("Redis connection closed")
+
+
+# Глобальный экземпляр сервиса истории
+history_service = HistoryService()
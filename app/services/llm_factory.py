@@ -1,5 +1,7 @@
 """Фабрика LLM для создания экземпляров моделей."""
+from functools import lru_cache
 from typing import Optional, Union
+from langchain_core.messages import BaseMessage
 from langchain_openai import ChatOpenAI
 from langchain_community.llms import Ollama
 from loguru import logger
@@ -80,6 +82,20 @@ class LLMFactory:
         )
 
 
+@lru_cache(maxsize=8)
 def get_llm(**kwargs) -> Union[ChatOpenAI, Ollama]:
-    """Получение экземпляра LLM по умолчанию."""
+    """Получение экземпляра LLM по умолчанию.
+
+    Экземпляры кэшируются по параметрам: агенты с одинаковыми настройками
+    используют общий клиент и его пул HTTP-соединений.
+    """
     return LLMFactory.create_llm(**kwargs)
+
+
+def message_text(message: Union[BaseMessage, str]) -> str:
+    """Получение текста ответа LLM.
+
+    Chat-модели (ChatOpenAI) возвращают сообщения, а Ollama - строки,
+    поэтому проверка типа выполняется одним isinstance без hasattr.
+    """
+    return message if isinstance(message, str) else message.content
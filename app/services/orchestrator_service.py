@@ -1,13 +1,33 @@
 """Сервис-оркестратор для координации множественных агентов."""
 import asyncio
-from typing import Dict, Any, List, Optional
+import hashlib
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, AsyncIterator
 from loguru import logger
 
 from app.agents.router_agent import router_agent
-from app.agents.sql_agent import sql_agent
-from app.agents.rag_agent import rag_agent
-from app.agents.web_search_agent import web_search_agent
-from app.services.llm_factory import get_llm
+from app.services.llm_factory import get_llm, message_text
+from app.utils.cache import QueryCache
+
+
+# Агенты импортируются при первом использовании: SQL-агент тянет SQLAlchemy,
+# веб-поиск - клиент Tavily, и запросы к одному агенту не загружают остальные
+@lru_cache(maxsize=None)
+def _sql_agent():
+    from app.agents.sql_agent import sql_agent
+    return sql_agent
+
+
+@lru_cache(maxsize=None)
+def _rag_agent():
+    from app.agents.rag_agent import rag_agent
+    return rag_agent
+
+
+@lru_cache(maxsize=None)
+def _web_search_agent():
+    from app.agents.web_search_agent import web_search_agent
+    return web_search_agent
 
 
 class OrchestratorService:
@@ -25,6 +45,8 @@ class OrchestratorService:
         self.router = router_agent
         self.llm = None
         self._initialized = False
+        # Готовые ответы на повторяющиеся запросы (маршрутизация + агенты + синтез)
+        self._result_cache = QueryCache(max_size=4096, ttl_seconds=300)
 
     def initialize(self):
         try:
@@ -71,11 +93,17 @@ class OrchestratorService:
         if not self._initialized:
             self.initialize()
 
+        cache_key = self._result_cache_key(query)
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Query result cache hit: {query[:100]}")
+            return dict(cached)
+
         try:
             logger.info(f"Processing query: {query[:100]}...")
 
             # Шаг 1: Маршрутизация запроса
-            routing_decision = self.router.route(query)
+            routing_decision = await self.router.route(query)
 
             logger.info(
                 f"Routing: tool={routing_decision['tool']}, "
@@ -97,6 +125,9 @@ class OrchestratorService:
 
             logger.success(f"Query processed successfully using {tool}")
 
+            if is_cacheable_result(result):
+                self._result_cache.set(cache_key, dict(result))
+
             return result
 
         except Exception as e:
@@ -109,6 +140,92 @@ class OrchestratorService:
                 "error": str(e)
             }
 
+    async def process_query_stream(
+        self,
+        query: str,
+        use_history: bool = True,
+        conversation_history: Optional[List[Dict[str, str]]] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Потоковая обработка запроса: решение маршрутизатора, затем текст ответа.
+
+        Ответ RAG-агента передается по токенам по мере генерации, ответы остальных
+        агентов - одним фрагментом после выполнения.
+
+        Args:
+            query: Запрос пользователя
+            use_history: Использовать ли историю беседы
+            conversation_history: Предыдущие сообщения беседы
+
+        Yields:
+            События {"type": "routing", ...}, {"type": "sources", ...},
+            {"type": "token", "text": ...} и завершающее {"type": "done", "result": ...}
+            с тем же словарем, что возвращает process_query
+        """
+        if not self._initialized:
+            self.initialize()
+
+        cache_key = self._result_cache_key(query)
+        cached = self._result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Query result cache hit: {query[:100]}")
+            yield {"type": "routing", "routing_decision": cached.get("routing_decision", {})}
+            yield {"type": "token", "text": cached["answer"]}
+            yield {"type": "done", "result": dict(cached)}
+            return
+
+        try:
+            logger.info(f"Processing streaming query: {query[:100]}...")
+
+            routing_decision = await self.router.route(query)
+            yield {"type": "routing", "routing_decision": routing_decision}
+
+            tool = routing_decision["tool"]
+
+            if tool == "RAG":
+                rag_agent = _rag_agent()
+                if not rag_agent._initialized:
+                    rag_agent.initialize(load_docs=False)
+
+                result = None
+                async for event in rag_agent.answer_question_stream(query, top_k=5):
+                    if event["type"] == "done":
+                        result = self._format_rag_result(query, event["result"])
+                    else:
+                        yield event
+            elif tool == "MULTIPLE":
+                result = None
+                async for event in self._execute_multiple_agents_stream(query, routing_decision):
+                    if event["type"] == "done":
+                        result = event["result"]
+                    else:
+                        yield event
+            else:
+                result = await self._execute_single_agent(query, tool)
+                yield {"type": "token", "text": result["answer"]}
+
+            result["routing_decision"] = routing_decision
+
+            if is_cacheable_result(result):
+                self._result_cache.set(cache_key, dict(result))
+
+            yield {"type": "done", "result": result}
+
+        except Exception as e:
+            logger.error(f"Error processing streaming query: {e}")
+            yield {"type": "done", "result": {
+                "success": False,
+                "answer": f"Произошла ошибка при обработке запроса: {str(e)}",
+                "tools_used": [],
+                "sources": [],
+                "error": str(e)
+            }}
+
+    @staticmethod
+    def _result_cache_key(query: str) -> str:
+        """Ключ кэша ответов: хэш запроса без учета регистра и лишних пробелов."""
+        return hashlib.sha1(" ".join(query.casefold().split()).encode()).hexdigest()
+
     async def _execute_single_agent(
         self,
         query: str,
@@ -150,67 +267,105 @@ class OrchestratorService:
         Returns:
             Агрегированный результат
         """
+        result = None
+        async for event in self._execute_multiple_agents_stream(query, routing_decision):
+            if event["type"] == "done":
+                result = event["result"]
+        return result
+
+    async def _execute_multiple_agents_stream(
+        self,
+        query: str,
+        routing_decision: Dict[str, Any]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Параллельное выполнение нескольких агентов с потоковым синтезом ответа.
+
+        Args:
+            query: Запрос пользователя
+            routing_decision: Решение о маршрутизации со списком инструментов
+
+        Yields:
+            События {"type": "token", "text": ...} синтезируемого ответа
+            и завершающее {"type": "done", "result": ...} с агрегированным результатом
+        """
         tools = routing_decision.get("tools", [])
 
         if not tools:
             logger.warning("No tools specified for MULTIPLE, falling back to RAG")
-            return await self._execute_rag_agent(query)
+            result = await self._execute_rag_agent(query)
+            yield {"type": "token", "text": result["answer"]}
+            yield {"type": "done", "result": result}
+            return
 
         logger.info(f"Executing multiple agents: {tools}")
 
         # Создание задач для каждого агента
-        tasks = []
-        for tool in tools:
-            if tool == "SQL":
-                tasks.append(self._execute_sql_agent(query))
-            elif tool == "RAG":
-                tasks.append(self._execute_rag_agent(query))
-            elif tool == "WEB_SEARCH":
-                tasks.append(self._execute_web_search_agent(query))
+        runners = {
+            "SQL": self._execute_sql_agent,
+            "RAG": self._execute_rag_agent,
+            "WEB_SEARCH": self._execute_web_search_agent
+        }
+        selected = [tool for tool in tools if tool in runners]
 
         # Параллельное выполнение всех агентов
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        results = await asyncio.gather(
+            *(runners[tool](query) for tool in selected),
+            return_exceptions=True
+        )
 
-        # Фильтрация исключений
+        # Ошибки отдельных агентов не прерывают ответ, а попадают в tools_used
         valid_results = []
-        for i, result in enumerate(results):
+        failed_tools_used = []
+        for tool, result in zip(selected, results):
             if isinstance(result, Exception):
-                logger.error(f"Agent {tools[i]} failed: {result}")
+                logger.error(f"Agent {tool} failed: {result}")
+                error = str(result)
             elif result.get("success", False):
                 valid_results.append(result)
+                continue
+            else:
+                error = result.get("answer", "Unknown error")
+
+            failed_tools_used.append({
+                "tool_type": tool.lower(),
+                "query": query,
+                "result_summary": f"error: {error}"
+            })
 
         if not valid_results:
-            return {
+            result = {
                 "success": False,
                 "answer": "Не удалось получить результаты ни от одного агента.",
-                "tools_used": [],
+                "tools_used": failed_tools_used,
                 "sources": []
             }
+            yield {"type": "token", "text": result["answer"]}
+            yield {"type": "done", "result": result}
+            return
 
         # Агрегация результатов
-        aggregated = await self._aggregate_results(query, valid_results, tools)
-
-        return aggregated
+        async for event in self._aggregate_results_stream(query, valid_results, tools):
+            if event["type"] == "done":
+                event["result"]["tools_used"].extend(failed_tools_used)
+            yield event
 
     async def _execute_sql_agent(self, query: str) -> Dict[str, Any]:
         try:
+            sql_agent = _sql_agent()
+
             # Инициализация при необходимости
             if not sql_agent._initialized:
                 sql_agent.initialize()
 
-            # Выполнение запроса
-            result = sql_agent.execute_query(query, validate=True)
+            # Генерация SQL, выполнение и форматирование ответа: вызовы LLM асинхронные,
+            # запрос к БД выполняется в отдельном потоке
+            result = await sql_agent.execute_and_format(query, validate=True)
 
             if result["success"]:
-                # Форматирование результатов
-                formatted_answer = sql_agent.format_results(
-                    result["results"],
-                    query
-                )
-
                 return {
                     "success": True,
-                    "answer": formatted_answer,
+                    "answer": result["answer"],
                     "tool": "SQL",
                     "tools_used": [{
                         "tool_type": "sql",
@@ -244,38 +399,16 @@ class OrchestratorService:
 
     async def _execute_rag_agent(self, query: str) -> Dict[str, Any]:
         try:
+            rag_agent = _rag_agent()
+
             # Инициализация при необходимости
             if not rag_agent._initialized:
                 rag_agent.initialize(load_docs=False)
 
             # Ответ на вопрос
-            result = rag_agent.answer_question(query, top_k=5)
+            result = await rag_agent.answer_question(query, top_k=5)
 
-            if result["success"]:
-                return {
-                    "success": True,
-                    "answer": result["answer"],
-                    "tool": "RAG",
-                    "tools_used": [{
-                        "tool_type": "rag",
-                        "query": query,
-                        "result_summary": f"Найдено {result['relevant_chunks']} релевантных документов",
-                        "metadata": {
-                            "retrieved_chunks": result["retrieved_chunks"],
-                            "relevant_chunks": result["relevant_chunks"],
-                            "top_similarity": result.get("top_similarity", 0.0)
-                        }
-                    }],
-                    "sources": [f"documentation: {src}" for src in result["sources"]]
-                }
-            else:
-                return {
-                    "success": False,
-                    "answer": result["answer"],
-                    "tool": "RAG",
-                    "tools_used": [],
-                    "sources": []
-                }
+            return self._format_rag_result(query, result)
 
         except Exception as e:
             logger.error(f"RAG Agent error: {e}")
@@ -287,8 +420,39 @@ class OrchestratorService:
                 "sources": []
             }
 
+    @staticmethod
+    def _format_rag_result(query: str, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Приведение ответа RAG-агента к формату результата оркестратора."""
+        if result["success"]:
+            return {
+                "success": True,
+                "answer": result["answer"],
+                "tool": "RAG",
+                "tools_used": [{
+                    "tool_type": "rag",
+                    "query": query,
+                    "result_summary": f"Найдено {result['relevant_chunks']} релевантных документов",
+                    "metadata": {
+                        "retrieved_chunks": result["retrieved_chunks"],
+                        "relevant_chunks": result["relevant_chunks"],
+                        "top_similarity": result.get("top_similarity", 0.0)
+                    }
+                }],
+                "sources": [f"documentation: {src}" for src in result["sources"]]
+            }
+        else:
+            return {
+                "success": False,
+                "answer": result["answer"],
+                "tool": "RAG",
+                "tools_used": [],
+                "sources": []
+            }
+
     async def _execute_web_search_agent(self, query: str) -> Dict[str, Any]:
         try:
+            web_search_agent = _web_search_agent()
+
             # Инициализация при необходимости
             if not web_search_agent._initialized:
                 web_search_agent.initialize()
@@ -297,11 +461,11 @@ class OrchestratorService:
             query_lower = query.lower()
             is_news_query = any(kw in query_lower for kw in ['новости', 'последние новости'])
 
-            # Поиск
+            # Поиск (клиент Tavily - в отдельном потоке, LLM - асинхронно)
             if is_news_query:
-                result = web_search_agent.search_news(query, max_results=5, days=7)
+                result = await web_search_agent.asearch_news(query, max_results=5, days=7)
             else:
-                result = web_search_agent.search_and_answer(query, max_results=5)
+                result = await web_search_agent.asearch_and_answer(query, max_results=5)
 
             if result["success"]:
                 return {
@@ -338,12 +502,12 @@ class OrchestratorService:
                 "sources": []
             }
 
-    async def _aggregate_results(
+    async def _aggregate_results_stream(
         self,
         query: str,
         results: List[Dict[str, Any]],
         tools: List[str]
-    ) -> Dict[str, Any]:
+    ) -> AsyncIterator[Dict[str, Any]]:
         """
         Агрегация результатов от нескольких агентов.
 
@@ -352,8 +516,8 @@ class OrchestratorService:
             results: Список результатов агентов
             tools: Список использованных инструментов
 
-        Returns:
-            Агрегированный результат
+        Yields:
+            Фрагменты синтезированного ответа и завершающее событие с агрегированным результатом
         """
         logger.info(f"Aggregating results from {len(results)} agents")
 
@@ -373,45 +537,62 @@ class OrchestratorService:
             all_sources.extend(result.get("sources", []))
 
         # Использование LLM для синтеза финального ответа
-        try:
-            synthesized_answer = await self._synthesize_answer(query, answers, tools)
-        except Exception as e:
-            logger.error(f"Error synthesizing answer: {e}")
-            # Резервный вариант: простая конкатенация
-            synthesized_answer = "\n\n".join(answers)
+        answer_parts = []
+        async for text in self._synthesize_answer_stream(query, answers, tools):
+            answer_parts.append(text)
+            yield {"type": "token", "text": text}
 
-        return {
+        yield {"type": "done", "result": {
             "success": True,
-            "answer": synthesized_answer,
+            "answer": "".join(answer_parts).strip(),
             "tools_used": all_tools_used,
             "sources": list(set(all_sources))  # Remove duplicates
-        }
+        }}
 
-    async def _synthesize_answer(
+    async def _synthesize_answer_stream(
         self,
         query: str,
         answers: List[str],
         tools: List[str]
-    ) -> str:
+    ) -> AsyncIterator[str]:
         """
-        Синтез финального ответа из нескольких ответов агентов.
+        Потоковый синтез финального ответа из нескольких ответов агентов.
 
         Args:
             query: Исходный запрос
             answers: Список ответов от агентов
             tools: Список использованных инструментов
 
-        Returns:
-            Синтезированный ответ
+        Yields:
+            Фрагменты синтезированного ответа
         """
         if len(answers) == 1:
             # Только один ответ, удаляем префикс инструмента
-            return answers[0].split("] ", 1)[-1] if "] " in answers[0] else answers[0]
+            yield _strip_tool_prefix(answers[0])
+            return
+
+        prompt = self._build_synthesis_prompt(query, answers)
+
+        produced = False
+        try:
+            async for chunk in self.llm.astream(prompt):
+                text = message_text(chunk)
+                if text:
+                    produced = True
+                    yield text
+        except Exception as e:
+            logger.error(f"Error in LLM synthesis: {e}")
+            if produced:
+                return
+            # Резервный вариант: конкатенация с разделителями
+            yield "\n\n".join(_strip_tool_prefix(ans) for ans in answers)
 
+    @staticmethod
+    def _build_synthesis_prompt(query: str, answers: List[str]) -> str:
         # Создание промпта для синтеза
         answers_text = "\n\n".join([f"{i+1}. {ans}" for i, ans in enumerate(answers)])
 
-        prompt = f"""Ты - помощник, который создает единый ответ на основе информации от разных источников.
+        return f"""Ты - помощник, который создает единый ответ на основе информации от разных источников.
 
 ЗАДАЧА: Объедини информацию из нескольких источников в один связный и структурированный ответ.
 
@@ -431,14 +612,31 @@ class OrchestratorService:
 
 ЕДИНЫЙ ОТВЕТ:"""
 
-        try:
-            response = self.llm.invoke(prompt)
-            answer = response.content if hasattr(response, 'content') else str(response)
-            return answer.strip()
-        except Exception as e:
-            logger.error(f"Error in LLM synthesis: {e}")
-            # Резервный вариант: конкатенация с разделителями
-            return "\n\n".join([ans.split("] ", 1)[-1] if "] " in ans else ans for ans in answers])
+
+def is_cacheable_result(result: Dict[str, Any]) -> bool:
+    """
+    Можно ли повторно отдавать результат оркестратора из кэша.
+
+    Ошибочные ответы не кэшируются, чтобы следующий запрос мог их исправить;
+    ответы с веб-поиском (в том числе в составе MULTIPLE) зависят от времени запроса.
+
+    Args:
+        result: Результат process_query с routing_decision
+
+    Returns:
+        True, если результат можно кэшировать
+    """
+    if not result.get("success"):
+        return False
+
+    routing_decision = result.get("routing_decision") or {}
+    tools = [routing_decision.get("tool")] + list(routing_decision.get("tools") or [])
+    return "WEB_SEARCH" not in tools
+
+
+def _strip_tool_prefix(answer: str) -> str:
+    """Удаление префикса инструмента "[TOOL] " из ответа агента."""
+    return answer.split("] ", 1)[-1] if "] " in answer else answer
 
 
 # Глобальный экземпляр оркестратора
@@ -1,5 +1,7 @@
 """Сервис RAG (Retrieval-Augmented Generation) для поиска по документам."""
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import bisect
 import os
 from pathlib import Path
 from loguru import logger
@@ -9,17 +11,34 @@ from chromadb.config import Settings
 from chromadb.utils import embedding_functions
 
 from app.config import settings
+from app.utils.batching import MicroBatcher
+from app.utils.cache import QueryCache
 from app.utils.document_loader import Document, load_documents_from_directory
 
 
 class RAGService:
-    """Сервис для поиска документов через векторное сходство."""
+    """Сервис для поиска документов через векторное сходство.
+
+    Одновременные асинхронные поиски собираются в пакет в течение BATCH_WINDOW_MS:
+    эмбеддинги всех запросов пакета вычисляются одним вызовом embedding-функции,
+    а поиск выполняется одним запросом к коллекции.
+    """
+
+    BATCH_WINDOW_MS = 10
+    MAX_BATCH_SIZE = 16
 
     def __init__(self):
         self.client = None
         self.collection = None
         self.embedding_function = None
         self._initialized = False
+        # Эмбеддинги запросов зависят только от текста и модели
+        self._embedding_cache = QueryCache(max_size=10000, ttl_seconds=86400)
+        # Статистика коллекции для /rag/stats; сбрасывается при любом изменении коллекции
+        self._stats_cache = QueryCache(max_size=1, ttl_seconds=5)
+        # Растет при любом изменении коллекции; входит в ETag /rag/stats
+        self._collection_version = 0
+        self._batcher = MicroBatcher(self._process_batch, self.BATCH_WINDOW_MS, self.MAX_BATCH_SIZE)
 
     def initialize(self):
         try:
@@ -104,6 +123,7 @@ class RAGService:
                     embedding_function=self.embedding_function,
                     metadata={"description": "PT Products documentation"}
                 )
+                self._invalidate_stats()
 
             # Загрузка и разбиение документов
             logger.info(f"Loading documents from {directory}...")
@@ -155,6 +175,7 @@ class RAGService:
             total_elapsed = time.time() - start_time
             logger.success(f"All batches processed in {total_elapsed:.2f}s (avg {total_elapsed/total_batches:.2f}s per batch)")
 
+            self._invalidate_stats()
             logger.success(f"Successfully loaded {len(documents)} document chunks into vector store")
 
         except Exception as e:
@@ -165,7 +186,8 @@ class RAGService:
         self,
         query: str,
         top_k: int = 5,
-        filter_metadata: Optional[Dict[str, Any]] = None
+        filter_metadata: Optional[Dict[str, Any]] = None,
+        max_distance: Optional[float] = None
     ) -> List[Dict[str, Any]]:
         """
         Поиск релевантных документов через векторное сходство.
@@ -174,40 +196,196 @@ class RAGService:
             query: Поисковый запрос
             top_k: Количество результатов для возврата
             filter_metadata: Опциональные фильтры по метаданным
+            max_distance: Максимальное расстояние; более далекие результаты отбрасываются
 
         Returns:
             Список релевантных документов со scores
         """
+        try:
+            return self._search_batch([query], top_k, filter_metadata, [max_distance])[0]
+
+        except Exception as e:
+            logger.error(f"Error searching documents: {e}")
+            raise
+
+    def search_batch(
+        self,
+        queries: List[str],
+        top_k: int = 5,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+        max_distance: Optional[float] = None
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Поиск для списка запросов: один вызов эмбеддингов и одно обращение к коллекции.
+
+        Args:
+            queries: Поисковые запросы
+            top_k: Количество результатов на запрос
+            filter_metadata: Опциональные фильтры по метаданным
+            max_distance: Максимальное расстояние; более далекие результаты отбрасываются
+
+        Returns:
+            Списки релевантных документов в порядке запросов
+        """
+        try:
+            return self._search_batch(queries, top_k, filter_metadata, [max_distance] * len(queries))
+
+        except Exception as e:
+            logger.error(f"Error searching documents: {e}")
+            raise
+
+    def _search_batch(
+        self,
+        queries: List[str],
+        top_k: int,
+        filter_metadata: Optional[Dict[str, Any]],
+        max_distances: List[Optional[float]]
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Поиск для нескольких запросов одним обращением к коллекции.
+
+        Args:
+            queries: Поисковые запросы
+            top_k: Количество результатов на запрос
+            filter_metadata: Опциональные фильтры по метаданным (общие для пакета)
+            max_distances: Максимальное расстояние для каждого запроса
+
+        Returns:
+            Списки релевантных документов в порядке запросов
+        """
         if not self._initialized:
             self.initialize()
 
-        try:
-            # Поиск по сходству
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=top_k,
-                where=filter_metadata
-            )
+        # Поиск по сходству
+        results = self.collection.query(
+            query_embeddings=self.embed_queries(queries),
+            n_results=top_k,
+            where=filter_metadata,
+            include=["documents", "metadatas", "distances"]
+        )
 
+        batch_documents = []
+        for q, (query, max_distance) in enumerate(zip(queries, max_distances)):
             # Форматирование результатов
             documents = []
-            if results and results['documents'] and len(results['documents']) > 0:
-                for i in range(len(results['documents'][0])):
+            if results and results['documents'] and len(results['documents']) > q:
+                count = len(results['documents'][q])
+
+                # Результаты отсортированы по возрастанию distance:
+                # отсекаем хвост до построения словарей
+                if max_distance is not None and results['distances']:
+                    count = bisect.bisect_right(results['distances'][q], max_distance)
+
+                for i in range(count):
                     doc = {
-                        'content': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i] if results['metadatas'] else {},
-                        'distance': results['distances'][0][i] if results['distances'] else None,
-                        'id': results['ids'][0][i] if results['ids'] else None
+                        'content': results['documents'][q][i],
+                        'metadata': results['metadatas'][q][i] if results['metadatas'] else {},
+                        'distance': results['distances'][q][i] if results['distances'] else None,
+                        'id': results['ids'][q][i] if results['ids'] else None
                     }
                     documents.append(doc)
 
             logger.debug(f"Search query: '{query}' returned {len(documents)} results")
+            batch_documents.append(documents)
+
+        return batch_documents
+
+    def embed_queries(self, queries: List[str]) -> List[Any]:
+        """
+        Эмбеддинги поисковых запросов с кэшированием по нормализованному тексту.
+
+        Отсутствующие в кэше запросы вычисляются одним вызовом embedding-функции.
 
-            return documents
+        Args:
+            queries: Поисковые запросы
 
+        Returns:
+            Эмбеддинги в порядке запросов
+        """
+        if not self._initialized:
+            self.initialize()
+
+        keys = [" ".join(query.lower().split()) for query in queries]
+        embeddings = [self._embedding_cache.get(key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            computed = self.embedding_function([queries[i] for i in missing])
+            for i, embedding in zip(missing, computed):
+                embeddings[i] = embedding
+                self._embedding_cache.set(keys[i], embedding)
+
+        return embeddings
+
+    async def asearch(
+        self,
+        query: str,
+        top_k: int = 5,
+        filter_metadata: Optional[Dict[str, Any]] = None,
+        max_distance: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Асинхронный поиск релевантных документов.
+
+        Запрос ставится в очередь пакетного поиска. Клиент ChromaDB синхронный,
+        поэтому пакет выполняется в отдельном потоке, не блокируя event loop.
+
+        Args:
+            query: Поисковый запрос
+            top_k: Количество результатов для возврата
+            filter_metadata: Опциональные фильтры по метаданным
+            max_distance: Максимальное расстояние; более далекие результаты отбрасываются
+
+        Returns:
+            Список релевантных документов со scores
+        """
+        return await self._batcher.submit(query, top_k, filter_metadata, max_distance)
+
+    async def _process_batch(
+        self,
+        batch: List[Tuple[str, int, Optional[Dict[str, Any]], Optional[float], asyncio.Future]]
+    ):
+        """
+        Выполнение пакета поисков и передача результатов ожидающим вызовам.
+
+        Запросы с разными top_k или фильтрами выполняются отдельными обращениями к коллекции.
+
+        Args:
+            batch: Кортежи (запрос, top_k, фильтр, max_distance, future) для разрешения
+        """
+        groups: Dict[Tuple[int, str], list] = {}
+        for item in batch:
+            groups.setdefault((item[1], repr(item[2])), []).append(item)
+
+        if len(batch) > 1:
+            logger.info(f"Searching documents for batch of {len(batch)} queries")
+
+        await asyncio.gather(*(self._process_group(items) for items in groups.values()))
+
+    async def _process_group(
+        self,
+        items: List[Tuple[str, int, Optional[Dict[str, Any]], Optional[float], asyncio.Future]]
+    ):
+        _, top_k, filter_metadata, _, _ = items[0]
+
+        try:
+            results = await asyncio.to_thread(
+                self._search_batch,
+                [item[0] for item in items],
+                top_k,
+                filter_metadata,
+                [item[3] for item in items]
+            )
         except Exception as e:
             logger.error(f"Error searching documents: {e}")
-            raise
+            for *_, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for documents, (*_, future) in zip(results, items):
+            if not future.done():
+                future.set_result(documents)
 
     def add_document(
         self,
@@ -238,6 +416,7 @@ class RAGService:
                 metadatas=[metadata or {}]
             )
 
+            self._invalidate_stats()
             logger.debug(f"Added document with ID: {doc_id}")
 
             return doc_id
@@ -258,27 +437,42 @@ class RAGService:
 
         try:
             self.collection.delete(ids=[doc_id])
+            self._invalidate_stats()
             logger.debug(f"Deleted document: {doc_id}")
 
         except Exception as e:
             logger.error(f"Error deleting document: {e}")
             raise
 
+    def _invalidate_stats(self):
+        """Сброс статистики после изменения коллекции."""
+        self._collection_version += 1
+        self._stats_cache.clear()
+
     def get_collection_stats(self) -> Dict[str, Any]:
         """
         Получение статистики коллекции документов.
 
+        Результат кэшируется на несколько секунд, чтобы частые запросы мониторинга
+        не обращались к векторному хранилищу.
+
         Returns:
             Словарь со статистикой коллекции
         """
         if not self._initialized:
             self.initialize()
 
-        return {
-            "total_documents": self.collection.count(),
-            "collection_name": self.collection.name,
-            "embedding_function": str(type(self.embedding_function).__name__)
-        }
+        stats = self._stats_cache.get("stats")
+        if stats is None:
+            stats = {
+                "total_documents": self.collection.count(),
+                "collection_version": self._collection_version,
+                "collection_name": self.collection.name,
+                "embedding_function": str(type(self.embedding_function).__name__)
+            }
+            self._stats_cache.set("stats", stats)
+
+        return dict(stats)
 
     def clear_collection(self):
         if not self._initialized:
@@ -291,6 +485,7 @@ class RAGService:
                 embedding_function=self.embedding_function,
                 metadata={"description": "PT Products documentation"}
             )
+            self._invalidate_stats()
             logger.warning("Cleared all documents from collection")
 
         except Exception as e:
@@ -0,0 +1,83 @@
+"""Семантический кэш ответов чата."""
+import asyncio
+from typing import Any, Dict, List, Optional
+from loguru import logger
+
+from app.config import settings
+from app.services.orchestrator_service import is_cacheable_result
+from app.services.rag_service import rag_service
+from app.utils.cache import SemanticCache
+
+
+class ResponseCache:
+    """
+    Кэш ответов оркестратора по косинусному сходству эмбеддингов запросов.
+
+    Перефразированные запросы (сходство не ниже semantic_cache_threshold)
+    получают сохраненный ответ без маршрутизации и вызова агентов.
+    Эмбеддинги берутся из кэширующего embed_queries RAG-сервиса.
+    """
+
+    def __init__(self, max_size: int = 1024):
+        self._cache = SemanticCache(
+            max_size=max_size,
+            similarity_threshold=settings.semantic_cache_threshold
+        )
+
+    async def get(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Поиск сохраненного ответа на близкий запрос.
+
+        Args:
+            query: Запрос пользователя
+
+        Returns:
+            Результат оркестратора или None при промахе
+        """
+        embedding = await self._embed(query)
+        if embedding is None:
+            return None
+
+        result = self._cache.get(embedding)
+        if result is None:
+            return None
+
+        logger.info(f"Semantic response cache hit: {query[:100]}")
+        return dict(result)
+
+    async def put(self, query: str, result: Dict[str, Any]):
+        """
+        Сохранение ответа оркестратора.
+
+        Ошибочные ответы и ответы с веб-поиском не сохраняются: первые должны
+        пересчитываться, вторые зависят от времени запроса.
+
+        Args:
+            query: Запрос пользователя
+            result: Результат оркестратора
+        """
+        if not is_cacheable_result(result):
+            return
+
+        embedding = await self._embed(query)
+        if embedding is not None:
+            self._cache.set(embedding, dict(result))
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика попаданий в кэш."""
+        return self._cache.stats()
+
+    async def _embed(self, query: str) -> Optional[List[float]]:
+        if not rag_service._initialized or rag_service.embedding_function is None:
+            return None
+
+        try:
+            embeddings = await asyncio.to_thread(rag_service.embed_queries, [query])
+            return embeddings[0]
+        except Exception as e:
+            logger.warning(f"Failed to embed query for response cache: {e}")
+            return None
+
+
+# Глобальный экземпляр кэша ответов
+response_cache = ResponseCache()
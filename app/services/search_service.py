@@ -1,4 +1,5 @@
 """Сервис веб-поиска через Tavily API."""
+import asyncio
 from typing import List, Dict, Any, Optional
 from loguru import logger
 
@@ -98,6 +99,31 @@ class SearchService:
             logger.error(f"Error performing search: {e}")
             return []
 
+    async def asearch(
+        self,
+        query: str,
+        max_results: int = 5,
+        search_depth: str = "basic",
+        include_domains: Optional[List[str]] = None,
+        exclude_domains: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Асинхронная версия search: HTTP-запрос к Tavily выполняется в отдельном потоке.
+
+        Args:
+            query: Поисковый запрос
+            max_results: Максимальное количество результатов
+            search_depth: "basic" или "advanced"
+            include_domains: Список доменов для включения
+            exclude_domains: Список доменов для исключения
+
+        Returns:
+            Список результатов поиска с title, url, content, score
+        """
+        return await asyncio.to_thread(
+            self.search, query, max_results, search_depth, include_domains, exclude_domains
+        )
+
     def _parse_results(self, response: Dict[str, Any]) -> List[Dict[str, Any]]:
         """
         Парсинг ответа Tavily API.
@@ -175,6 +201,25 @@ class SearchService:
             logger.error(f"Error performing news search: {e}")
             return []
 
+    async def asearch_news(
+        self,
+        query: str,
+        max_results: int = 5,
+        days: int = 7
+    ) -> List[Dict[str, Any]]:
+        """
+        Асинхронная версия search_news.
+
+        Args:
+            query: Поисковый запрос
+            max_results: Максимальное количество результатов
+            days: Поиск за последние N дней
+
+        Returns:
+            Список новостных результатов
+        """
+        return await asyncio.to_thread(self.search_news, query, max_results, days)
+
     def get_search_context(
         self,
         query: str,
@@ -0,0 +1,66 @@
+"""Микро-пакетирование одновременных асинхронных запросов."""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+
+class MicroBatcher:
+    """Собирает одновременные запросы в пакет в течение окна window_ms.
+
+    Каждый элемент пакета - кортеж аргументов submit() с future в конце.
+    Пакет передается в process, который обязан разрешить все future.
+    Пакет отправляется досрочно, как только набирается max_batch_size элементов.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[List[Tuple[Any, ...]]], Awaitable[None]],
+        window_ms: float,
+        max_batch_size: int
+    ):
+        """
+        Args:
+            process: Корутина обработки пакета кортежей (*args, future)
+            window_ms: Окно сбора пакета в миллисекундах
+            max_batch_size: Размер пакета, при котором он отправляется без ожидания окна
+        """
+        self._process = process
+        self.window_ms = window_ms
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[Any, ...]] = []
+        self._drain_task: Optional[asyncio.Task] = None
+        # Event loop хранит только слабые ссылки на задачи
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, *args: Any) -> Any:
+        """
+        Постановка запроса в очередь и ожидание результата обработки пакета.
+
+        Args:
+            *args: Аргументы запроса; попадают в пакет как кортеж (*args, future)
+
+        Returns:
+            Результат, переданный в future обработчиком пакета
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((*args, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._spawn(self._process(self._take_pending()))
+        elif self._drain_task is None or self._drain_task.done():
+            self._drain_task = self._spawn(self._drain_after_window())
+
+        return await future
+
+    def _spawn(self, coro: Awaitable[None]) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _take_pending(self) -> List[Tuple[Any, ...]]:
+        batch, self._pending = self._pending, []
+        return batch
+
+    async def _drain_after_window(self):
+        await asyncio.sleep(self.window_ms / 1000)
+        await self._process(self._take_pending())
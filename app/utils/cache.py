@@ -0,0 +1,165 @@
+"""Потокобезопасные кэши для результатов агентов и сервисов."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+
+class QueryCache:
+    """LRU-кэш с ограничением по размеру и времени жизни записей."""
+
+    def __init__(self, max_size: int = 512, ttl_seconds: float = 300):
+        """
+        Args:
+            max_size: Максимальное количество записей в кэше
+            ttl_seconds: Время жизни записи в секундах
+        """
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Получение значения из кэша.
+
+        Args:
+            key: Ключ записи
+
+        Returns:
+            Сохраненное значение или None, если записи нет или она устарела
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        """
+        Сохранение значения в кэш с вытеснением самых старых записей.
+
+        Args:
+            key: Ключ записи
+            value: Сохраняемое значение
+        """
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """Удаление одной записи из кэша."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Полная очистка кэша."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class SemanticCache:
+    """Кэш по косинусному сходству эмбеддингов запросов с FIFO-вытеснением."""
+
+    def __init__(self, max_size: int = 256, similarity_threshold: float = 0.95):
+        """
+        Args:
+            max_size: Максимальное количество записей в кэше
+            similarity_threshold: Минимальное косинусное сходство для попадания в кэш
+        """
+        self.max_size = max_size
+        self.similarity_threshold = similarity_threshold
+        self._embeddings: Optional[np.ndarray] = None
+        self._values: List[Any] = []
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def get(self, embedding: Sequence[float]) -> Optional[Any]:
+        """
+        Поиск значения для ближайшего сохраненного эмбеддинга.
+
+        Args:
+            embedding: Эмбеддинг запроса
+
+        Returns:
+            Сохраненное значение или None, если сходство ниже порога
+        """
+        query = self._normalize(embedding)
+
+        with self._lock:
+            if self._embeddings is None or self._embeddings.shape[1] != query.shape[0]:
+                self._misses += 1
+                return None
+
+            scores = self._embeddings @ query
+            best = int(np.argmax(scores))
+
+            if scores[best] < self.similarity_threshold:
+                self._misses += 1
+                return None
+
+            self._hits += 1
+            return self._values[best]
+
+    def set(self, embedding: Sequence[float], value: Any):
+        """
+        Сохранение значения с вытеснением самой старой записи.
+
+        Args:
+            embedding: Эмбеддинг запроса
+            value: Сохраняемое значение
+        """
+        vector = self._normalize(embedding)[np.newaxis, :]
+
+        with self._lock:
+            if self._embeddings is None or self._embeddings.shape[1] != vector.shape[1]:
+                self._embeddings = vector
+                self._values = [value]
+                return
+
+            self._embeddings = np.vstack([self._embeddings, vector])[-self.max_size:]
+            self._values = (self._values + [value])[-self.max_size:]
+
+    def clear(self):
+        """Полная очистка кэша."""
+        with self._lock:
+            self._embeddings = None
+            self._values = []
+
+    def stats(self) -> Dict[str, Any]:
+        """Статистика попаданий в кэш."""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._values),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / total if total else 0.0
+            }
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._values)
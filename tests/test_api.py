@@ -1,4 +1,7 @@
 """Basic API tests."""
+import json
+from unittest.mock import patch
+
 import pytest
 from fastapi.testclient import TestClient
 
@@ -40,6 +43,296 @@ def test_chat_endpoint():
     assert "tools_used" in data
 
 
+def test_chat_stream_endpoint():
+    """Test streaming chat endpoint emits SSE events and stores the answer."""
+    async def fake_stream(query, **kwargs):
+        yield {"type": "routing", "routing_decision": {"tool": "RAG", "confidence": 0.9}}
+        yield {"type": "token", "text": "При"}
+        yield {"type": "token", "text": "вет"}
+        yield {"type": "done", "result": {
+            "success": True,
+            "answer": "Привет",
+            "tools_used": [],
+            "sources": [],
+            "routing_decision": {"tool": "RAG", "confidence": 0.9}
+        }}
+
+    with patch("app.api.routes.orchestrator.process_query_stream", side_effect=fake_stream):
+        response = client.post(
+            "/api/v1/chat/stream",
+            json={"message": "Привет!", "session_id": "stream-test", "use_history": False}
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        json.loads(line[len("data: "):])
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert [e["type"] for e in events] == ["session", "routing", "token", "token", "done"]
+    assert events[-1]["response"]["message"] == "Привет"
+    assert events[-1]["response"]["tools_used"][0]["tool_type"] == "router"
+
+    history = client.get("/api/v1/history/stream-test").json()
+    assert [m["content"] for m in history["messages"]] == ["Привет!", "Привет"]
+
+
+def test_chat_stream_passes_history():
+    """Test streaming chat forwards the conversation history when use_history is set."""
+    calls = []
+
+    async def fake_stream(query, **kwargs):
+        calls.append(kwargs)
+        yield {"type": "done", "result": {"success": True, "answer": "Ответ", "tools_used": [], "sources": []}}
+
+    with patch("app.api.routes.orchestrator.process_query_stream", side_effect=fake_stream):
+        client.post("/api/v1/chat/stream", json={"message": "Первый", "session_id": "stream-history"})
+        client.post("/api/v1/chat/stream", json={"message": "Второй", "session_id": "stream-history"})
+        client.post(
+            "/api/v1/chat/stream",
+            json={"message": "Третий", "session_id": "stream-history", "use_history": False}
+        )
+
+    assert calls[1]["use_history"] is True
+    assert [m["content"] for m in calls[1]["conversation_history"]][:3] == ["Первый", "Ответ", "Второй"]
+    assert calls[2] == {"use_history": False, "conversation_history": None}
+
+
+def test_chat_stream_rejected_request_is_not_stored():
+    """Test that a stream rejected by the limiter does not persist the user message."""
+    class RacingLimiter:
+        saturated = False
+
+        def try_acquire(self):
+            return False
+
+    with patch("app.api.routes._chat_limiter", RacingLimiter()):
+        response = client.post("/api/v1/chat/stream", json={"message": "Привет!", "session_id": "stream-busy"})
+
+    assert '"type":"error"' in response.text.replace(" ", "")
+    assert client.get("/api/v1/history/stream-busy").status_code == 404
+
+
+def test_evaluation_job_endpoints():
+    """Test background evaluation returns a job id and stores the result."""
+    result = {
+        "query": "Сколько программистов?",
+        "response": "Два",
+        "routing": {"tool": "sql", "confidence": 0.9, "reasoning": "db"},
+        "metrics": {}
+    }
+
+    with patch("app.api.routes.DEEPEVAL_AVAILABLE", True), \
+            patch("app.api.routes._run_evaluation", return_value=result):
+        response = client.post(
+            "/api/v1/evaluate/jobs",
+            json={"query": "Сколько программистов?", "expected_output": "Два"}
+        )
+
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    job = client.get(f"/api/v1/evaluate/jobs/{job_id}").json()
+    assert job["status"] == "completed"
+    assert job["result"]["response"] == "Два"
+
+    assert client.get("/api/v1/evaluate/jobs/missing").status_code == 404
+
+
+def test_evaluate_without_deepeval():
+    """Test evaluation endpoints report 503 when DeepEval is not installed."""
+    payload = {"query": "Сколько программистов?", "expected_output": "Два"}
+
+    with patch("app.api.routes.DEEPEVAL_AVAILABLE", False):
+        assert client.post("/api/v1/evaluate", json=payload).status_code == 503
+        assert client.post("/api/v1/evaluate/jobs", json=payload).status_code == 503
+
+
+def test_evaluate_measures_metrics_concurrently():
+    """Test metric errors are reported per metric without failing the evaluation."""
+    import threading
+    from unittest.mock import MagicMock
+
+    barrier = threading.Barrier(2, timeout=5)
+
+    def make_metric(name, fail=False):
+        metric = MagicMock(__name__=name, threshold=0.7, score=0.9, reason="ok")
+        metric.is_successful.return_value = True
+
+        def measure(test_case):
+            # Both metrics must be running at the same time to pass the barrier
+            barrier.wait()
+            if fail:
+                raise RuntimeError("LLM timeout")
+
+        metric.measure.side_effect = measure
+        return metric
+
+    query_result = {
+        "success": True,
+        "answer": "Два",
+        "sources": [],
+        "tools_used": [],
+        "routing_decision": {"tool": "SQL", "confidence": 0.9, "reasoning": "db"}
+    }
+    payload = {"query": "Сколько программистов?", "expected_output": "Два"}
+
+    with patch("app.api.routes.DEEPEVAL_AVAILABLE", True), \
+            patch("app.api.routes.LLMTestCase", MagicMock(), create=True), \
+            patch("app.api.routes._evaluation_metrics", return_value=[
+                make_metric("Answer Relevancy"),
+                make_metric("Faithfulness", fail=True)
+            ]), \
+            patch("app.api.routes._run_query", return_value=query_result), \
+            patch("app.api.routes.history_service.append_message") as append_message:
+        response = client.post("/api/v1/evaluate", json=payload)
+
+    assert response.status_code == 200
+    assert response.json()["routing"]["tool"] == "sql"
+    append_message.assert_not_called()
+    metrics = response.json()["metrics"]
+    assert metrics["Answer Relevancy"]["passed"] is True
+    assert metrics["Faithfulness"]["passed"] is False
+    assert metrics["Faithfulness"]["reason"] == "Error: LLM timeout"
+
+
+def test_rag_stats_etag():
+    """Test /rag/stats caches the test search and honours If-None-Match."""
+    from unittest.mock import MagicMock
+    from app.utils.cache import QueryCache
+
+    rag_agent = MagicMock(_initialized=True)
+    rag_agent.get_collection_info.return_value = {"total_documents": 7, "collection_version": 1}
+    rag_agent.rag_service.search.return_value = [
+        {"metadata": {"filename": "sandbox.md"}, "distance": 0.2, "content": "PT Sandbox"}
+    ]
+
+    with patch("app.api.routes._rag_agent", return_value=rag_agent), \
+            patch("app.api.routes._rag_stats_cache", QueryCache(max_size=1, ttl_seconds=30)):
+        first = client.get("/api/v1/rag/stats")
+        second = client.get("/api/v1/rag/stats")
+        not_modified = client.get("/api/v1/rag/stats", headers={"If-None-Match": first.headers["etag"]})
+
+        # A reload with the same chunk count but new content bumps the collection version
+        rag_agent.get_collection_info.return_value = {"total_documents": 7, "collection_version": 2}
+        reloaded = client.get("/api/v1/rag/stats", headers={"If-None-Match": first.headers["etag"]})
+
+    assert first.status_code == 200
+    assert first.json()["test_search"]["results_count"] == 1
+    assert second.json() == first.json()
+    assert not_modified.status_code == 304
+    assert reloaded.status_code == 200
+    assert reloaded.headers["etag"] != first.headers["etag"]
+    assert rag_agent.rag_service.search.call_count == 2
+
+
+def test_build_tools_used_normalizes_tool_types():
+    """Test tool types are lower-cased and unknown ones fall back to none."""
+    from app.api.routes import _build_tools_used
+
+    tools_used = _build_tools_used(
+        {"tools_used": [{"tool_type": "SQL"}, {"tool_type": "calculator"}]},
+        "query"
+    )
+
+    assert [tool["tool_type"] for tool in tools_used] == ["sql", "none"]
+
+
+def test_history_pagination():
+    """Test /history pages backwards from the newest messages."""
+    import asyncio
+    from datetime import datetime, timedelta, timezone
+    from app.models.schemas import Message, MessageRole
+    from app.services.history_service import history_service
+
+    started_at = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i in range(5):
+        message = Message(role=MessageRole.USER, content=str(i), timestamp=started_at + timedelta(seconds=i))
+        asyncio.run(history_service.append_message("paged", message))
+
+    first = client.get("/api/v1/history/paged", params={"limit": 2}).json()
+    second = client.get(
+        "/api/v1/history/paged",
+        params={"limit": 2, "before": first["next_before"], "before_offset": first["next_before_offset"]}
+    ).json()
+    last = client.get(
+        "/api/v1/history/paged",
+        params={"limit": 2, "before": second["next_before"], "before_offset": second["next_before_offset"]}
+    ).json()
+
+    assert [m["content"] for m in first["messages"]] == ["3", "4"]
+    assert [m["content"] for m in second["messages"]] == ["1", "2"]
+    assert [m["content"] for m in last["messages"]] == ["0"]
+    assert first["has_more"] and second["has_more"] and not last["has_more"]
+    assert first["total_messages"] == 5
+
+
+def test_history_pagination_with_equal_timestamps():
+    """Test the history cursor does not skip messages that share a timestamp."""
+    import asyncio
+    from datetime import datetime, timezone
+    from app.models.schemas import Message, MessageRole
+    from app.services.history_service import history_service
+
+    same_time = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i in range(5):
+        message = Message(role=MessageRole.USER, content=str(i), timestamp=same_time)
+        asyncio.run(history_service.append_message("paged-same-time", message))
+
+    contents = []
+    params = {"limit": 2}
+    while True:
+        page = client.get("/api/v1/history/paged-same-time", params=params).json()
+        contents = [m["content"] for m in page["messages"]] + contents
+        if not page["has_more"]:
+            break
+        params = {"limit": 2, "before": page["next_before"], "before_offset": page["next_before_offset"]}
+
+    assert contents == ["0", "1", "2", "3", "4"]
+
+
+def test_chat_returns_503_when_saturated():
+    """Test back-pressure on chat endpoints when the concurrency limit is reached."""
+    from app.api.rate_limit import ConcurrencyLimiter
+
+    limiter = ConcurrencyLimiter(limit=0)
+
+    with patch("app.api.routes._chat_limiter", limiter):
+        response = client.post("/api/v1/chat", json={"message": "Привет!"})
+        stream_response = client.post("/api/v1/chat/stream", json={"message": "Привет!"})
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert stream_response.status_code == 503
+
+
+def test_evaluation_metrics_are_copied_per_call():
+    """Test metric objects are built once and each evaluation gets its own copies."""
+    from unittest.mock import MagicMock
+    from app.api.routes import _evaluation_metrics, _metric_prototypes
+
+    class FakeMetric:
+        def __init__(self, **kwargs):
+            self.score = None
+
+    _metric_prototypes.cache_clear()
+    constructor = MagicMock(side_effect=FakeMetric)
+    try:
+        with patch("app.api.routes.AnswerRelevancyMetric", constructor, create=True), \
+                patch("app.api.routes.FaithfulnessMetric", constructor, create=True):
+            first = _evaluation_metrics()
+            second = _evaluation_metrics()
+    finally:
+        _metric_prototypes.cache_clear()
+
+    first[0].score = 0.9
+
+    assert constructor.call_count == 2
+    assert second[0] is not first[0]
+    assert second[0].score is None
+
+
 def test_chat_endpoint_validation():
     """Test chat endpoint validation."""
     # Empty message should fail
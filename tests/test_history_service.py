@@ -0,0 +1,134 @@
+"""Tests for chat history service."""
+import pytest
+from unittest.mock import patch
+
+from app.models.schemas import Message, MessageRole
+from app.services.history_service import HistoryService
+
+
+class TestHistoryService:
+    """Tests for the in-memory history backend."""
+
+    @pytest.fixture
+    def history_service(self):
+        """Create history service without Redis."""
+        service = HistoryService()
+        service._initialized = True
+        return service
+
+    @pytest.mark.asyncio
+    async def test_append_and_get_messages(self, history_service):
+        """Test storing and reading session history."""
+        await history_service.append_message("s1", Message(role=MessageRole.USER, content="Привет"))
+        await history_service.append_message("s1", Message(role=MessageRole.ASSISTANT, content="Здравствуйте"))
+
+        messages = await history_service.get_messages("s1")
+
+        assert [m.content for m in messages] == ["Привет", "Здравствуйте"]
+        assert await history_service.get_messages("missing") is None
+
+    @pytest.mark.asyncio
+    async def test_get_conversation(self, history_service):
+        """Test role/content view of the history follows appends, caps and clears."""
+        with patch("app.services.history_service.settings") as mock_settings:
+            mock_settings.history_max_sessions = 10
+            mock_settings.history_max_messages = 2
+
+            for role, content in ((MessageRole.USER, "a"), (MessageRole.ASSISTANT, "b"), (MessageRole.USER, "c")):
+                await history_service.append_message("s1", Message(role=role, content=content))
+
+        assert await history_service.get_conversation("s1") == [
+            {"role": "assistant", "content": "b"},
+            {"role": "user", "content": "c"}
+        ]
+
+        assert await history_service.get_conversation("s1", limit=1) == [{"role": "user", "content": "c"}]
+
+        await history_service.clear("s1")
+        assert await history_service.get_conversation("s1") == []
+
+    @pytest.mark.asyncio
+    async def test_clear(self, history_service):
+        """Test clearing session history."""
+        await history_service.append_message("s1", Message(role=MessageRole.USER, content="Привет"))
+
+        assert await history_service.clear("s1") is True
+        assert await history_service.clear("s1") is False
+        assert await history_service.get_messages("s1") is None
+
+    @pytest.mark.asyncio
+    async def test_stats(self, history_service):
+        """Test aggregated session and feedback statistics."""
+        await history_service.append_message("s1", Message(role=MessageRole.USER, content="a"))
+        await history_service.append_message("s2", Message(role=MessageRole.USER, content="b"))
+        await history_service.append_message("s2", Message(role=MessageRole.ASSISTANT, content="c"))
+        await history_service.add_feedback({"session_id": "s1", "rating": 5})
+        await history_service.add_feedback({"session_id": "s2", "rating": 2})
+
+        stats = await history_service.get_stats()
+
+        assert stats["total_sessions"] == 2
+        assert stats["total_messages"] == 3
+        assert stats["total_feedback"] == 2
+        assert stats["average_rating"] == 3.5
+
+    @pytest.mark.asyncio
+    async def test_stats_after_clear(self, history_service):
+        """Test that counters are decremented when a session is cleared."""
+        await history_service.append_message("s1", Message(role=MessageRole.USER, content="a"))
+        await history_service.append_message("s1", Message(role=MessageRole.ASSISTANT, content="b"))
+        await history_service.append_message("s2", Message(role=MessageRole.USER, content="c"))
+        await history_service.clear("s1")
+
+        stats = await history_service.get_stats()
+
+        assert stats["total_sessions"] == 1
+        assert stats["total_messages"] == 1
+
+    @pytest.mark.asyncio
+    async def test_limits_evict_least_recent_session_and_old_messages(self, history_service):
+        """Test LRU eviction of sessions and per-session message cap."""
+        with patch("app.services.history_service.settings") as mock_settings:
+            mock_settings.history_max_sessions = 2
+            mock_settings.history_max_messages = 2
+
+            for session_id in ("s1", "s2"):
+                await history_service.append_message(session_id, Message(role=MessageRole.USER, content=session_id))
+            # Touch s1 so that s2 becomes the least recently used session
+            await history_service.get_messages("s1")
+            await history_service.append_message("s3", Message(role=MessageRole.USER, content="s3"))
+            for content in ("a", "b", "c"):
+                await history_service.append_message("s1", Message(role=MessageRole.USER, content=content))
+
+            stats = await history_service.get_stats()
+
+        assert await history_service.get_messages("s2") is None
+        assert [m.content for m in await history_service.get_messages("s1")] == ["b", "c"]
+        assert stats["total_sessions"] == 2
+        assert stats["total_messages"] == 3
+
+    @pytest.mark.asyncio
+    async def test_feedback_is_bounded(self):
+        """Test only the latest feedback entries are kept while stats count all of them."""
+        with patch("app.services.history_service.settings") as mock_settings:
+            mock_settings.history_max_feedback = 2
+            service = HistoryService()
+        service._initialized = True
+
+        for rating in (1, 2, 3):
+            await service.add_feedback({"session_id": "s1", "rating": rating})
+
+        stats = await service.get_stats()
+
+        assert len(service._feedback) == 2
+        assert stats["total_feedback"] == 3
+        assert stats["average_rating"] == 2
+
+    @pytest.mark.asyncio
+    async def test_evaluation_jobs(self, history_service):
+        """Test storing and reading background evaluation state."""
+        await history_service.save_evaluation_job("job1", {"job_id": "job1", "status": "pending"})
+        await history_service.save_evaluation_job("job1", {"job_id": "job1", "status": "completed"})
+
+        assert (await history_service.get_evaluation_job("job1"))["status"] == "completed"
+        assert await history_service.get_evaluation_job("missing") is None
@@ -0,0 +1,119 @@
+"""Tests for Orchestrator service."""
+import pytest
+from unittest.mock import AsyncMock, Mock
+
+from app.services.orchestrator_service import OrchestratorService
+
+
+async def _astream_chunks(parts):
+    for part in parts:
+        yield part
+
+
+@pytest.fixture
+def orchestrator():
+    """Create orchestrator with mocked router and LLM."""
+    service = OrchestratorService()
+    service._initialized = True
+    service.router = Mock()
+    service.llm = Mock()
+    return service
+
+
+class TestOrchestratorService:
+    """Tests for OrchestratorService."""
+
+    @pytest.mark.asyncio
+    async def test_stream_multiple_synthesizes_tokens(self, orchestrator):
+        """Test that MULTIPLE routing streams the synthesized answer."""
+        orchestrator.router.route = AsyncMock(return_value={
+            "tool": "MULTIPLE", "tools": ["SQL", "RAG"], "confidence": 0.9
+        })
+        orchestrator._execute_sql_agent = AsyncMock(return_value={
+            "success": True, "answer": "3 разработчика", "tool": "SQL",
+            "tools_used": [{"tool_type": "sql"}], "sources": ["database"]
+        })
+        orchestrator._execute_rag_agent = AsyncMock(return_value={
+            "success": True, "answer": "Песочница", "tool": "RAG",
+            "tools_used": [{"tool_type": "rag"}], "sources": ["documentation: pt.md"]
+        })
+        orchestrator.llm.astream = Mock(side_effect=lambda prompt: _astream_chunks(["Итог", "овый ответ"]))
+
+        events = [event async for event in orchestrator.process_query_stream("Сколько и что такое?")]
+
+        assert [e["type"] for e in events] == ["routing", "token", "token", "done"]
+        result = events[-1]["result"]
+        assert result["answer"] == "Итоговый ответ"
+        assert sorted(result["sources"]) == ["database", "documentation: pt.md"]
+        assert "[SQL] 3 разработчика" in orchestrator.llm.astream.call_args[0][0]
+
+    @pytest.mark.asyncio
+    async def test_multiple_synthesis_failure_falls_back_to_concatenation(self, orchestrator):
+        """Test that synthesis errors fall back to joined agent answers."""
+        orchestrator.router.route = AsyncMock(return_value={
+            "tool": "MULTIPLE", "tools": ["SQL", "RAG"], "confidence": 0.9
+        })
+        orchestrator._execute_sql_agent = AsyncMock(return_value={
+            "success": True, "answer": "A", "tool": "SQL", "tools_used": [], "sources": []
+        })
+        orchestrator._execute_rag_agent = AsyncMock(return_value={
+            "success": True, "answer": "B", "tool": "RAG", "tools_used": [], "sources": []
+        })
+        orchestrator.llm.astream = Mock(side_effect=Exception("LLM error"))
+
+        result = await orchestrator.process_query("Сколько и что такое?")
+
+        assert result["success"] is True
+        assert result["answer"] == "A\n\nB"
+
+    @pytest.mark.asyncio
+    async def test_multiple_reports_failed_agent(self, orchestrator):
+        """Test that a failing agent is reported in tools_used without aborting the answer."""
+        orchestrator.router.route = AsyncMock(return_value={
+            "tool": "MULTIPLE", "tools": ["SQL", "WEB_SEARCH"], "confidence": 0.9
+        })
+        orchestrator._execute_sql_agent = AsyncMock(return_value={
+            "success": True, "answer": "3 разработчика", "tool": "SQL",
+            "tools_used": [{"tool_type": "sql"}], "sources": []
+        })
+        orchestrator._execute_web_search_agent = AsyncMock(side_effect=Exception("Tavily down"))
+
+        result = await orchestrator.process_query("Сколько разработчиков и какие новости?")
+
+        assert result["success"] is True
+        assert result["answer"] == "3 разработчика"
+        assert result["tools_used"][-1] == {
+            "tool_type": "web_search",
+            "query": "Сколько разработчиков и какие новости?",
+            "result_summary": "error: Tavily down"
+        }
+
+    @pytest.mark.asyncio
+    async def test_web_search_result_is_not_replayed(self, orchestrator):
+        """Test that time-sensitive web search answers bypass the result cache."""
+        orchestrator.router.route = AsyncMock(return_value={"tool": "WEB_SEARCH", "confidence": 0.9})
+        orchestrator._execute_single_agent = AsyncMock(side_effect=[
+            {"success": True, "answer": "Новость 1", "tools_used": [], "sources": []},
+            {"success": True, "answer": "Новость 2", "tools_used": [], "sources": []}
+        ])
+
+        first = await orchestrator.process_query("Последние новости")
+        second = await orchestrator.process_query("Последние новости")
+
+        assert first["answer"] == "Новость 1"
+        assert second["answer"] == "Новость 2"
+        assert len(orchestrator._result_cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_sql_result_is_cached(self, orchestrator):
+        """Test that non-web answers are served from the result cache."""
+        orchestrator.router.route = AsyncMock(return_value={"tool": "SQL", "confidence": 0.9})
+        orchestrator._execute_single_agent = AsyncMock(return_value={
+            "success": True, "answer": "3", "tools_used": [], "sources": []
+        })
+
+        await orchestrator.process_query("Сколько разработчиков?")
+        cached = await orchestrator.process_query("  сколько   разработчиков? ")
+
+        assert cached["answer"] == "3"
+        orchestrator._execute_single_agent.assert_awaited_once()
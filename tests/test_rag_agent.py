@@ -1,13 +1,22 @@
 """Tests for RAG Agent."""
+import asyncio
 import pytest
 import os
+from unittest.mock import Mock, AsyncMock, patch
 from pathlib import Path
 
 from app.agents.rag_agent import RAGAgent
+from app.utils.cache import QueryCache
 from app.services.rag_service import RAGService
 from app.utils.document_loader import DocumentLoader, TextSplitter, Document
 
 
+async def _astream_chunks(parts):
+    """Emulate LLM astream yielding message chunks."""
+    for part in parts:
+        yield Mock(content=part)
+
+
 class TestDocumentLoader:
     """Tests for document loader."""
 
@@ -141,6 +150,100 @@ class TestRAGService:
             pytest.skip(f"Test skipped: {e}")
 
 
+    def test_search_max_distance(self):
+        """Test that results beyond max_distance are dropped."""
+        service = RAGService()
+        service._initialized = True
+        service.embedding_function = Mock(side_effect=lambda texts: [[float(len(t))] for t in texts])
+        service.collection = Mock()
+        service.collection.query.return_value = {
+            "ids": [["doc_0", "doc_1", "doc_2"]],
+            "documents": [["near", "middle", "far"]],
+            "metadatas": [[{}, {}, {}]],
+            "distances": [[0.1, 0.5, 0.9]]
+        }
+
+        results = service.search("query", top_k=3, max_distance=0.5)
+
+        assert [r["content"] for r in results] == ["near", "middle"]
+
+    def test_search_batch_single_embedding_call(self):
+        """Test that a list of queries is embedded and searched in one call each."""
+        service = RAGService()
+        service._initialized = True
+        service.embedding_function = Mock(side_effect=lambda texts: [[float(len(t))] for t in texts])
+        service.collection = Mock()
+        service.collection.query.return_value = {
+            "ids": [["doc_0"], ["doc_1"]],
+            "documents": [["first"], ["second"]],
+            "metadatas": [[{}], [{}]],
+            "distances": [[0.1], [0.2]]
+        }
+
+        results = service.search_batch(["PT Sandbox", "PT AI"], top_k=1)
+
+        assert [[r["content"] for r in batch] for batch in results] == [["first"], ["second"]]
+        assert service.embedding_function.call_count == 1
+        assert service.collection.query.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_asearch_batches_concurrent_queries(self):
+        """Test that concurrent searches share one collection query."""
+        service = RAGService()
+        service._initialized = True
+        service.embedding_function = Mock(side_effect=lambda texts: [[float(len(t))] for t in texts])
+        service.collection = Mock()
+        service.collection.query.return_value = {
+            "ids": [["a_0", "a_1"], ["b_0", "b_1"]],
+            "documents": [["a near", "a far"], ["b near", "b far"]],
+            "metadatas": [[{}, {}], [{}, {}]],
+            "distances": [[0.1, 0.9], [0.2, 0.3]]
+        }
+
+        first, second = await asyncio.gather(
+            service.asearch("first", top_k=2, max_distance=0.5),
+            service.asearch("second", top_k=2, max_distance=0.5)
+        )
+
+        service.collection.query.assert_called_once()
+        assert service.collection.query.call_args.kwargs["query_embeddings"] == [[5.0], [6.0]]
+        assert [r["content"] for r in first] == ["a near"]
+        assert [r["content"] for r in second] == ["b near", "b far"]
+
+
+    def test_collection_stats_cached_until_change(self):
+        """Test that collection stats are cached and reset when documents are added."""
+        service = RAGService()
+        service._initialized = True
+        service.collection = Mock()
+        service.collection.name = "documents"
+        service.collection.count.side_effect = [1, 2, 2]
+
+        assert service.get_collection_stats()["total_documents"] == 1
+        assert service.get_collection_stats()["total_documents"] == 1
+
+        version = service.get_collection_stats()["collection_version"]
+        service.add_document("new", {})
+
+        stats = service.get_collection_stats()
+        assert stats["total_documents"] == 2
+        assert stats["collection_version"] == version + 1
+
+    def test_embed_queries_cached(self):
+        """Test that repeated queries are embedded once and only misses hit the embedder."""
+        service = RAGService()
+        service._initialized = True
+        service.embedding_function = Mock(side_effect=lambda texts: [[float(len(t))] for t in texts])
+
+        first = service.embed_queries(["PT Sandbox"])
+        second = service.embed_queries(["  pt   sandbox ", "PT AI"])
+
+        assert first == [[10.0]]
+        assert second == [[10.0], [5.0]]
+        assert service.embedding_function.call_count == 2
+        assert service.embedding_function.call_args.args[0] == ["PT AI"]
+
+
 class TestRAGAgent:
     """Tests for RAG agent."""
 
@@ -159,7 +262,8 @@ class TestRAGAgent:
         except Exception as e:
             pytest.skip(f"RAG agent initialization failed: {e}")
 
-    def test_answer_question_no_documents(self, rag_agent):
+    @pytest.mark.asyncio
+    async def test_answer_question_no_documents(self, rag_agent):
         """Test answering question with no documents in collection."""
         try:
             rag_agent.initialize(load_docs=False)
@@ -167,7 +271,7 @@ class TestRAGAgent:
             # Clear collection
             rag_agent.rag_service.clear_collection()
 
-            result = rag_agent.answer_question("What is PT AI?")
+            result = await rag_agent.answer_question("What is PT AI?")
 
             assert result is not None
             assert "success" in result
@@ -175,7 +279,8 @@ class TestRAGAgent:
         except Exception as e:
             pytest.skip(f"Test skipped: {e}")
 
-    def test_answer_question_with_documents(self, rag_agent, tmp_path):
+    @pytest.mark.asyncio
+    async def test_answer_question_with_documents(self, rag_agent, tmp_path):
         """Test answering question with documents."""
         try:
             # Create test documents
@@ -199,7 +304,7 @@ It helps developers find security vulnerabilities in source code.
             rag_agent.initialize(load_docs=True, docs_directory=str(docs_dir))
 
             # Ask question
-            result = rag_agent.answer_question("What is PT Application Inspector?")
+            result = await rag_agent.answer_question("What is PT Application Inspector?")
 
             assert result is not None
             assert result.get("success") is True
@@ -226,11 +331,138 @@ It helps developers find security vulnerabilities in source code.
             pytest.skip(f"Test skipped: {e}")
 
 
+class TestQueryCache:
+    """Tests for query cache."""
+
+    def test_set_and_get(self):
+        """Test storing and retrieving a value."""
+        cache = QueryCache(max_size=2, ttl_seconds=60)
+        cache.set("key", {"answer": "value"})
+
+        assert cache.get("key") == {"answer": "value"}
+        assert cache.get("missing") is None
+
+    def test_lru_eviction(self):
+        """Test that least recently used entry is evicted."""
+        cache = QueryCache(max_size=2, ttl_seconds=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_ttl_expiration(self):
+        """Test that expired entries are not returned."""
+        cache = QueryCache(max_size=2, ttl_seconds=0)
+        cache.set("a", 1)
+
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_answer_question_uses_cache(self):
+        """Test that repeated question is served from cache."""
+        agent = RAGAgent()
+        agent._initialized = True
+        agent.rag_service = Mock()
+        agent.rag_service.asearch = AsyncMock(return_value=[
+            {"content": "PT Sandbox", "metadata": {"filename": "pt.md"}, "distance": 0.2}
+        ])
+        agent.llm = Mock()
+        agent.llm.astream = Mock(side_effect=lambda messages: _astream_chunks(["Отв", "ет"]))
+
+        first = await agent.answer_question("Что такое PT Sandbox?")
+        second = await agent.answer_question("  что такое pt sandbox?")
+
+        assert first["success"] is True
+        assert first["answer"] == "Ответ"
+        assert second == first
+        agent.rag_service.asearch.assert_awaited_once()
+        agent.llm.astream.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_answer_question_stream_events(self):
+        """Test that streaming yields sources, tokens and final result."""
+        agent = RAGAgent()
+        agent._initialized = True
+        agent.rag_service = Mock()
+        agent.rag_service.asearch = AsyncMock(return_value=[
+            {"content": "PT NAD", "metadata": {"filename": "nad.md"}, "distance": 0.1}
+        ])
+        agent.llm = Mock()
+        agent.llm.astream = Mock(side_effect=lambda messages: _astream_chunks(["PT ", "NAD"]))
+
+        events = [event async for event in agent.answer_question_stream("Что такое PT NAD?")]
+
+        assert [event["type"] for event in events] == ["sources", "token", "token", "done"]
+        assert events[0]["sources"] == ["nad.md"]
+        assert events[-1]["result"]["answer"] == "PT NAD"
+
+    @pytest.mark.asyncio
+    async def test_system_message_is_shared_and_not_mutated(self):
+        """Test that cached SystemMessage is reused across calls unchanged."""
+        from app.agents.rag_agent import _SYSTEM_MESSAGE, _SYSTEM_PROMPT
+
+        agent = RAGAgent()
+        agent._initialized = True
+        agent.rag_service = Mock()
+        agent.rag_service.asearch = AsyncMock(return_value=[
+            {"content": "PT Sandbox", "metadata": {"filename": "pt.md"}, "distance": 0.2}
+        ])
+        agent.llm = Mock()
+        agent.llm.astream = Mock(side_effect=lambda messages: _astream_chunks(["Ответ"]))
+
+        await agent.answer_question("Первый вопрос")
+        await agent.answer_question("Второй вопрос")
+
+        first_messages = agent.llm.astream.call_args_list[0][0][0]
+        second_messages = agent.llm.astream.call_args_list[1][0][0]
+        assert first_messages[0] is _SYSTEM_MESSAGE
+        assert second_messages[0] is _SYSTEM_MESSAGE
+        assert _SYSTEM_MESSAGE.content == _SYSTEM_PROMPT
+
+    def test_fit_to_token_budget_drops_least_relevant(self):
+        """Test that least relevant documents are dropped to fit token budget."""
+        agent = RAGAgent()
+        docs = [
+            {"content": "a" * 400, "metadata": {"filename": "best.md"}, "similarity": 0.9},
+            {"content": "b" * 400, "metadata": {"filename": "worst.md"}, "similarity": 0.4},
+            {"content": "c" * 400, "metadata": {"filename": "middle.md"}, "similarity": 0.6},
+        ]
+
+        with patch('app.agents.rag_agent.settings.rag_max_context_tokens', 1), \
+                patch('app.agents.rag_agent._count_tokens', side_effect=lambda text: len(text) // 100):
+            fitted = agent._fit_to_token_budget(docs)
+
+        assert [doc["metadata"]["filename"] for doc in fitted] == ["best.md"]
+
+    def test_fit_to_token_budget_tokenizes_each_document_once(self):
+        """Test that trimming does not re-tokenize the joined context per dropped document."""
+        agent = RAGAgent()
+        docs = [
+            {"content": str(i) * 400, "metadata": {"filename": f"{i}.md"}, "similarity": 1.0 - i / 10}
+            for i in range(8)
+        ]
+
+        with patch('app.agents.rag_agent.settings.rag_max_context_tokens', 10), \
+                patch('app.agents.rag_agent._count_tokens', side_effect=lambda text: len(text) // 100) as count:
+            fitted = agent._fit_to_token_budget(docs)
+
+        # One call per document plus one for the separator
+        assert count.call_count == len(docs) + 1
+        assert [doc["metadata"]["filename"] for doc in fitted] == ["0.md", "1.md"]
+        assert len(agent._format_context(fitted)) // 100 <= 10
+
+
 # Integration test with real data (skip if docs not available)
 class TestRAGIntegration:
     """Integration tests with actual documentation."""
 
-    def test_with_real_documentation(self):
+    @pytest.mark.asyncio
+    async def test_with_real_documentation(self):
         """Test RAG agent with real PT documentation."""
         docs_path = Path("./data/docs")
 
@@ -249,7 +481,7 @@ class TestRAGIntegration:
             ]
 
             for question in questions:
-                result = agent.answer_question(question)
+                result = await agent.answer_question(question)
 
                 assert result is not None
                 assert result.get("success") is True
@@ -0,0 +1,72 @@
+"""Tests for rate limit middleware."""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.rate_limit import ConcurrencyLimiter, RateLimitMiddleware
+
+
+def _create_app(rate: float, burst: int) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, rate=rate, burst=burst, path_prefixes=("/limited",))
+
+    @app.get("/limited")
+    async def limited():
+        return {"ok": True}
+
+    @app.get("/free")
+    async def free():
+        return {"ok": True}
+
+    return app
+
+
+class TestRateLimitMiddleware:
+    """Tests for the per-IP token bucket."""
+
+    def test_rejects_requests_over_burst(self):
+        """Test that requests beyond the bucket capacity get 429 with Retry-After."""
+        client = TestClient(_create_app(rate=0.001, burst=2))
+
+        statuses = [client.get("/limited").status_code for _ in range(3)]
+
+        assert statuses == [200, 200, 429]
+        response = client.get("/limited")
+        assert response.json()["error"] == "Too Many Requests"
+        assert int(response.headers["retry-after"]) >= 1
+
+    def test_other_paths_not_limited(self):
+        """Test that paths outside the prefixes are not limited."""
+        client = TestClient(_create_app(rate=0.001, burst=1))
+
+        statuses = [client.get("/free").status_code for _ in range(5)]
+
+        assert statuses == [200] * 5
+
+    def test_bucket_refills(self):
+        """Test that tokens are replenished over time."""
+        middleware = RateLimitMiddleware(app=None, rate=10.0, burst=1, path_prefixes=("/",))
+
+        assert middleware._acquire("1.2.3.4") is None
+        retry_after = middleware._acquire("1.2.3.4")
+        assert retry_after is not None and retry_after <= 0.1
+
+        tokens, updated_at = middleware._buckets["1.2.3.4"]
+        middleware._buckets["1.2.3.4"] = (tokens, updated_at - 1.0)
+        assert middleware._acquire("1.2.3.4") is None
+
+
+class TestConcurrencyLimiter:
+    """Tests for the in-flight request limiter."""
+
+    def test_rejects_over_limit_until_release(self):
+        """Test that slots are refused at the limit and become available after release."""
+        limiter = ConcurrencyLimiter(limit=2)
+
+        assert limiter.try_acquire() and limiter.try_acquire()
+        assert limiter.saturated
+        assert not limiter.try_acquire()
+
+        limiter.release()
+
+        assert limiter.try_acquire()
+        assert limiter.in_flight == 2
@@ -0,0 +1,64 @@
+"""Tests for semantic response cache."""
+import pytest
+from unittest.mock import patch
+
+from app.services.response_cache import ResponseCache
+
+
+EMBEDDINGS = {
+    "Что такое PT Sandbox?": [1.0, 0.0],
+    "Что такое PT Sandbox": [0.99, 0.01],
+    "Последние новости": [0.0, 1.0],
+}
+
+
+@pytest.fixture
+def mock_rag_service():
+    """Patch RAG service with deterministic embeddings."""
+    with patch("app.services.response_cache.rag_service") as service:
+        service._initialized = True
+        service.embed_queries = lambda texts: [EMBEDDINGS[texts[0]]]
+        yield service
+
+
+class TestResponseCache:
+    """Tests for ResponseCache."""
+
+    @pytest.mark.asyncio
+    async def test_near_duplicate_hit(self, mock_rag_service):
+        """Test that a paraphrased query returns the stored result."""
+        cache = ResponseCache()
+        result = {"success": True, "answer": "Песочница", "routing_decision": {"tool": "RAG"}}
+
+        await cache.put("Что такое PT Sandbox?", result)
+        cached = await cache.get("Что такое PT Sandbox")
+
+        assert cached == result
+        assert cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_skips_failed_and_web_results(self, mock_rag_service):
+        """Test that failed and web search results are not cached."""
+        cache = ResponseCache()
+
+        await cache.put("Что такое PT Sandbox?", {"success": False, "answer": "Ошибка"})
+        await cache.put("Последние новости", {
+            "success": True,
+            "answer": "Новости",
+            "routing_decision": {"tool": "MULTIPLE", "tools": ["RAG", "WEB_SEARCH"]}
+        })
+
+        assert await cache.get("Что такое PT Sandbox?") is None
+        assert await cache.get("Последние новости") is None
+
+    @pytest.mark.asyncio
+    async def test_no_embeddings_without_rag_service(self):
+        """Test that cache is bypassed when RAG service is not initialized."""
+        with patch("app.services.response_cache.rag_service") as service:
+            service._initialized = False
+            cache = ResponseCache()
+
+            await cache.put("Что такое PT Sandbox?", {"success": True, "answer": "x"})
+
+            assert await cache.get("Что такое PT Sandbox?") is None
+            service.embed_queries.assert_not_called()
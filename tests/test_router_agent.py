@@ -1,9 +1,11 @@
 """Tests for Router Agent."""
+import asyncio
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, AsyncMock, patch
 import json
 
 from app.agents.router_agent import RouterAgent
+from app.models.schemas import RoutingDecision
 from app.prompts.router_prompts import get_router_prompt, ROUTER_FEW_SHOT_EXAMPLES
 
 
@@ -185,6 +187,13 @@ class TestRouterAgent:
         # Should detect both SQL (сколько разработчиков) and RAG (возможности)
         assert len(tools) >= 2 or "SQL" in tools or "RAG" in tools
 
+    def test_infer_tools_single_pass_all_groups(self, router_agent):
+        """Test that one scan finds keywords of every tool in stable order."""
+        query = "СЕЙЧАС: сколько инцидентов и что такое PT Sandbox?"
+        tools = router_agent._infer_tools_from_query(query)
+
+        assert tools == ["SQL", "RAG", "WEB_SEARCH"]
+
     def test_fallback_routing_sql(self, router_agent):
         """Test fallback routing for SQL-like queries."""
         query = "Сколько продуктов в базе данных?"
@@ -207,46 +216,53 @@ class TestRouterAgent:
 
         assert result["tool"] == "RAG"
 
-    def test_route_with_mock_llm_sql(self, router_agent, mock_llm_response):
+    @pytest.mark.asyncio
+    async def test_route_with_mock_llm_sql(self, router_agent, mock_llm_response):
         """Test routing SQL query with mocked LLM."""
         with patch('app.agents.router_agent.get_llm') as mock_get_llm:
             mock_llm = Mock()
-            mock_llm.invoke.return_value = mock_llm_response("SQL", "Database query")
+            mock_llm.ainvoke = AsyncMock(return_value=mock_llm_response("SQL", "Database query"))
+            mock_llm.with_structured_output.return_value = mock_llm
             mock_get_llm.return_value = mock_llm
 
             router_agent.initialize()
-            result = router_agent.route("Сколько разработчиков?")
+            result = await router_agent.route("Сколько разработчиков?")
 
             assert result["tool"] == "SQL"
             assert result["confidence"] == 0.9
             assert "reasoning" in result
 
-    def test_route_with_mock_llm_rag(self, router_agent, mock_llm_response):
+    @pytest.mark.asyncio
+    async def test_route_with_mock_llm_rag(self, router_agent, mock_llm_response):
         """Test routing RAG query with mocked LLM."""
         with patch('app.agents.router_agent.get_llm') as mock_get_llm:
             mock_llm = Mock()
-            mock_llm.invoke.return_value = mock_llm_response("RAG", "Documentation search")
+            mock_llm.ainvoke = AsyncMock(return_value=mock_llm_response("RAG", "Documentation search"))
+            mock_llm.with_structured_output.return_value = mock_llm
             mock_get_llm.return_value = mock_llm
 
             router_agent.initialize()
-            result = router_agent.route("Что такое PT AI?")
+            result = await router_agent.route("Что такое PT AI?")
 
             assert result["tool"] == "RAG"
             assert result["confidence"] == 0.9
 
-    def test_route_with_mock_llm_web_search(self, router_agent, mock_llm_response):
+    @pytest.mark.asyncio
+    async def test_route_with_mock_llm_web_search(self, router_agent, mock_llm_response):
         """Test routing Web Search query with mocked LLM."""
         with patch('app.agents.router_agent.get_llm') as mock_get_llm:
             mock_llm = Mock()
-            mock_llm.invoke.return_value = mock_llm_response("WEB_SEARCH", "Internet search")
+            mock_llm.ainvoke = AsyncMock(return_value=mock_llm_response("WEB_SEARCH", "Internet search"))
+            mock_llm.with_structured_output.return_value = mock_llm
             mock_get_llm.return_value = mock_llm
 
             router_agent.initialize()
-            result = router_agent.route("Последние новости")
+            result = await router_agent.route("Последние новости")
 
             assert result["tool"] == "WEB_SEARCH"
 
-    def test_route_with_mock_llm_multiple(self, router_agent, mock_llm_response):
+    @pytest.mark.asyncio
+    async def test_route_with_mock_llm_multiple(self, router_agent, mock_llm_response):
         """Test routing MULTIPLE query with mocked LLM."""
         with patch('app.agents.router_agent.get_llm') as mock_get_llm:
             mock_llm = Mock()
@@ -258,26 +274,100 @@ class TestRouterAgent:
                 "confidence": 0.85,
                 "query_type": "combined"
             })
-            mock_llm.invoke.return_value = response
+            mock_llm.ainvoke = AsyncMock(return_value=response)
+            mock_llm.with_structured_output.return_value = mock_llm
             mock_get_llm.return_value = mock_llm
 
             router_agent.initialize()
-            result = router_agent.route("Сколько человек работает над PT AI и какие у него возможности?")
+            result = await router_agent.route("Сколько человек работает над PT AI и какие у него возможности?")
 
             assert result["tool"] == "MULTIPLE"
             assert "tools" in result
             assert "SQL" in result["tools"]
             assert "RAG" in result["tools"]
 
-    def test_route_handles_llm_error(self, router_agent):
+    @pytest.mark.asyncio
+    async def test_route_with_structured_output(self, router_agent):
+        """Test routing when LLM returns structured RoutingDecision."""
+        with patch('app.agents.router_agent.get_llm') as mock_get_llm:
+            structured_llm = Mock()
+            structured_llm.ainvoke = AsyncMock(return_value=RoutingDecision(
+                tool="SQL",
+                reasoning="Database query",
+                confidence=0.95,
+                query_type="count"
+            ))
+            mock_get_llm.return_value.with_structured_output.return_value = structured_llm
+
+            router_agent.initialize()
+            result = await router_agent.route("Сколько разработчиков?")
+
+            mock_get_llm.return_value.with_structured_output.assert_any_call(RoutingDecision)
+            assert result["tool"] == "SQL"
+            assert result["confidence"] == 0.95
+            assert "tools" not in result
+
+    @pytest.mark.asyncio
+    async def test_route_batches_concurrent_queries(self, router_agent):
+        """Test that concurrent queries are routed with a single LLM call."""
+        with patch('app.agents.router_agent.get_llm') as mock_get_llm:
+            mock_llm = Mock()
+            response = Mock()
+            response.content = (
+                'A[1]: {"tool": "SQL", "reasoning": "Database", "confidence": 0.9, "query_type": "count"}\n'
+                'A[2]: {"tool": "RAG", "reasoning": "Docs", "confidence": 0.8, "query_type": "docs"}'
+            )
+            mock_llm.ainvoke = AsyncMock(return_value=response)
+            mock_llm.with_structured_output.return_value = mock_llm
+            mock_get_llm.return_value = mock_llm
+
+            router_agent.initialize()
+            first, second = await asyncio.gather(
+                router_agent.route("Сколько разработчиков?"),
+                router_agent.route("Что такое PT AI?")
+            )
+
+            mock_llm.ainvoke.assert_awaited_once()
+            assert "Q[1]: Сколько разработчиков?" in mock_llm.ainvoke.call_args[0][0]
+            assert first["tool"] == "SQL"
+            assert second["tool"] == "RAG"
+
+    @pytest.mark.asyncio
+    async def test_route_semantic_cache_hit(self, router_agent, mock_llm_response):
+        """Test that near-duplicate query is served from semantic cache."""
+        embeddings = {
+            "Сколько разработчиков?": [1.0, 0.0],
+            "Сколько разработчиков ?": [0.99, 0.01],
+        }
+        with patch('app.agents.router_agent.get_llm') as mock_get_llm, \
+                patch('app.agents.router_agent.rag_service') as mock_rag_service:
+            mock_rag_service._initialized = True
+            mock_rag_service.embed_queries = lambda texts: [embeddings[texts[0]]]
+
+            mock_llm = Mock()
+            mock_llm.ainvoke = AsyncMock(return_value=mock_llm_response("SQL", "Database query"))
+            mock_llm.with_structured_output.return_value = mock_llm
+            mock_get_llm.return_value = mock_llm
+
+            router_agent.initialize()
+            first = await router_agent.route("Сколько разработчиков?")
+            second = await router_agent.route("Сколько разработчиков ?")
+
+            assert first == second
+            mock_llm.ainvoke.assert_awaited_once()
+            assert router_agent.get_cache_stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_route_handles_llm_error(self, router_agent):
         """Test routing handles LLM errors gracefully."""
         with patch('app.agents.router_agent.get_llm') as mock_get_llm:
             mock_llm = Mock()
-            mock_llm.invoke.side_effect = Exception("LLM error")
+            mock_llm.ainvoke = AsyncMock(side_effect=Exception("LLM error"))
+            mock_llm.with_structured_output.return_value = mock_llm
             mock_get_llm.return_value = mock_llm
 
             router_agent.initialize()
-            result = router_agent.route("Test query")
+            result = await router_agent.route("Test query")
 
             # Should fallback to some valid tool
             assert result["tool"] in ["SQL", "RAG", "WEB_SEARCH"]
@@ -319,13 +409,14 @@ class TestRouterAgent:
 class TestRouterAgentIntegration:
     """Integration tests with real LLM."""
 
-    def test_route_real_sql_query(self):
+    @pytest.mark.asyncio
+    async def test_route_real_sql_query(self):
         """Test routing real SQL query."""
         try:
             agent = RouterAgent(use_few_shot=True)
             agent.initialize()
 
-            result = agent.route("Сколько разработчиков работает над PT Application Inspector?")
+            result = await agent.route("Сколько разработчиков работает над PT Application Inspector?")
 
             assert result is not None
             assert "tool" in result
@@ -336,13 +427,14 @@ class TestRouterAgentIntegration:
         except Exception as e:
             pytest.skip(f"Integration test skipped: {e}")
 
-    def test_route_real_rag_query(self):
+    @pytest.mark.asyncio
+    async def test_route_real_rag_query(self):
         """Test routing real RAG query."""
         try:
             agent = RouterAgent(use_few_shot=True)
             agent.initialize()
 
-            result = agent.route("Что такое PT Sandbox и какие у него возможности?")
+            result = await agent.route("Что такое PT Sandbox и какие у него возможности?")
 
             assert result is not None
             assert result["tool"] == "RAG"
@@ -351,13 +443,14 @@ class TestRouterAgentIntegration:
         except Exception as e:
             pytest.skip(f"Integration test skipped: {e}")
 
-    def test_route_real_web_search_query(self):
+    @pytest.mark.asyncio
+    async def test_route_real_web_search_query(self):
         """Test routing real web search query."""
         try:
             agent = RouterAgent(use_few_shot=True)
             agent.initialize()
 
-            result = agent.route("Последние новости по кибербезопасности за эту неделю")
+            result = await agent.route("Последние новости по кибербезопасности за эту неделю")
 
             assert result is not None
             assert result["tool"] == "WEB_SEARCH"
@@ -366,13 +459,14 @@ class TestRouterAgentIntegration:
         except Exception as e:
             pytest.skip(f"Integration test skipped: {e}")
 
-    def test_route_real_multiple_query(self):
+    @pytest.mark.asyncio
+    async def test_route_real_multiple_query(self):
         """Test routing real multiple query."""
         try:
             agent = RouterAgent(use_few_shot=True)
             agent.initialize()
 
-            result = agent.route("Сколько человек в команде PT AI и какие у него функции?")
+            result = await agent.route("Сколько человек в команде PT AI и какие у него функции?")
 
             assert result is not None
             # Could be MULTIPLE or single tool (both acceptable)
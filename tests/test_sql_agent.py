@@ -1,11 +1,29 @@
 """Tests for SQL Agent."""
+import asyncio
+
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock
 
 from app.agents.sql_agent import SQLAgent
 from app.services.database_service import DatabaseService
 
 
+def _stream_chunks(*texts):
+    """Build a list of streamed message chunks."""
+    chunks = []
+    for text in texts:
+        chunk = MagicMock()
+        chunk.content = text
+        chunks.append(chunk)
+    return iter(chunks)
+
+
+async def _astream_chunks(*texts):
+    """Async generator of streamed message chunks."""
+    for chunk in _stream_chunks(*texts):
+        yield chunk
+
+
 class TestSQLAgent:
     """Test SQL Agent functionality."""
 
@@ -36,6 +54,9 @@ class TestSQLAgent:
             mock_response = MagicMock()
             mock_response.content = "SELECT first_name, last_name FROM team_members LIMIT 2;"
             mock.return_value.invoke.return_value = mock_response
+            mock.return_value.stream.side_effect = lambda *args, **kwargs: _stream_chunks(
+                "SELECT first_name, last_name ", "FROM team_members LIMIT 2;"
+            )
             yield mock
 
     def test_sql_extraction_with_markdown(self):
@@ -57,6 +78,66 @@ class TestSQLAgent:
         result3 = agent._extract_sql(response3)
         assert result3 == "SELECT * FROM orders"
 
+    def test_sql_extraction_with_explanation(self):
+        """Test SQL extraction when the model wraps the query in prose."""
+        agent = SQLAgent()
+
+        response = "Here is the query:\nSELECT name FROM products;\nIt lists all products."
+        assert agent._extract_sql(response) == "SELECT name FROM products"
+
+        # Unclosed code block
+        response = "```sql\nSELECT id\nFROM incidents;"
+        assert agent._extract_sql(response) == "SELECT id\nFROM incidents"
+
+    def test_render_rows_tabular(self):
+        """Test compact tab-separated rendering of query results."""
+        agent = SQLAgent()
+
+        rows = [
+            {"name": "PT Sandbox", "score": 0.123456789},
+            {"name": "PT NAD", "score": 2.0}
+        ]
+
+        assert agent._render_rows(rows) == "name\tscore\nPT Sandbox\t0.1235\nPT NAD\t2.0"
+        assert agent._render_rows([]) == ""
+
+    def test_render_value_keeps_small_floats(self):
+        """Test that small floats keep significant digits instead of rounding to zero."""
+        assert SQLAgent._render_value(3e-05) == "3e-05"
+        assert SQLAgent._render_value(0.000123456) == "0.0001235"
+        assert SQLAgent._render_value(123456.789012) == "123456.789"
+        assert SQLAgent._render_value(0.0) == "0"
+
+    def test_initialize_concurrent_calls_run_once(self, mock_db_service, mock_llm):
+        """Test that concurrent initialize() calls load the schema only once."""
+        from concurrent.futures import ThreadPoolExecutor
+
+        agent = SQLAgent()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: agent.initialize(), range(16)))
+
+        assert agent._initialized is True
+        mock_db_service.get_table_info_for_llm.assert_called_once()
+        mock_llm.assert_called_once()
+
+    def test_format_results_small_result_skips_llm(self, mock_db_service, mock_llm):
+        """Test that trivial results are rendered without calling the LLM."""
+        agent = SQLAgent()
+        agent._initialized = True
+        agent.llm = mock_llm.return_value
+        agent.db_info = mock_db_service.get_table_info_for_llm()
+
+        assert agent.format_results([{"count": 42}], "How many?") == "Ответ: 42"
+        assert agent.format_results(
+            [{"name": "PT NAD", "count": 7}], "Which product?"
+        ) == "name: PT NAD, count: 7"
+
+        rows = [{"name": "Ivan"}, {"name": "Olga"}]
+        assert agent.format_results(rows, "Who?", explain=False).startswith("Найдено 2 записей")
+
+        agent.llm.invoke.assert_not_called()
+
     def test_generate_sql(self, mock_db_service, mock_llm):
         """Test SQL generation from natural language."""
         agent = SQLAgent()
@@ -70,6 +151,58 @@ class TestSQLAgent:
         assert "SELECT" in sql.upper()
         assert "team_members" in sql.lower()
 
+    def test_generate_sql_stops_at_semicolon(self, mock_db_service, mock_llm):
+        """Test that streaming stops once the query is complete."""
+        agent = SQLAgent()
+        agent._initialized = True
+        agent.llm = mock_llm.return_value
+        agent.db_info = mock_db_service.get_table_info_for_llm()
+
+        chunks = _stream_chunks("SELECT id FROM products;", " This query returns", " all product ids.")
+        agent.llm.stream.side_effect = lambda *args, **kwargs: chunks
+
+        sql = agent.generate_sql("List product ids")
+
+        assert sql == "SELECT id FROM products"
+        # Remaining explanation chunks were never consumed
+        assert len(list(chunks)) == 2
+        assert agent.llm.stream.call_args.kwargs["stop"] == [";"]
+
+    def test_generate_sql_cached(self, mock_db_service, mock_llm):
+        """Test that repeated questions reuse the generated SQL."""
+        agent = SQLAgent()
+        agent._initialized = True
+        agent.llm = mock_llm.return_value
+        agent.db_info = mock_db_service.get_table_info_for_llm()
+
+        first = agent.generate_sql("Show me all team members")
+        second = agent.generate_sql("  show me ALL team   members ")
+
+        assert first == second
+        assert agent.llm.stream.call_count == 1
+
+        # Schema change (e.g. a migration) invalidates cached queries and the prompt
+        schema = mock_db_service.get_table_info_for_llm.return_value + "\nTable: products"
+        mock_db_service.get_table_info_for_llm.return_value = schema
+        agent.generate_sql("Show me all team members")
+        assert agent.llm.stream.call_count == 2
+        assert "Table: products" in agent.llm.stream.call_args.args[0][0].content
+
+    def test_sql_prompt_static_prefix(self, mock_db_service, mock_llm):
+        """Test that schema and rules go into a reused system message."""
+        agent = SQLAgent()
+        agent._initialized = True
+        agent.llm = mock_llm.return_value
+        agent.db_info = mock_db_service.get_table_info_for_llm()
+
+        first = agent._create_sql_prompt("Show me all team members")
+        second = agent._create_sql_prompt("How many products?")
+
+        assert first[0] is second[0]
+        assert "team_members" in first[0].content
+        assert "How many products?" in second[1].content
+        assert "team_members" not in second[1].content
+
     def test_execute_query_success(self, mock_db_service, mock_llm):
         """Test successful query execution."""
         agent = SQLAgent()
@@ -94,9 +227,7 @@ class TestSQLAgent:
         # Mock invalid query
         mock_db_service.validate_query.return_value = (False, "DELETE not allowed")
 
-        mock_response = MagicMock()
-        mock_response.content = "DELETE FROM team_members;"
-        agent.llm.invoke.return_value = mock_response
+        agent.llm.stream.side_effect = lambda *args, **kwargs: _stream_chunks("DELETE FROM team_members;")
 
         result = agent.execute_query("Delete all team members", validate=True)
 
@@ -104,6 +235,81 @@ class TestSQLAgent:
         assert "not allowed" in result["error"].lower()
 
 
+    @pytest.mark.asyncio
+    async def test_execute_and_format(self, mock_db_service, mock_llm):
+        """Test async SQL generation, execution and answer formatting."""
+        agent = SQLAgent()
+        agent._initialized = True
+        agent.llm = mock_llm.return_value
+        agent.db_info = mock_db_service.get_table_info_for_llm()
+
+        agent.llm.astream = lambda *args, **kwargs: _astream_chunks(
+            "SELECT first_name, last_name FROM team_members LIMIT 2;"
+        )
+        answer_response = MagicMock()
+        answer_response.content = "Ivan Petrov and Olga Sidorova"
+        agent.llm.ainvoke = AsyncMock(return_value=answer_response)
+
+        result = await agent.execute_and_format("Show me all team members")
+
+        assert result["success"] is True
+        assert result["row_count"] == 2
+        assert result["answer"] == "Ivan Petrov and Olga Sidorova"
+        agent.llm.invoke.assert_not_called()
+
+
+    @pytest.mark.asyncio
+    async def test_agenerate_sql_batches_concurrent_questions(self, mock_db_service, mock_llm):
+        """Test that concurrent questions are sent to the LLM as one batch."""
+        agent = SQLAgent()
+        agent._initialized = True
+        agent.llm = mock_llm.return_value
+        agent.db_info = mock_db_service.get_table_info_for_llm()
+
+        first = MagicMock()
+        first.content = "SELECT COUNT(*) FROM team_members;"
+        second = MagicMock()
+        second.content = "SELECT COUNT(*) FROM products;"
+        agent.llm.abatch = AsyncMock(return_value=[first, second])
+
+        results = await asyncio.gather(
+            agent.agenerate_sql("How many team members?"),
+            agent.agenerate_sql("How many products?")
+        )
+
+        assert results == ["SELECT COUNT(*) FROM team_members", "SELECT COUNT(*) FROM products"]
+        agent.llm.abatch.assert_awaited_once()
+        assert len(agent.llm.abatch.call_args.args[0]) == 2
+
+    @pytest.mark.asyncio
+    async def test_full_batch_is_flushed_without_window(self, mock_db_service, mock_llm):
+        """Test that a full batch is processed at once and its task is retained."""
+        agent = SQLAgent()
+        agent._initialized = True
+        agent.llm = mock_llm.return_value
+        agent.db_info = mock_db_service.get_table_info_for_llm()
+        agent._batcher.window_ms = 10_000
+
+        responses = []
+        for i in range(agent.MAX_BATCH_SIZE):
+            response = MagicMock()
+            response.content = f"SELECT {i};"
+            responses.append(response)
+        agent.llm.abatch = AsyncMock(return_value=responses)
+
+        requests = [
+            asyncio.create_task(agent._request_sql(f"Question {i}"))
+            for i in range(agent.MAX_BATCH_SIZE)
+        ]
+        await asyncio.sleep(0)
+        assert agent._batcher._tasks
+
+        results = await asyncio.wait_for(asyncio.gather(*requests), timeout=1)
+
+        assert results == [f"SELECT {i}" for i in range(agent.MAX_BATCH_SIZE)]
+        agent.llm.abatch.assert_awaited_once()
+
+
 class TestDatabaseService:
     """Test Database Service."""
 
@@ -138,6 +344,31 @@ class TestDatabaseService:
         assert is_valid is False
         assert "multiple" in msg.lower() or "EXEC" in msg
 
+    def test_validate_query_stored_procedure_prefix(self):
+        """Test that stored procedure calls are blocked but similar column names are not."""
+        service = DatabaseService()
+
+        is_valid, msg = service.validate_query("SELECT * FROM master..xp_cmdshell ('dir')")
+        assert is_valid is False
+        assert "xp_" in msg
+
+        is_valid, msg = service.validate_query("SELECT sp_executesql(N'SELECT 1')")
+        assert is_valid is False
+        assert "sp_" in msg
+
+        is_valid, msg = service.validate_query("SELECT resp_time, wsp_id FROM incidents;")
+        assert is_valid is True, f"Query was blocked incorrectly: {msg}"
+
+    def test_validate_query_procedure_like_columns_allowed(self):
+        """Test that identifiers with sp_/xp_ prefixes pass when they are not called."""
+        service = DatabaseService()
+
+        is_valid, msg = service.validate_query("SELECT sp_name, xp_total FROM procedures ORDER BY sp_name;")
+        assert is_valid is True, f"Query was blocked incorrectly: {msg}"
+
+        is_valid, msg = service.validate_query("SELECT COUNT(sp_name) FROM procedures;")
+        assert is_valid is True, f"Query was blocked incorrectly: {msg}"
+
     def test_validate_query_with_created_at(self):
         """Test that queries with created_at column pass validation."""
         service = DatabaseService()
@@ -213,6 +444,100 @@ class TestDatabaseService:
         assert is_valid is False
         assert "empty" in msg.lower()
 
+    def test_table_info_cached_until_schema_changes(self, tmp_path):
+        """Test that table info is reused until DDL changes the schema."""
+        from sqlalchemy import create_engine, text
+
+        service = DatabaseService()
+        service.engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        service._initialized = True
+
+        with service.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR(50))"))
+
+        with patch.object(service, "_build_table_info", wraps=service._build_table_info) as build, \
+                patch.object(service, "schema_fingerprint", wraps=service.schema_fingerprint) as fingerprint, \
+                patch("app.services.database_service.settings.db_schema_check_ttl_seconds", 3600), \
+                patch("app.services.database_service.settings.db_schema_cache_dir", None):
+            first = service.get_table_info_for_llm()
+            second = service.get_table_info_for_llm()
+
+            assert first == second
+            assert "Table: products" in first
+            assert build.call_count == 1
+            # Fingerprint is not re-checked within the TTL
+            assert fingerprint.call_count == 1
+
+            with service.engine.begin() as conn:
+                conn.execute(text("CREATE TABLE incidents (id INTEGER PRIMARY KEY)"))
+
+            assert service.get_table_info_for_llm() == first
+
+            with patch("app.services.database_service.settings.db_schema_check_ttl_seconds", 0):
+                third = service.get_table_info_for_llm()
+                fourth = service.get_table_info_for_llm()
+
+            assert "Table: incidents" in third
+            assert fourth == third
+            assert build.call_count == 2
+            assert fingerprint.call_count == 3
+
+    def test_table_info_disk_cache_survives_restart(self, tmp_path):
+        """Test that a new process reuses the private on-disk schema description."""
+        import stat
+        from sqlalchemy import create_engine, text
+
+        db_url = f"sqlite:///{tmp_path / 'test.db'}"
+        cache_dir = tmp_path / "schema_cache"
+
+        def make_service():
+            service = DatabaseService()
+            service.engine = create_engine(db_url)
+            service._initialized = True
+            return service
+
+        with create_engine(db_url).begin() as conn:
+            conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY)"))
+
+        with patch("app.services.database_service.settings.db_schema_cache_dir", str(cache_dir)):
+            first = make_service().get_table_info_for_llm()
+
+            cache_files = list(cache_dir.glob("schema_*.txt"))
+            assert len(cache_files) == 1
+            assert stat.S_IMODE(cache_dir.stat().st_mode) == 0o700
+            assert stat.S_IMODE(cache_files[0].stat().st_mode) == 0o600
+
+            restarted = make_service()
+            with patch.object(restarted, "_build_table_info") as build:
+                assert restarted.get_table_info_for_llm() == first
+                build.assert_not_called()
+
+            with restarted.engine.begin() as conn:
+                conn.execute(text("CREATE TABLE incidents (id INTEGER PRIMARY KEY)"))
+
+            assert "Table: incidents" in make_service().get_table_info_for_llm()
+            # The superseded fingerprint file is removed
+            assert len(list(cache_dir.glob("schema_*.txt"))) == 1
+
+    def test_iter_query_yields_chunks(self, tmp_path):
+        """Test that query results are streamed in chunks and collected by execute_query."""
+        from sqlalchemy import create_engine, text
+
+        service = DatabaseService()
+        service.engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        service._initialized = True
+
+        with service.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR(50))"))
+            conn.execute(text("INSERT INTO products (name) VALUES ('a'), ('b'), ('c')"))
+
+        chunks = list(service.iter_query("SELECT name FROM products ORDER BY id", chunk_size=2))
+
+        assert chunks == [[{"name": "a"}, {"name": "b"}], [{"name": "c"}]]
+        assert service.execute_query("SELECT name FROM products ORDER BY id") == [
+            {"name": "a"}, {"name": "b"}, {"name": "c"}
+        ]
+
     def test_validate_query_with_joins(self):
         """Test that SELECT with JOINs passes validation."""
         service = DatabaseService()
@@ -1,6 +1,6 @@
 """Tests for Web Search Agent."""
 import pytest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch, MagicMock
 
 from app.agents.web_search_agent import WebSearchAgent
 from app.services.search_service import SearchService
@@ -144,6 +144,87 @@ class TestWebSearchAgent:
         assert len(result["sources"]) > 0
         assert result["search_results"] == 1
 
+    @pytest.mark.asyncio
+    @patch('app.agents.web_search_agent.search_service')
+    @patch('app.agents.web_search_agent.get_llm')
+    async def test_asearch_and_answer(self, mock_get_llm, mock_search_service, web_search_agent):
+        """Test async search and answer generation."""
+        mock_search_service._initialized = True
+        mock_search_service.asearch = AsyncMock(return_value=[
+            {
+                "title": "Test Article",
+                "url": "https://example.com",
+                "content": "Test content about the question",
+                "score": 0.9
+            }
+        ])
+
+        mock_llm_instance = MagicMock()
+        mock_response = MagicMock()
+        mock_response.content = "Generated answer based on search results"
+        mock_llm_instance.ainvoke = AsyncMock(return_value=mock_response)
+        mock_get_llm.return_value = mock_llm_instance
+
+        web_search_agent.initialize()
+        result = await web_search_agent.asearch_and_answer("test question")
+
+        assert result["success"] is True
+        assert result["answer"] == "Generated answer based on search results"
+        assert result["search_results"] == 1
+        mock_llm_instance.invoke.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch('app.agents.web_search_agent.search_service')
+    @patch('app.agents.web_search_agent.get_llm')
+    async def test_asearch_and_answer_falls_back_to_tavily(self, mock_get_llm, mock_search_service, web_search_agent):
+        """Test that an LLM failure falls back to the Tavily summary."""
+        mock_search_service._initialized = True
+        mock_search_service.asearch = AsyncMock(return_value=[
+            {
+                "title": "Test Article",
+                "url": "https://example.com",
+                "content": "Test content",
+                "score": 0.5,
+                "tavily_answer": "Tavily summary"
+            }
+        ])
+
+        mock_llm_instance = MagicMock()
+        mock_llm_instance.ainvoke = AsyncMock(side_effect=RuntimeError("LLM down"))
+        mock_get_llm.return_value = mock_llm_instance
+
+        web_search_agent.initialize()
+        result = await web_search_agent.asearch_and_answer("test question")
+
+        assert result["success"] is True
+        assert result["answer"] == "На основе поиска: Tavily summary"
+        assert result["sources"] == ["Test Article (https://example.com)"]
+
+    @patch('app.agents.web_search_agent.search_service')
+    @patch('app.agents.web_search_agent.get_llm')
+    def test_search_and_answer_uses_confident_tavily_answer(self, mock_get_llm, mock_search_service, web_search_agent):
+        """Test that a high-confidence Tavily answer is returned without calling the LLM."""
+        mock_search_service._initialized = True
+        mock_search_service.search.return_value = [
+            {
+                "title": "Test Article",
+                "url": "https://example.com",
+                "content": "Test content",
+                "score": 0.95,
+                "tavily_answer": "Tavily summary"
+            }
+        ]
+        mock_llm_instance = MagicMock()
+        mock_get_llm.return_value = mock_llm_instance
+
+        web_search_agent.initialize()
+        result = web_search_agent.search_and_answer("test question")
+
+        assert result["success"] is True
+        assert result["answer"] == "Tavily summary"
+        assert result["sources"] == ["Test Article (https://example.com)"]
+        mock_llm_instance.invoke.assert_not_called()
+
     @patch('app.agents.web_search_agent.search_service')
     def test_search_and_answer_no_results(self, mock_search_service, web_search_agent):
         """Test when search returns no results."""
@@ -212,6 +293,51 @@ class TestWebSearchAgent:
         assert "https://example.com/1" in context
         assert "Content 1" in context
 
+    def test_format_search_context_truncates_content(self, web_search_agent):
+        """Test that long result content is capped before reaching the LLM."""
+        results = [
+            {
+                "title": "Long Article",
+                "url": "https://example.com/long",
+                "content": "x" * 5000,
+                "score": 0.9
+            }
+        ]
+
+        context = web_search_agent._format_search_context(results, snippet_chars=100)
+
+        assert "x" * 100 in context
+        assert "x" * 101 not in context
+
+    def test_select_relevant_drops_low_scores(self, web_search_agent):
+        """Test that low-relevance results are dropped but the Tavily summary is kept."""
+        results = [
+            {"title": "Weak", "url": "https://example.com/1", "score": 0.1, "tavily_answer": "Summary"},
+            {"title": "Strong", "url": "https://example.com/2", "score": 0.8}
+        ]
+
+        selected = web_search_agent._select_relevant(results, min_score=0.3)
+
+        assert [r["title"] for r in selected] == ["Strong"]
+        assert selected[0]["tavily_answer"] == "Summary"
+
+        # The best result is kept even if everything is below the threshold
+        selected = web_search_agent._select_relevant(results, min_score=0.9)
+        assert [r["title"] for r in selected] == ["Strong"]
+
+    def test_format_and_extract_single_pass(self, web_search_agent):
+        """Test that context and sources built together match the separate helpers."""
+        results = [
+            {"title": "Article 1", "url": "https://example.com/1", "content": "Content 1", "score": 0.9},
+            {"title": "Article 2", "url": "", "content": "Content 2", "score": 0.8}
+        ]
+
+        context, sources = web_search_agent._format_and_extract(results)
+
+        assert context == web_search_agent._format_search_context(results)
+        assert sources == web_search_agent._extract_sources(results)
+        assert sources == ["Article 1 (https://example.com/1)"]
+
     def test_extract_sources(self, web_search_agent):
         """Test extracting sources from results."""
         results = [